@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# python
+import threading
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant
+from pyrant.batch import BatchLoader
+from pyrant.cache import RecordCache
+from pyrant.pool import TyrantPool
+from pyrant.server import TyrantServer
+
+
+def run_threads(count, func):
+    results = [None] * count
+    def run(i):
+        try:
+            results[i] = func(i)
+        except Exception, e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in xrange(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestBatchLoader(unittest.TestCase):
+
+    def test_batching(self):
+        loader = BatchLoader(window=0.1)
+        batches = []
+        def fetch(keys):
+            batches.append(sorted(keys))
+            return dict((k, [k]) for k in keys if k != 'missing')
+        keys = ['a', 'b', 'c', 'a', 'missing']
+        results = run_threads(5, lambda i: loader.load(keys[i], fetch))
+        assert batches == [['a', 'b', 'c', 'missing']]
+        assert results[:4] == [['a'], ['b'], ['c'], ['a']]
+        assert results[0] is not results[3]
+        assert isinstance(results[4], KeyError)
+        assert loader.stats() == {'calls': 5, 'batches': 1}
+
+    def test_max_size(self):
+        loader = BatchLoader(window=10, max_size=2)
+        sizes = []
+        def fetch(keys):
+            sizes.append(len(keys))
+            return dict((k, k) for k in keys)
+        results = run_threads(4, lambda i: loader.load(str(i), fetch))
+        assert results == ['0', '1', '2', '3']
+        assert sizes == [2, 2]
+
+    def test_error(self):
+        loader = BatchLoader(window=0.05)
+        def fetch(keys):
+            raise ValueError('broken')
+        results = run_threads(3, lambda i: loader.load(str(i), fetch))
+        assert all(isinstance(x, ValueError) for x in results)
+
+
+class TestBatchedTyrant(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer(latency=0.05).start()
+        self.pool = TyrantPool(self.server.host, self.server.port,
+                               max_size=20)
+        self.t = Tyrant(pool=self.pool, batch=BatchLoader(window=0.05),
+                        cache=RecordCache())
+        self.t.multi_set(('key%d' % i, {'n': str(i)}) for i in xrange(10))
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_get(self):
+        misc = self.server.counters.get('cnt_misc', 0)
+        gets = self.server.counters.get('cnt_get', 0)
+        results = run_threads(10, lambda i: self.t['key%d' % i])
+        assert results == [{'n': str(i)} for i in xrange(10)]
+        assert self.server.counters['cnt_misc'] - misc < 10
+        assert self.server.counters.get('cnt_get', 0) == gets
+        # the records are cached now
+        assert self.t.cache.stats()['items'] == 10
+        assert self.t.get('missing') is None
+
+    def test_non_ascii_keys(self):
+        t = Tyrant(host=self.server.host, port=self.server.port,
+                   batch=BatchLoader(window=0))
+        t['ключ'] = {'n': 'x'}
+        assert t['ключ'] == {'n': 'x'}
+        assert t[u'ключ'] == {'n': 'x'}
+        t.literal = True
+        assert t['ключ'] == {'n': 'x'}
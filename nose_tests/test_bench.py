@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol
+from pyrant import bench
+from pyrant.server import TyrantServer
+
+
+class TestBench(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+
+    def tearDown(self):
+        self.t.proto._sock.close()
+        self.server.stop()
+
+    def test_percentile(self):
+        values = range(1, 101)
+        assert bench._percentile(values, 50) == 50
+        assert bench._percentile(values, 99) == 99
+        assert bench._percentile([7], 99) == 7
+        assert bench._percentile([], 50) is None
+
+    def test_run_workloads(self):
+        seen = []
+        results = bench.run_workloads(self.t, records=50, iterations=10,
+                                      callback=seen.append)
+        assert [r['workload'] for r in results] == \
+            [w.name for w in bench.WORKLOADS]
+        assert seen == results
+        for result in results:
+            assert 0 < result['calls']
+            assert 0 < result['bytes_sent_per_call']
+            assert result['p50_ms'] <= result['p99_ms']
+        get = results[0]
+        assert get['calls'] == 10
+        assert get['bytes_received_per_call'] > 100
+        # a table record is a dictionary, ten of them are ten dictionaries
+        multi_get = results[2]
+        assert 1 <= get['objects_allocated_per_call']
+        assert (10 <= multi_get['objects_allocated_per_call'] and
+                get['objects_allocated_per_call'] <
+                multi_get['objects_allocated_per_call'])
+        assert '%9.1f obj' % get['objects_allocated_per_call'] in \
+            bench.format_result(get)
+        assert len(self.t) == 0
+
+    def test_hash_database(self):
+        server = TyrantServer(db_type=protocol.DB_HASH).start()
+        try:
+            t = Tyrant(host=server.host, port=server.port)
+            results = bench.run_workloads(t, ['get', 'query_slice_20'],
+                                          records=10, iterations=5)
+            assert [r['workload'] for r in results] == ['get']
+        finally:
+            server.stop()
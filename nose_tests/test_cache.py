@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant
+from pyrant.cache import RecordCache
+from pyrant.server import TyrantServer
+
+
+class TestRecordCache(unittest.TestCase):
+
+    def test_lru(self):
+        cache = RecordCache(max_items=2)
+        cache.set('a', u'1')
+        cache.set('b', u'2')
+        assert cache.get('a') == (True, u'1')    # 'b' is now the oldest
+        cache.set('c', u'3')
+        assert 'b' not in cache
+        assert 'a' in cache and 'c' in cache
+        assert cache.stats()['evictions'] == 1
+
+    def test_max_bytes(self):
+        cache = RecordCache(max_bytes=20)
+        cache.set('a', {u'name': u'x' * 10})
+        cache.set('b', {u'name': u'y' * 10})
+        assert len(cache) == 1
+        assert cache.stats()['bytes'] == 15
+
+    def test_ttl(self):
+        cache = RecordCache(ttl=0.05)
+        cache.set('a', u'1')
+        assert cache.get('a') == (True, u'1')
+        time.sleep(0.06)
+        assert cache.get('a') == (False, None)
+        assert cache.stats()['expirations'] == 1
+
+    def test_generation(self):
+        cache = RecordCache()
+        generation = cache.generation
+        cache.invalidate(['a'])
+        cache.set('a', u'old', generation)
+        assert 'a' not in cache
+        cache.set('a', u'new', cache.generation)
+        assert 'a' in cache
+
+    def test_copies(self):
+        cache = RecordCache()
+        value = {u'name': u'Foo'}
+        cache.set('a', value)
+        value['name'] = u'Bar'
+        found, cached = cache.get('a')
+        cached['name'] = u'Baz'
+        assert cache.get('a') == (True, {u'name': u'Foo'})
+
+
+class TestCachedTyrant(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.cache = RecordCache()
+        self.t = Tyrant(host=self.server.host, port=self.server.port,
+                        cache=self.cache)
+        self.t.multi_set([('foo', {'name': 'Foo'}), ('bar', {'name': 'Bar'})])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _gets(self):
+        return self.server.counters.get('cnt_get', 0)
+
+    def test_get(self):
+        gets = self._gets()
+        for i in xrange(10):
+            assert self.t['foo'] == {'name': 'Foo'}
+        assert self._gets() - gets == 1
+        stats = self.cache.stats()
+        assert (stats['hits'], stats['misses']) == (9, 1)
+        assert self.t.get('missing') is None
+        assert 'missing' not in self.cache
+
+    def test_invalidation(self):
+        self.t['foo']
+        self.t['foo'] = {'name': 'New'}
+        assert self.t['foo'] == {'name': 'New'}
+        del self.t['foo']
+        assert 'foo' not in self.t
+        self.t['bar']
+        self.t.multi_set({'bar': {'name': 'Bar 2'}})
+        assert self.t['bar'] == {'name': 'Bar 2'}
+        with self.t.buffered() as w:
+            w['bar'] = {'name': 'Bar 3'}
+        assert self.t['bar'] == {'name': 'Bar 3'}
+        self.t.multi_del(['bar'])
+        assert self.t.get('bar') is None
+        self.t['bar'] = {'name': 'Bar'}
+        self.t['bar']
+        self.t.clear()
+        assert len(self.cache) == 0
+
+    def test_multi_get(self):
+        self.t['foo']
+        misc = self.server.counters.get('cnt_misc', 0)
+        result = self.t.multi_get(['foo', 'missing', 'bar'])
+        assert result == [('foo', {'name': 'Foo'}), ('bar', {'name': 'Bar'})]
+        assert self.server.counters['cnt_misc'] - misc == 1
+        # everything is cached now: no request at all
+        assert self.t.multi_get(['bar', 'foo'])[0][0] == 'bar'
+        assert self.server.counters['cnt_misc'] - misc == 1
+
+    def test_non_ascii_keys(self):
+        self.t['ключ'] = {'name': 'Foo'}
+        plain = Tyrant(host=self.server.host, port=self.server.port)
+        expected = plain.multi_get(['ключ', u'ключ'])
+        assert len(expected) == 2
+        for i in xrange(2):
+            assert self.t.multi_get(['ключ', u'ключ']) == expected
+        assert u'ключ' in self.cache and 'ключ' in self.cache
+        # the same with byte strings returned as is
+        self.t.literal = plain.literal = True
+        expected = plain.multi_get(['ключ', u'ключ'])
+        assert self.t.multi_get(['ключ', u'ключ']) == expected
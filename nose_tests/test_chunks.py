@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant
+from pyrant.chunks import AdaptiveChunkSize
+from pyrant.server import TyrantServer
+
+
+class TestAdaptiveChunkSize(unittest.TestCase):
+
+    def test_target_bytes(self):
+        sizer = AdaptiveChunkSize(initial=100, target_bytes=10000)
+        for i in xrange(10):
+            sizer.observe(sizer.size, sizer.size * 1000)
+        assert sizer.size == 10
+        for i in xrange(40):
+            sizer.observe(sizer.size, sizer.size * 10)
+        assert 950 < sizer.size <= 1000
+
+    def test_gradual_change(self):
+        sizer = AdaptiveChunkSize(initial=100, target_bytes=10000)
+        sizer.observe(100, 100)
+        assert sizer.size == 200
+        sizer = AdaptiveChunkSize(initial=100, target_bytes=10000)
+        sizer.observe(100, 100 * 10000)
+        assert sizer.size == 50
+
+    def test_target_seconds(self):
+        sizer = AdaptiveChunkSize(initial=100, target_bytes=None,
+                                  target_seconds=0.1)
+        for i in xrange(30):
+            # 10 ms per round trip plus 1 ms per record
+            sizer.observe(sizer.size, 0, 0.01 + sizer.size * 0.001)
+        assert 85 <= sizer.size <= 95
+
+    def test_bounds(self):
+        sizer = AdaptiveChunkSize(initial=100, min_size=20, max_size=300)
+        for i in xrange(10):
+            sizer.observe(sizer.size, 1)
+        assert sizer.size == 300
+        for i in xrange(10):
+            sizer.observe(sizer.size, sizer.size * 10 ** 6)
+        assert sizer.size == 20
+
+
+class TestAdaptiveChunks(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        # large records first, then small ones
+        self.t.multi_set(('key%03d' % i, {'n': str(i),
+                                          'text': 'x' * (1000 if i < 50 else 1)})
+                         for i in xrange(300))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_query(self):
+        sizer = AdaptiveChunkSize(initial=10, min_size=5, target_bytes=5000)
+        q = self.t.query.order_by('n', numeric=True)
+        q.set_chunk_size(sizer)
+        items = list(q)
+        assert [int(x['n']) for k, x in items] == range(300)
+        sizes = [len(x) for x in q._cache.chunks.values()]
+        assert min(sizes) == 5
+        assert sizes[-2] > 10
+        # access by index and slices use the same boundaries
+        assert q[123] == items[123]
+        assert q[40:160] == items[40:160]
+
+    def test_iteritems(self):
+        sizer = AdaptiveChunkSize(initial=10, min_size=5, target_bytes=5000)
+        items = list(self.t.iteritems(chunk_size=sizer))
+        assert len(items) == 300
+        assert sizer.size > 10
+        assert len(list(self.t.iteritems(chunk_size=7))) == 300
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# python
+import threading
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant
+from pyrant.flight import SingleFlight
+from pyrant.pool import TyrantPool
+from pyrant.server import TyrantServer
+
+
+def run_threads(count, func):
+    results = [None] * count
+    def run(i):
+        try:
+            results[i] = func()
+        except Exception, e:
+            results[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in xrange(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_shared_result(self):
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        def slow():
+            started.set()
+            release.wait()
+            return [1, 2]
+        leader = threading.Thread(target=flight.do, args=('a', slow))
+        leader.start()
+        started.wait()
+        # another key is not affected
+        assert flight.do('b', lambda: 3) == 3
+        timer = threading.Timer(0.05, release.set)
+        timer.start()
+        results = run_threads(5, lambda: flight.do('a', slow))
+        leader.join()
+        assert results == [[1, 2]] * 5
+        assert results[0] is not results[1]    # each waiter gets a copy
+        assert flight.stats() == {'calls': 2, 'shared': 5, 'in_flight': 0}
+
+    def test_shared_error(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        def fail():
+            release.wait()
+            raise KeyError('a')
+        timer = threading.Timer(0.05, release.set)
+        timer.start()
+        results = run_threads(5, lambda: flight.do('a', fail))
+        assert all(isinstance(x, KeyError) for x in results)
+        assert flight.stats()['in_flight'] == 0
+
+
+class TestCoalescedReads(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer(latency=0.1).start()
+        self.pool = TyrantPool(self.server.host, self.server.port,
+                               max_size=20)
+        self.t = Tyrant(pool=self.pool, flight=SingleFlight())
+        self.t.multi_set([('foo', {'name': 'Foo'}), ('bar', {'name': 'Bar'})])
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def test_get(self):
+        gets = self.server.counters.get('cnt_get', 0)
+        results = run_threads(10, lambda: self.t['foo'])
+        assert results == [{'name': 'Foo'}] * 10
+        assert self.server.counters['cnt_get'] - gets < 10
+        assert 0 < self.t.flight.stats()['shared']
+
+        results = run_threads(10, lambda: self.t.get('missing'))
+        assert results == [None] * 10
+
+    def test_query(self):
+        search = lambda: list(self.t.query.filter(name__startswith='F')[:])
+        misc = self.server.counters.get('cnt_misc', 0)
+        results = run_threads(10, search)
+        assert results == [[('foo', {'name': 'Foo'})]] * 10
+        assert self.server.counters['cnt_misc'] - misc < 10
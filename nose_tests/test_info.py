@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import protocol
+from pyrant.info import ServerInfo
+
+
+STAT = (u'version\t1.1.41\ntype\ttable\npath\t/tmp/test.tct\nrnum\t12\n'
+        u'size\t4096\nmhost\t\nmport\t0\ndelay\t0.25\nrts\t1262300000000000\n')
+
+
+class DummyProtocol(object):
+    "Counts calls of the `stat` command."
+
+    def __init__(self):
+        self.calls = 0
+
+    def stat(self):
+        self.calls += 1
+        return STAT
+
+
+class TestServerInfo(unittest.TestCase):
+
+    def setUp(self):
+        self.proto = DummyProtocol()
+
+    def test_lazy_fetch(self):
+        info = ServerInfo(self.proto)
+        assert self.proto.calls == 0
+        assert info.db_type == protocol.DB_TABLE
+        assert info.path == u'/tmp/test.tct'
+        assert info.rnum == 12
+        assert self.proto.calls == 1
+
+    def test_typed_values(self):
+        info = ServerInfo(self.proto)
+        assert info.size == 4096
+        assert info.version == u'1.1.41'
+        assert info.master_host is None
+        assert info.master_port is None
+        assert info.replication_delay == 0.25
+        assert info.replication_timestamp == 1262300000000000
+        assert info.stats['rnum'] == u'12'
+
+    def test_refresh(self):
+        info = ServerInfo(self.proto)
+        info.rnum
+        assert info.refresh() is info
+        assert self.proto.calls == 2
+        info.rnum
+        assert self.proto.calls == 2
+
+    def test_ttl(self):
+        info = ServerInfo(self.proto, ttl=0.05)
+        info.rnum
+        info.rnum
+        assert self.proto.calls == 1
+        time.sleep(0.06)
+        info.rnum
+        assert self.proto.calls == 2
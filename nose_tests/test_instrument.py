@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol, exceptions
+from pyrant.instrument import Collector, Histogram
+from pyrant.pool import TyrantPool
+from pyrant.server import TyrantServer
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        h = Histogram()
+        assert h.percentile(50) is None
+        for i in xrange(1, 1001):
+            h.add(i / 1000.0)
+        assert h.count == 1000
+        assert h.min == 0.001 and h.max == 1.0
+        assert abs(h.percentile(50) - 0.5) < 0.5 * 0.05
+        assert abs(h.percentile(99) - 0.99) < 0.99 * 0.05
+        assert h.percentile(100) == 1.0
+        assert abs(h.mean - 0.5005) < 1e-9
+
+    def test_constant_memory(self):
+        h = Histogram()
+        size = len(h.buckets)
+        for value in 0, 1e-9, 1e-3, 1e9:
+            h.add(value)
+        assert len(h.buckets) == size
+        assert h.percentile(100) == 1e9
+
+    def test_merge(self):
+        a, b = Histogram(), Histogram()
+        a.add(0.1)
+        b.add(0.2)
+        b.add(0.3)
+        a.merge(b)
+        assert a.count == 3
+        assert a.min == 0.1 and a.max == 0.3
+
+
+class TestCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.events = []
+        self.collector = Collector(callbacks=[self.events.append])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _connect(self):
+        return protocol.TyrantProtocol(self.server.host, self.server.port,
+                                       instrument=self.collector)
+
+    def test_commands(self):
+        p = self._connect()
+        p.put('foo', 'name\x00Foo')
+        p.get('foo')
+        self.assertRaises(exceptions.InvalidOperation, p.get, 'bar')
+        p.search([])
+        report = self.collector.report()
+        assert sorted(report) == ['get', 'put', 'search']
+        assert report['get']['calls'] == 2
+        assert report['get']['errors'] == 1
+        assert report['get']['code'] == protocol.TyrantProtocol.GET
+        assert report['put']['bytes_sent'] == 2 + 8 + 3 + 8
+        assert report['put']['bytes_received'] == 1
+        assert report['search']['code'] == protocol.TyrantProtocol.MISC
+        assert report['get']['wait']['count'] == 2
+        assert [e.name for e in self.events] == ['put', 'get', 'get', 'search']
+        assert 0 <= self.events[0].wait
+
+    def test_misc_and_streams(self):
+        p = self._connect()
+        p.misc('putlist', ['a', 'x\x00y', 'b', 'x\x00z'])
+        assert len(list(p.iter_misc('getlist', ['a', 'b']))) == 4
+        report = self.collector.report()
+        assert sorted(report) == ['iter_misc:getlist', 'misc:putlist']
+        assert report['iter_misc:getlist']['bytes_received'] > 20
+
+    def test_pipeline(self):
+        p = self._connect()
+        with p.pipeline() as pipe:
+            pipe.put('foo', 'a\x00b')
+            pipe.get('foo')
+        assert pipe.results == [None, u'a\x00b']
+        report = self.collector.report()
+        assert list(report) == ['pipeline']
+        assert report['pipeline']['calls'] == 1
+        assert report['pipeline']['code'] is None
+
+    def test_pool(self):
+        pool = TyrantPool(self.server.host, self.server.port,
+                          instrument=self.collector)
+        t = Tyrant(pool=pool)
+        t['foo'] = {'name': 'Foo'}
+        assert t['foo'] == {'name': 'Foo'}
+        assert 'misc:put' in self.collector.report()
+
+    def test_disabled(self):
+        p = protocol.TyrantProtocol(self.server.host, self.server.port)
+        assert type(p) is protocol.TyrantProtocol
+        assert type(p._sock._sock).__name__ != '_MeteredSocket'
+        p.rnum()
+        assert not self.collector.report()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# python
+import threading
+import uuid
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol
+from pyrant.keys import (GenuidAllocator, CounterAllocator,
+                         TimeOrderedAllocator)
+from pyrant.server import TyrantServer
+
+
+class TestAllocators(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.p = protocol.TyrantProtocol(self.server.host, self.server.port)
+
+    def tearDown(self):
+        self.p._sock.close()
+        self.server.stop()
+
+    def test_genuid(self):
+        allocator = GenuidAllocator(self.p)
+        requests = self.server.counters.get('requests', 0)
+        assert allocator.allocate(3) == [u'1', u'2', u'3']
+        assert allocator.allocate(1) == [u'4']
+        assert allocator.allocate(0) == []
+        assert self.server.counters['requests'] - requests == 4
+
+    def test_genuid_fallback(self):
+        server = TyrantServer(db_type=protocol.DB_HASH).start()
+        try:
+            p = protocol.TyrantProtocol(server.host, server.port)
+            keys = GenuidAllocator(p).allocate(2)
+            assert all(isinstance(k, uuid.UUID) for k in keys)
+            assert keys[0] != keys[1]
+        finally:
+            server.stop()
+
+    def test_generate_key(self):
+        t = Tyrant(host=self.server.host, port=self.server.port)
+        assert t.generate_key() == u'1'
+        # a single key comes from TyrantProtocol.genuid, so the UUID fallback
+        # can be faked by monkey-patching it
+        def fake_genuid():
+            raise ValueError
+        t.proto.genuid = fake_genuid
+        assert isinstance(t.generate_key(), uuid.UUID)
+
+    def test_counter(self):
+        allocator = CounterAllocator(self.p, chunk_size=10, prefix=u'k')
+        assert allocator.allocate(3) == [u'k1', u'k2', u'k3']
+        assert allocator.allocate(9) == [u'k%d' % i for i in xrange(4, 13)]
+        # another allocator sharing the counter gets a different range
+        other = CounterAllocator(self.p, chunk_size=10, prefix=u'k')
+        assert other.allocate(1) == [u'k21']
+        assert self.p.getint(u'_pyrant_key_counter') == 30
+
+    def test_time_ordered(self):
+        allocator = TimeOrderedAllocator()
+        keys = allocator.allocate(5000)
+        assert len(set(keys)) == 5000
+        assert keys == sorted(keys)
+        assert all(len(k) == 24 for k in keys)
+        assert TimeOrderedAllocator().allocate(1)[0][16:] != keys[0][16:]
+
+    def test_time_ordered_threads(self):
+        allocator = TimeOrderedAllocator()
+        keys = []
+        def run():
+            keys.extend(allocator.allocate(1000))
+        threads = [threading.Thread(target=run) for i in xrange(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(keys)) == 4000
+
+
+class TestMultiAdd(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_round_trips(self):
+        t = Tyrant(host=self.server.host, port=self.server.port)
+        t.get_stats()
+        requests = self.server.counters['requests']
+        keys = t.multi_add(({'n': str(i)} for i in xrange(25)), chunk_size=10)
+        assert keys == [unicode(i) for i in xrange(1, 26)]
+        # three chunks: a genuid pipeline and a putlist each
+        assert self.server.counters['requests'] - requests == 25 + 3
+        assert t[u'25'] == {'n': '24'}
+        assert t.generate_key() == u'26'
+
+    def test_allocator(self):
+        t = Tyrant(host=self.server.host, port=self.server.port,
+                   key_allocator=TimeOrderedAllocator())
+        keys = t.multi_add([{'n': str(i)} for i in xrange(5)], chunk_size=0)
+        assert len(t) == 5
+        assert [t[k]['n'] for k in keys] == [str(i) for i in xrange(5)]
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+import urllib2
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import protocol
+from pyrant.instrument import Collector
+from pyrant.metrics import MetricsExporter
+from pyrant.server import TyrantServer
+
+
+class TestMetricsExporter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.collector = Collector()
+        self.p = protocol.TyrantProtocol(self.server.host, self.server.port,
+                                         instrument=self.collector)
+        self.exporter = MetricsExporter(self.server.host, self.server.port,
+                                        collector=self.collector,
+                                        namespace='tt')
+
+    def tearDown(self):
+        self.exporter.stop()
+        self.p._sock.close()
+        self.server.stop()
+
+    def test_poll(self):
+        assert self.exporter.poll()
+        proto = self.exporter._proto
+        assert self.exporter.stats['records'] == 0
+        assert not self.exporter.rates
+        self.p.put('foo', 'a\x00b')
+        self.p.put('bar', 'a\x00b')
+        self.exporter.polled_at -= 1    # as if a second has passed
+        assert self.exporter.poll()
+        # the connection is reused
+        assert self.exporter._proto is proto
+        assert self.exporter.stats['records'] == 2
+        assert 1.5 < self.exporter.rates['records_per_second'] < 2.5
+        assert 1.5 < self.exporter.rates['ops_put_per_second'] < 2.5
+
+    def test_render(self):
+        self.p.put('foo', 'a\x00b')
+        self.p.get('foo')
+        self.exporter.poll()
+        text = self.exporter.render()
+        server = 'server="%s:%s"' % (self.server.host, self.server.port)
+        assert 'tt_up{%s} 1' % server in text
+        assert 'tt_records{%s} 1' % server in text
+        assert '# TYPE tt_client_wait_seconds summary' in text
+        assert 'tt_client_calls_total{command="get"} 1' in text
+        assert 'tt_client_wait_seconds_count{command="put"} 1' in text
+        assert 'tt_client_wait_seconds{command="get",quantile="0.99"}' in text
+
+    def test_server_down(self):
+        self.exporter.poll()
+        self.server.stop()
+        assert not self.exporter.poll()
+        assert 'tt_up{server="%s:%s"} 0' % (self.server.host,
+                                             self.server.port) \
+            in self.exporter.render()
+        assert self.exporter.errors == 1
+
+    def test_background(self):
+        self.exporter.interval = 0.01
+        self.exporter.start()
+        host, port = self.exporter.serve('127.0.0.1', 0)
+        deadline = time.time() + 5
+        while self.exporter.stats is None and time.time() < deadline:
+            time.sleep(0.01)
+        text = urllib2.urlopen('http://%s:%s/metrics' % (host, port)).read()
+        assert 'tt_up' in text and 'tt_records' in text
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# python
+import socket
+import struct
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import protocol, exceptions
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    Checks pipelined requests and responses against a fake server which
+    sends canned bytes.
+    """
+
+    def setUp(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        host, port = listener.getsockname()
+        self.p = protocol.TyrantProtocol(host, port)
+        self.peer, _ = listener.accept()
+        listener.close()
+
+    def tearDown(self):
+        self.peer.close()
+
+    def _received(self, size):
+        data = ''
+        while len(data) < size:
+            data += self.peer.recv(size - len(data))
+        return data
+
+    def test_execute(self):
+        pipe = self.p.pipeline()
+        pipe.put('foo', u'bär')
+        pipe.get('foo')
+        pipe.get('quux')
+        pipe.rnum()
+        pipe.misc('getlist', ['foo'])
+        assert len(pipe) == 5
+
+        self.peer.sendall('\x00' +
+                          '\x00' + struct.pack('>I', 4) + u'bär'.encode('utf-8') +
+                          '\x01' +
+                          '\x00' + struct.pack('>Q', 1) +
+                          '\x00' + struct.pack('>I', 2) +
+                          struct.pack('>I', 3) + 'foo' +
+                          struct.pack('>I', 1) + 'x')
+        results = pipe.execute()
+
+        expected = ''.join([
+            protocol._pack(protocol.TyrantProtocol.PUT, 3, 4, 'foo', u'bär'),
+            protocol._pack(protocol.TyrantProtocol.GET, 3, 'foo'),
+            protocol._pack(protocol.TyrantProtocol.GET, 4, 'quux'),
+            protocol._pack(protocol.TyrantProtocol.RNUM),
+            protocol._pack(protocol.TyrantProtocol.MISC, 7, 0, 1, 'getlist', ['foo']),
+        ])
+        assert self._received(len(expected)) == expected
+
+        assert results[:2] == [None, u'bär']
+        assert isinstance(results[2], exceptions.InvalidOperation)
+        assert results[3:] == [1, [u'foo', u'x']]
+        assert pipe.results == results
+        assert len(pipe) == 0
+
+    def test_context_manager(self):
+        self.peer.sendall('\x00' + struct.pack('>I', 3) +
+                          '\x00' + struct.pack('>I', 5))
+        pipe = self.p.pipeline()
+        pipe.__enter__()
+        pipe.addint('a', 3)
+        pipe.addint('b', 5)
+        pipe.__exit__(None, None, None)
+        assert pipe.results == [3, 5]
+
+    def test_invalid_arguments(self):
+        pipe = self.p.pipeline()
+        self.assertRaises(TypeError, lambda: pipe.mget(9))
+        self.assertRaises(AttributeError, lambda: pipe.pipeline)
+        assert len(pipe) == 0
+        assert pipe.execute() == []
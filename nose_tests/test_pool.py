@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+# python
+import socket
+import threading
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import exceptions, protocol
+from pyrant.pool import TyrantPool
+
+
+class TestTyrantPool(unittest.TestCase):
+    """
+    Checks pool mechanics against a fake server which only accepts
+    connections.
+    """
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(50)
+        self.host, self.port = self.listener.getsockname()
+        self.peers = []
+        def accept():
+            while True:
+                try:
+                    peer, _ = self.listener.accept()
+                except socket.error:
+                    break
+                self.peers.append(peer)
+        self.acceptor = threading.Thread(target=accept)
+        self.acceptor.setDaemon(True)
+        self.acceptor.start()
+
+    def tearDown(self):
+        self.listener.close()
+        for peer in self.peers:
+            peer.close()
+
+    def _pool(self, **kwargs):
+        return TyrantPool(self.host, self.port, **kwargs)
+
+    def _in_thread(self, func):
+        result = []
+        def inner():
+            try:
+                result.append(func())
+            except Exception, e:
+                result.append(e)
+        thread = threading.Thread(target=inner)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_reuse(self):
+        pool = self._pool()
+        proto = pool.checkout()
+        assert isinstance(proto, protocol.TyrantProtocol)
+        pool.checkin(proto)
+        assert pool.checkout() is proto
+        pool.checkin(proto)
+        assert pool._size == 1
+
+    def test_nested_checkout(self):
+        pool = self._pool()
+        outer = pool.checkout()
+        inner = pool.checkout()
+        assert inner is outer
+        pool.checkin(inner)
+        assert pool._idle == []
+        pool.checkin(outer)
+        assert len(pool._idle) == 1
+
+    def test_threads_get_own_connections(self):
+        pool = self._pool()
+        mine = pool.checkout()
+        theirs = self._in_thread(lambda: pool.checkout())
+        assert theirs is not mine
+        assert pool._size == 2
+
+    def test_checkout_timeout(self):
+        pool = self._pool(max_size=1, checkout_timeout=0.05)
+        pool.checkout()
+        started = time.time()
+        error = self._in_thread(lambda: pool.checkout())
+        assert isinstance(error, exceptions.PoolTimeout)
+        assert 0.04 < time.time() - started
+
+    def test_waits_for_free_connection(self):
+        pool = self._pool(max_size=1)
+        held = []
+        def hold():
+            held.append(pool.checkout())
+            time.sleep(0.05)
+            pool.checkin(held[0])
+        thread = threading.Thread(target=hold)
+        thread.start()
+        time.sleep(0.01)
+        assert pool.checkout() is held[0]
+        thread.join()
+
+    def test_health_check(self):
+        pool = self._pool()
+        proto = pool.checkout()
+        pool.checkin(proto)
+        time.sleep(0.05)
+        for peer in self.peers:
+            peer.close()
+        time.sleep(0.05)
+        fresh = pool.checkout()
+        assert fresh is not proto
+        assert pool._size == 1
+
+    def test_discard(self):
+        pool = self._pool()
+        proto = pool.checkout()
+        pool.checkin(proto, discard=True)
+        assert pool._size == 0
+        assert pool.checkout() is not proto
+
+    def test_min_size_and_idle_eviction(self):
+        pool = self._pool(min_size=1, max_idle=0.05)
+        assert pool._size == 1
+        first = pool.checkout()
+        self._in_thread(lambda: pool.checkout())
+        assert pool._size == 2
+        pool.checkin(first)
+        assert len(pool._idle) == 1
+        time.sleep(0.1)
+        # idle connections are only evicted above the minimum size
+        assert self._in_thread(lambda: pool.checkout()) is not first
+        assert pool._size == 2
+        assert pool._idle == []
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant
+from pyrant.server import TyrantServer
+
+
+class TestResultCachePolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t.multi_set(('key%03d' % i, {'n': str(i), 'text': 'x' * 10})
+                         for i in xrange(100))
+        self.expected = [('key%03d' % i, {'n': str(i), 'text': 'x' * 10})
+                         for i in xrange(100)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _query(self, **policy):
+        q = self.t.query.order_by('n', numeric=True)
+        q.set_chunk_size(10)
+        if policy:
+            q.set_cache_policy(**policy)
+        return q
+
+    def test_unbounded(self):
+        q = self._query()
+        assert list(q) == self.expected
+        assert len(q._cache.chunks) == 10
+
+    def test_max_chunks(self):
+        q = self._query(max_chunks=3)
+        assert list(q) == self.expected
+        assert sorted(q._cache.chunks) == [7, 8, 9]
+        # chunk 7 becomes the most recently used one
+        assert q[75] == self.expected[75]
+        assert q[5] == self.expected[5]
+        assert sorted(q._cache.chunks) == [0, 7, 9]
+
+    def test_max_bytes(self):
+        q = self._query(max_bytes=500)
+        'key000' in q    # retrieves the keys
+        assert q[:50] == self.expected[:50]
+        assert q._cache.size <= 500
+        assert len(q._cache.chunks) == 2
+
+    def test_streaming(self):
+        q = self._query(streaming=True)
+        assert list(q) == self.expected
+        assert q[20:35] == self.expected[20:35]
+        assert q[42] == self.expected[42]
+        assert not q._cache.chunks
+
+    def test_chunk_size_keeps_policy(self):
+        q = self.t.query
+        q.set_cache_policy(max_chunks=2)
+        q.set_chunk_size(10)
+        assert q._cache.max_chunks == 2
+
+
+class TestReadAhead(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer(latency=0.02).start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t.multi_set(('key%03d' % i, {'n': str(i)}) for i in xrange(100))
+        self.expected = [('key%03d' % i, {'n': str(i)}) for i in xrange(100)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _query(self, prefetch):
+        q = self.t.query.order_by('n', numeric=True)
+        q.set_chunk_size(10)
+        q.set_prefetch(prefetch)
+        return q
+
+    def test_iteration(self):
+        q = self._query(2)
+        assert list(q) == self.expected
+        assert len(q._cache.chunks) == 10
+        # cached chunks are reused
+        assert q[15:35] == self.expected[15:35]
+
+    def test_slice(self):
+        q = self._query(3)
+        'key000' in q    # retrieves the keys
+        assert q[25:47] == self.expected[25:47]
+        assert sorted(q._cache.chunks) == [2, 3, 4]
+
+    def test_streaming(self):
+        q = self._query(1)
+        q.set_cache_policy(streaming=True)
+        assert q._cache.prefetch == 1
+        assert list(q) == self.expected
+        assert not q._cache.chunks
+
+    def test_early_exit(self):
+        q = self._query(2)
+        for i, item in enumerate(q):
+            if i == 15:
+                break
+        assert item == self.expected[15]
+
+    def _idle_connection(self, cache):
+        # the background thread gives the connection back after the slice
+        deadline = time.time() + 5
+        while cache._reader_proto is None and time.time() < deadline:
+            time.sleep(0.01)
+        return cache._reader_proto
+
+    def test_connection_reuse(self):
+        q = self._query(1)
+        'key000' in q    # retrieves the keys
+        assert q[5:15] == self.expected[5:15]
+        proto = self._idle_connection(q._cache)
+        assert proto is not None
+        for i in xrange(3):
+            assert q[i * 10 + 3:i * 10 + 18] == \
+                self.expected[i * 10 + 3:i * 10 + 18]
+            assert self._idle_connection(q._cache) is proto
+        connections = self.server._server.connections
+        assert len(connections) == 2
+        # dropping the cache closes the connection
+        cache = q._cache
+        q.set_cache_policy(max_chunks=2)
+        assert cache._reader_proto is None
+        deadline = time.time() + 5
+        while len(connections) == 2 and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(connections) == 1
+
+    def test_error(self):
+        q = self._query(1)
+        items = iter(q)
+        items.next()
+        self.server.stop()
+        self.assertRaises(Exception, list, items)
+
+
+class TestInlineRecords(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t.multi_set(('key%03d' % i, {'n': str(i), 'even': str(i % 2)})
+                         for i in xrange(95))
+        self.expected = [('key%03d' % i, {'n': str(i), 'even': str(i % 2)})
+                         for i in xrange(95)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _query(self):
+        q = self.t.query.order_by('n', numeric=True)
+        q.set_chunk_size(10)
+        q.set_inline()
+        return q
+
+    def test_iteration(self):
+        q = self._query()
+        misc = self.server.counters['cnt_misc']
+        assert list(q) == self.expected
+        # one search per chunk and no separate request for the keys
+        assert self.server.counters['cnt_misc'] - misc == 10
+        assert q._cache.keys is None
+
+    def test_slice_and_index(self):
+        q = self._query()
+        assert q[33] == self.expected[33]
+        assert q[25:47] == self.expected[25:47]
+        assert q[90:200] == self.expected[90:]
+        self.assertRaises(IndexError, lambda: q[95])
+        assert len(q) == 95
+
+    def test_filter(self):
+        q = self.t.query.filter(even='1').order_by('n', numeric=True)
+        q.set_inline()
+        assert q[:] == self.expected[1::2]
+
+    def test_prefetch(self):
+        q = self._query()
+        q.set_prefetch(2)
+        q.set_cache_policy(streaming=True)
+        assert q._cache.inline
+        assert list(q) == self.expected
+
+    def test_non_ascii(self):
+        self.t.multi_set(('ключ%d' % i, {'n': str(100 + i), 'имя': 'Щ' * i})
+                         for i in xrange(15))
+        plain = self.t.query.order_by('n', numeric=True)
+        plain.set_chunk_size(10)
+        expected = list(plain)
+        assert expected[-1] == ('ключ14', {'n': '114', 'имя': 'Щ' * 14})
+        # the records are converted exactly as those retrieved by keys
+        assert repr(list(self._query())) == repr(expected)
+
+
+class TestWindows(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t.multi_set(('key%03d' % i, {'n': str(i)}) for i in xrange(95))
+        self.expected = [('key%03d' % i, {'n': str(i)}) for i in xrange(95)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _searches(self):
+        return self.server.counters['cnt_misc']
+
+    def test_windows(self):
+        q = self.t.query.order_by('n', numeric=True)
+        searches = self._searches()
+        assert q[0] == self.expected[0]
+        assert q[20:40] == self.expected[20:40]
+        assert self._searches() - searches == 2
+        # covered by cached windows
+        assert q[25:30] == self.expected[25:30]
+        assert q[39] == self.expected[39]
+        assert q[0:1] == self.expected[:1]
+        assert self._searches() - searches == 2
+        assert q._cache.keys is None
+        assert sorted(q._cache.windows) == [(0, 1), (20, 40)]
+        # a window beyond the end
+        assert q[90:200] == self.expected[90:]
+        assert q[93:150] == self.expected[93:]
+        self.assertRaises(IndexError, lambda: q[100])
+        assert self._searches() - searches == 3
+
+    def test_keys_take_over(self):
+        q = self.t.query.order_by('n', numeric=True)
+        assert q[10:20] == self.expected[10:20]
+        # open-ended slices need the keys; chunks are used from then on
+        assert q[90:] == self.expected[90:]
+        assert q._cache.keys is not None
+        assert q[50:60] == self.expected[50:60]
+        assert sorted(q._cache.windows) == [(10, 20)]
+
+    def test_limits(self):
+        q = self.t.query.order_by('n', numeric=True)
+        q.set_cache_policy(max_chunks=2)
+        for i in xrange(5):
+            q[i * 10:i * 10 + 5]
+        assert sorted(q._cache.windows) == [(30, 35), (40, 45)]
+        q.set_cache_policy(streaming=True)
+        assert q[3:5] == self.expected[3:5]
+        assert not q._cache.windows
+
+    def test_non_ascii(self):
+        self.t.multi_set(('ключ%d' % i, {'n': str(100 + i), 'имя': 'Щ' * i})
+                         for i in xrange(5))
+        q = self.t.query.order_by('n', numeric=True)
+        items = [q[i] for i in xrange(93, 100)] + q[95:100]
+        assert q._cache.keys is None
+        expected = list(self.t.query.order_by('n', numeric=True))
+        assert items[-1] == ('ключ4', {'n': '104', 'имя': 'Щ' * 4})
+        # windows are converted exactly as the records retrieved by keys
+        assert repr(items) == repr(expected[93:100] + expected[95:100])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# python
+import socket
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol
+from pyrant.instrument import Collector
+from pyrant.retry import RetryPolicy
+from pyrant.server import TyrantServer
+
+
+P = protocol.TyrantProtocol
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_idempotent(self):
+        policy = RetryPolicy()
+        check = lambda name, *args, **kwargs: policy.is_idempotent(
+            getattr(P, name).im_func, args, kwargs)
+        assert check('get', 'foo')
+        assert check('rnum')
+        assert not check('put', 'foo', 'bar')
+        assert not check('addint', 'foo', 1)
+        assert check('misc', 'getlist', ['foo'])
+        assert not check('misc', 'putlist', ['foo', 'bar'])
+        assert check('misc', 'search', ['addcond\x00a\x000\x00b'])
+        assert not check('misc', 'search', ['out'])
+        assert check('search', [])
+        assert not check('search', [], out=True)
+
+    def test_pauses(self):
+        policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+        for attempt in xrange(10):
+            assert 0 <= policy.get_pause(attempt) <= min(0.3, 0.1 * 2 ** attempt)
+
+
+class TestReconnect(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _restart(self):
+        self.server.stop()
+        self.server = TyrantServer(port=self.server.port).start()
+
+    def test_without_policy(self):
+        p = P(self.server.host, self.server.port)
+        p.put('foo', 'a\x00b')
+        self._restart()
+        self.assertRaises(socket.error, p.rnum)
+        self.assertRaises(socket.error, p.rnum)
+        p.reconnect()
+        assert p.rnum() == 0
+
+    def test_retry_reads(self):
+        p = P(self.server.host, self.server.port, retry=RetryPolicy(backoff=0))
+        p.put('foo', 'a\x00b')
+        self._restart()
+        assert p.rnum() == 0
+        p.put('foo', 'a\x00b')
+        assert p.get('foo') == 'a\x00b'
+
+    def test_no_retry_of_writes(self):
+        p = P(self.server.host, self.server.port, retry=RetryPolicy(backoff=0))
+        self._restart()
+        self.assertRaises(socket.error, p.put, 'foo', 'a\x00b')
+        # the next call reconnects
+        p.put('foo', 'a\x00b')
+        assert self.server.db.records
+
+    def test_tyrant(self):
+        t = Tyrant(host=self.server.host, port=self.server.port,
+                   retry=RetryPolicy(backoff=0))
+        t['foo'] = {'a': 'b'}
+        self._restart()
+        assert t.multi_get(['foo']) == []
+        t['foo'] = {'a': 'b'}
+        assert t['foo'] == {'a': 'b'}
+
+    def test_instrumented(self):
+        collector = Collector()
+        p = P(self.server.host, self.server.port, instrument=collector,
+              retry=RetryPolicy(backoff=0))
+        p.rnum()
+        self._restart()
+        assert p.rnum() == 0
+        report = collector.report()
+        assert report['rnum']['calls'] == 2
+        assert report['rnum']['errors'] == 0
+        assert report['rnum']['bytes_received'] == 2 * 9
+
+    def test_deadline_server_down(self):
+        p = P(self.server.host, self.server.port,
+              retry=RetryPolicy(retries=1000, backoff=0.01, deadline=0.3))
+        self.server.stop()
+        started = time.time()
+        self.assertRaises(socket.error, p.rnum)
+        assert time.time() - started < 0.5
+
+    def test_deadline_slow_server(self):
+        self.server.stop()
+        self.server = TyrantServer(latency=2).start()
+        p = P(self.server.host, self.server.port,
+              retry=RetryPolicy(retries=1000, deadline=0.2))
+        started = time.time()
+        self.assertRaises(socket.timeout, p.rnum)
+        assert time.time() - started < 0.5
+
+    def test_deadline_reconnect(self):
+        p = P(self.server.host, self.server.port,
+              retry=RetryPolicy(retries=1000, backoff=0.01, deadline=0.5))
+        port = self.server.port
+        self.server.stop()
+        # a listener which never accepts: once its backlog is full, new
+        # connections hang in the handshake
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('127.0.0.1', port))
+        listener.listen(0)
+        fillers = []
+        try:
+            while True:
+                filler = socket.socket()
+                filler.settimeout(0.2)
+                fillers.append(filler)
+                try:
+                    filler.connect(('127.0.0.1', port))
+                except socket.timeout:
+                    break
+            started = time.time()
+            self.assertRaises(socket.error, p.rnum)
+            assert time.time() - started < 1
+        finally:
+            for filler in fillers:
+                filler.close()
+            listener.close()
+            self.server = TyrantServer().start()
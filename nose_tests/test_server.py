@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol, exceptions
+from pyrant.server import TyrantServer
+
+
+class TestTableServer(unittest.TestCase):
+    """
+    Checks the stand-in server through the regular client API.
+    """
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t['apple'] = {'name': 'Apple', 'type': 'Convenience Store',
+                           'price': '1.5'}
+        self.t['banana'] = {'name': 'Banana', 'type': "Farmer's Market",
+                            'price': '10'}
+        self.t['cherry'] = {'name': 'Cherry', 'type': 'Store', 'price': '3'}
+
+    def tearDown(self):
+        self.t.proto._sock.close()
+        self.server.stop()
+
+    def test_records(self):
+        assert self.t.db_type == protocol.DB_TABLE
+        assert len(self.t) == 3
+        assert self.t['apple']['price'] == '1.5'
+        assert 'quux' not in self.t
+        assert list(self.t.iterkeys()) == ['apple', 'banana', 'cherry']
+        assert self.t.prefix_keys('b') == ['banana']
+        assert [k for k, v in self.t.multi_get(['cherry', 'quux', 'apple'])] \
+            == ['cherry', 'apple']
+        del self.t['apple']
+        assert 'apple' not in self.t
+        self.assertRaises(KeyError, lambda: self.t['apple'])
+
+    def test_putkeep_putcat(self):
+        self.assertRaises(exceptions.InvalidOperation,
+                          self.t.proto.putkeep, 'apple', 'name\x00X')
+        self.t.proto.putcat('apple', 'name\x00Green Apple\x00color\x00green')
+        assert self.t['apple'] == {'name': 'Green Apple', 'color': 'green',
+                                   'type': 'Convenience Store', 'price': '1.5'}
+
+    def test_search(self):
+        q = self.t.query
+        assert q.filter(price__gt=2).order_by('price', numeric=True).columns(
+            'name') == [{'name': 'Cherry'}, {'name': 'Banana'}]
+        assert q.filter(type__contains_any=['Market', 'Store']).count() == 3
+        assert q.filter(type__contains=['Store', 'Convenience']).count() == 1
+        assert [k for k, v in q.filter(type__like='market')] == ['banana']
+        assert q.exclude(name__startswith='B').count() == 2
+        assert q.filter(price__between=[2, 5]).count() == 1
+        assert q.order_by('-name')[:2][0][0] == 'cherry'
+        union = q.filter(name='Apple') | q.filter(name='Cherry')
+        assert [k for k, v in union] == ['apple', 'cherry']
+        assert 'HINT' in q.hint()
+        q.filter(name='Apple').delete()
+        assert len(self.t) == 2
+
+    def test_numbers(self):
+        p = self.t.proto
+        assert p.addint('counter', 5) == 5
+        assert p.addint('counter', 2) == 7
+        assert p.adddouble('total', 1.25) == 1.25
+        assert p.adddouble('total', 1) == 2.25
+
+    def test_stat(self):
+        info = self.t.server_info.refresh()
+        assert info.rnum == 3
+        assert info.path == ':memory:'
+        assert self.server.counters['requests'] >= 3
+        assert self.server.counters['bytes_received'] > 0
+
+    def test_pipeline(self):
+        pipe = self.t.proto.pipeline()
+        pipe.get('banana')
+        pipe.get('quux')
+        pipe.rnum()
+        results = pipe.execute()
+        assert isinstance(results[1], exceptions.InvalidOperation)
+        assert results[2] == 3
+
+
+class TestHashServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer(db_type=protocol.DB_HASH).start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+
+    def tearDown(self):
+        self.t.proto._sock.close()
+        self.server.stop()
+
+    def test_values(self):
+        self.t['foo'] = u'bär'
+        assert self.t['foo'] == u'bär'
+        self.t.concat('foo', 'baz')
+        assert self.t['foo'] == u'bärbaz'
+        self.t.concat('foo', 'quux', width=5)
+        assert self.t['foo'] == u'zquux'
+        assert self.t.get_size('foo') == 5
+        self.t.clear()
+        assert len(self.t) == 0
+
+    def test_no_search(self):
+        self.assertRaises(exceptions.InvalidOperation,
+                          self.t.proto.misc, 'search', [])
+
+
+class TestLatency(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer(latency=0.02).start()
+        self.p = protocol.TyrantProtocol(self.server.host, self.server.port)
+
+    def tearDown(self):
+        self.p._sock.close()
+        self.server.stop()
+
+    def test_round_trips(self):
+        started = time.time()
+        for i in xrange(5):
+            self.p.put('key%d' % i, 'a\x00b')
+        assert 0.1 <= time.time() - started
+
+        # pipelined requests share the round trip
+        started = time.time()
+        pipe = self.p.pipeline()
+        for i in xrange(5):
+            pipe.get('key%d' % i)
+        assert len(pipe.execute()) == 5
+        assert time.time() - started < 0.08
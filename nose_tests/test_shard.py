@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+# python
+import threading
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant.query import Ordering
+from pyrant.shard import HashRing, ShardedQuery, ShardedTyrant, run_parallel
+
+
+class DummyProtocol(object):
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+
+
+class DummyTyrant(dict):
+    "Mimics the parts of Tyrant API used by ShardedTyrant."
+
+    def __init__(self, port):
+        self.proto = DummyProtocol('127.0.0.1', port)
+        self.threads = set()
+
+    def multi_get(self, keys):
+        self.threads.add(threading.currentThread())
+        return [(k, self[k]) for k in keys if k in self]
+
+    def multi_set(self, items, no_update_log=False):
+        self.threads.add(threading.currentThread())
+        self.update(items)
+
+    def multi_del(self, keys, no_update_log=False):
+        for key in keys:
+            self.pop(key, None)
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_stable(self):
+        ring = HashRing(['a', 'b', 'c'])
+        nodes = [ring.get_node('key%d' % i) for i in xrange(1000)]
+        assert nodes == [HashRing(['c', 'b', 'a']).get_node('key%d' % i)
+                         for i in xrange(1000)]
+        assert set(nodes) == set('abc')
+
+    def test_unicode_keys(self):
+        ring = HashRing(['a', 'b', 'c'])
+        assert ring.get_node(u'тест') == ring.get_node(u'тест'.encode('utf-8'))
+
+    def test_few_keys_move_when_node_added(self):
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        moved = [i for i in xrange(10000)
+                 if before.get_node(i) != after.get_node(i)]
+        # ideally 1/4 of keys move, all of them to the new node
+        assert 1500 < len(moved) < 3500
+        assert set(after.get_node(i) for i in moved) == set(['d'])
+
+    def test_weights(self):
+        ring = HashRing({'a': 1, 'b': 3})
+        nodes = [ring.get_node(i) for i in xrange(10000)]
+        assert 2 < nodes.count('b') / float(nodes.count('a')) < 4
+
+
+class TestShardedTyrant(unittest.TestCase):
+
+    def setUp(self):
+        self.shards = [DummyTyrant(port) for port in 1001, 1002, 1003]
+        self.t = ShardedTyrant(self.shards)
+
+    def test_routing(self):
+        for i in xrange(100):
+            self.t['key%d' % i] = i
+        assert sum(len(shard) for shard in self.shards) == 100
+        assert all(self.shards)
+        for i in xrange(100):
+            key = 'key%d' % i
+            assert self.t[key] == i
+            assert self.t.get_shard(key)[key] == i
+        del self.t['key1']
+        assert 'key1' not in self.t
+        assert len(self.t) == 99
+
+    def test_multi_set_and_get(self):
+        self.t.multi_set(('key%d' % i, i) for i in xrange(100))
+        assert all(self.shards)
+        keys = ['key%d' % i for i in xrange(120, -1, -3)]
+        assert self.t.multi_get(keys) == [(k, int(k[3:])) for k in keys
+                                          if int(k[3:]) < 100]
+        threads = set()
+        for shard in self.shards:
+            threads |= shard.threads
+        assert 1 < len(threads)
+
+    def test_multi_del(self):
+        self.t.multi_set(dict(('key%d' % i, i) for i in xrange(10)))
+        self.t.multi_del(['key%d' % i for i in xrange(5)])
+        assert sorted(self.t.keys()) == ['key%d' % i for i in xrange(5, 10)]
+
+    def test_weighted_servers(self):
+        t = ShardedTyrant([(self.shards[0], 1), (self.shards[1], 4)])
+        t.multi_set(('key%d' % i, i) for i in xrange(1000))
+        assert len(self.shards[0]) < len(self.shards[1])
+
+
+class TestRunParallel(unittest.TestCase):
+
+    def test_results_in_order(self):
+        assert run_parallel([(lambda x: x * 2, (i,)) for i in xrange(5)]) == \
+               [0, 2, 4, 6, 8]
+        assert run_parallel([]) == []
+
+    def test_errors(self):
+        def fail():
+            raise KeyError('foo')
+        self.assertRaises(KeyError, run_parallel, [(fail, ()), (len, ('a',))])
+
+
+class DummyQuery(object):
+    "Mimics Query on top of a list of (key, record) pairs."
+
+    def __init__(self, items, ordering=None):
+        self.items = items
+        self._ordering = ordering or Ordering()
+        self.requested = []
+
+    def _sorted(self):
+        items = self.items
+        o = self._ordering
+        if o:
+            convert = float if o.method == Ordering.NUMERIC else str
+            items = sorted(items, key=lambda x: convert(x[1][o.name]),
+                           reverse=o.direction == Ordering.DESC)
+        return items
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            self.requested.append(k.stop)
+        return self._sorted()[k]
+
+    def __len__(self):
+        return len(self.items)
+
+    def count(self):
+        return len(self.items)
+
+    def filter(self, **kwargs):
+        (name, value), = kwargs.items()
+        return DummyQuery([x for x in self.items if x[1][name] == value],
+                          self._ordering)
+
+    def order_by(self, name, numeric=False):
+        direction = Ordering.ASC
+        if name.startswith('-'):
+            name, direction = name[1:], Ordering.DESC
+        return DummyQuery(self.items, Ordering(name, direction, numeric))
+
+
+class TestShardedQuery(unittest.TestCase):
+
+    def setUp(self):
+        items = [('k%02d' % i, {'price': str(i * 7 % 30), 'name': 'n%02d' % i,
+                                'color': ('red', 'blue')[i % 2]})
+                 for i in xrange(30)]
+        self.queries = [DummyQuery(items[i::3]) for i in xrange(3)]
+        self.q = ShardedQuery(self.queries)
+        self.items = items
+
+    def test_count(self):
+        assert self.q.count() == 30
+        assert self.q.filter(color='red').count() == 15
+        assert len(self.q) == 30
+
+    def test_merge_alphabetic(self):
+        result = self.q.order_by('name')[:]
+        assert [k for k, v in result] == ['k%02d' % i for i in xrange(30)]
+        result = self.q.order_by('-name')[:]
+        assert [k for k, v in result] == ['k%02d' % i for i in xrange(29, -1, -1)]
+
+    def test_merge_numeric(self):
+        result = self.q.order_by('price', numeric=True)[:]
+        prices = [int(v['price']) for k, v in result]
+        assert prices == sorted(prices)
+        result = self.q.order_by('-price', numeric=True)
+        assert [int(v['price']) for k, v in result] == sorted(prices, reverse=True)
+
+    def test_slice_pushdown(self):
+        q = self.q.order_by('name')
+        assert [k for k, v in q[5:8]] == ['k05', 'k06', 'k07']
+        assert [x.requested for x in q._queries] == [[8], [8], [8]]
+        assert q[12] == self.items[12]
+
+    def test_iteration(self):
+        keys = [k for k, v in self.q.order_by('name')]
+        assert keys == ['k%02d' % i for i in xrange(30)]
+        assert len(list(self.q)) == 30
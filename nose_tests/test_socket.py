@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# python
+import socket
+import struct
+import threading
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import protocol
+
+
+class TestTyrantSocket(unittest.TestCase):
+    """
+    Checks the buffered reader against a fake server which sends canned bytes.
+    """
+
+    def setUp(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        host, port = listener.getsockname()
+        self.sock = protocol._TyrantSocket(host, port)
+        self.peer, _ = listener.accept()
+        listener.close()
+
+    def tearDown(self):
+        self.peer.close()
+
+    def _feed(self, data, step=None, delay=0.001):
+        "Sends `data` to the client, optionally in small pieces."
+        if step is None:
+            self.peer.sendall(data)
+            return
+        def inner():
+            for i in xrange(0, len(data), step):
+                self.peer.sendall(data[i:i+step])
+                time.sleep(delay)
+        thread = threading.Thread(target=inner)
+        thread.start()
+        return thread
+
+    def test_numbers(self):
+        self._feed(struct.pack('>BIQQQ', 0, 42, 2**40, 3, 500000000000))
+        assert self.sock.get_byte() == '\x00'
+        assert self.sock.get_int() == 42
+        assert self.sock.get_long() == 2**40
+        assert self.sock.get_double() == 3.5
+
+    def test_strings(self):
+        self._feed(struct.pack('>I', 3) + 'foo' + struct.pack('>I', 4) +
+                   u'тест'.encode('utf-8')[:4])
+        assert self.sock.get_str() == 'foo'
+        assert self.sock.get_unicode() == u'те'
+
+    def test_strpairs(self):
+        pairs = [('key%d' % i, 'value%d' % i) for i in xrange(1000)]
+        data = ''.join(struct.pack('>II', len(k), len(v)) + k + v
+                       for k, v in pairs)
+        thread = self._feed(data, step=4096)
+        assert [self.sock.get_strpair() for i in xrange(1000)] == pairs
+        thread.join()
+
+    def test_fragmented_response(self):
+        thread = self._feed(struct.pack('>I', 5) + 'hello' +
+                            struct.pack('>I', 7), step=1)
+        assert self.sock.get_str() == 'hello'
+        assert self.sock.get_int() == 7
+        thread.join()
+
+    def test_value_larger_than_buffer(self):
+        value = ''.join(chr(i % 256) for i in xrange(protocol.RECV_BUFFER_SIZE * 3 + 17))
+        thread = self._feed(struct.pack('>I', len(value)) + value +
+                            struct.pack('>I', 1), step=10000)
+        assert self.sock.get_str() == value
+        assert self.sock.get_int() == 1
+        thread.join()
+
+    def test_disconnect(self):
+        self._feed('\x00\x00')
+        self.peer.close()
+        self.assertRaises(socket.error, self.sock.get_int)
+
+    def test_strlist(self):
+        strings = ['x' * (i % 50) for i in xrange(5000)]
+        strings.append('y' * (protocol.RECV_BUFFER_SIZE + 10))
+        strings.append('z')
+        data = ''.join(struct.pack('>I', len(x)) + x for x in strings)
+        thread = self._feed(data, step=7000)
+        assert self.sock.get_strlist(len(strings)) == strings
+        thread.join()
+
+    def test_strpairlist(self):
+        pairs = [('k%d' % i, 'v' * (i % 70)) for i in xrange(5000)]
+        pairs.append(('big', 'b' * (protocol.RECV_BUFFER_SIZE * 2)))
+        data = ''.join(struct.pack('>II', len(k), len(v)) + k + v
+                       for k, v in pairs)
+        thread = self._feed(data + struct.pack('>I', 9), step=9000)
+        assert self.sock.get_strpairlist(len(pairs)) == pairs
+        assert self.sock.get_int() == 9
+        thread.join()
+
+    def test_stream(self):
+        self._feed(''.join(struct.pack('>I', 3) + 'v%02d' % i for i in xrange(10)))
+        stream = self.sock.stream(10, self.sock.get_str)
+        assert stream.next() == 'v00'
+        assert stream.next() == 'v01'
+        assert self.sock._stream is stream
+        assert list(stream) == ['v%02d' % i for i in xrange(2, 10)]
+        assert self.sock._stream is None
+
+    def test_stream_drained_before_next_request(self):
+        self._feed(''.join(struct.pack('>I', 3) + 'v%02d' % i for i in xrange(10)) +
+                   '\x00' + struct.pack('>I', 42))
+        stream = self.sock.stream(10, self.sock.get_str)
+        assert stream.next() == 'v00'
+        # another command is sent while the stream is being consumed
+        self.sock.send(protocol.TyrantProtocol.VSIZ, 3, 'foo')
+        assert self.sock.get_int() == 42
+        assert self.sock._stream is None
+        assert list(stream) == ['v%02d' % i for i in xrange(1, 10)]
+        assert self.peer.recv(100) == protocol._pack(protocol.TyrantProtocol.VSIZ, 3, 'foo')
+
+    def test_pack(self):
+        P = protocol.TyrantProtocol
+        expected = (struct.pack('>BBIII', protocol.MAGIC_NUMBER, P.MISC, 7, 0, 3) +
+                    'putlist' + struct.pack('>I', 3) + 'foo' +
+                    struct.pack('>I', 4) + u'bär'.encode('utf-8') +
+                    struct.pack('>I', 2) + '42')
+        assert protocol._pack(P.MISC, 7, 0, 3, 'putlist',
+                              ['foo', u'bär', 42]) == expected
+        assert protocol._pack(P.ADDDOUBLE, 3, 1L, 2L, 'foo') == \
+            struct.pack('>BBIQQ', protocol.MAGIC_NUMBER, P.ADDDOUBLE, 3, 1, 2) + 'foo'
+
+    def test_send_large_request_in_blocks(self):
+        sent = []
+        real = self.sock._sock
+        class Recorder(object):
+            def sendall(self, data):
+                sent.append(data)
+                real.sendall(data)
+        self.sock._sock = Recorder()
+        args = ['value %d' % i for i in xrange(20000)]
+        expected = protocol._pack(protocol.TyrantProtocol.MISC, 7, 0,
+                                  len(args), 'putlist', args)
+        assert protocol.SEND_BLOCK_SIZE < len(expected)
+        received = []
+        def read():
+            size = 0
+            while size < len(expected):
+                received.append(self.peer.recv(65536))
+                size += len(received[-1])
+        reader = threading.Thread(target=read)
+        reader.start()
+        self.sock.send(protocol.TyrantProtocol.MISC, 7, 0, len(args),
+                       'putlist', args, sync=False)
+        reader.join()
+        assert ''.join(received) == expected
+        assert 1 < len(sent)
+        assert max(len(x) for x in sent) < 2 * protocol.SEND_BLOCK_SIZE
+        self.sock._sock = real
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# python
+import time
+
+# testing
+import unittest
+from nose import *
+
+# the app
+from pyrant import Tyrant, protocol
+from pyrant.pool import TyrantPool
+from pyrant.server import TyrantServer
+
+
+class TestBufferedWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.server = TyrantServer().start()
+        self.t = Tyrant(host=self.server.host, port=self.server.port)
+        self.t.get_stats()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _requests(self):
+        return self.server.counters.get('cnt_misc', 0)
+
+    def test_coalescing(self):
+        self.t['old'] = {'name': 'Old'}
+        misc = self._requests()
+        with self.t.buffered() as w:
+            for i in xrange(100):
+                w['key%d' % i] = {'name': u'Ключ %d' % i, 'n': i}
+            w['key0'] = {'name': 'Zero'}
+            del w['key1']
+            del w['old']
+            assert len(w) == 101
+            assert 'key2' not in self.t
+        # one outlist and one putlist
+        assert self._requests() - misc == 2
+        assert len(self.t) == 99
+        assert self.t['key0'] == {'name': 'Zero'}
+        assert self.t['key2'] == {'name': u'Ключ 2', 'n': '2'}
+        assert 'key1' not in self.t
+        assert 'old' not in self.t
+
+    def test_put_after_delete(self):
+        with self.t.buffered() as w:
+            del w['foo']
+            w['foo'] = {'name': 'Foo'}
+        assert self.t['foo'] == {'name': 'Foo'}
+
+    def test_limits(self):
+        w = self.t.buffered(max_items=10)
+        for i in xrange(25):
+            w['key%d' % i] = {'n': i}
+        assert len(self.t) == 20
+        assert len(w) == 5
+        w.close()
+        assert len(self.t) == 25
+
+        w = self.t.buffered(max_bytes=100)
+        w['a'] = {'text': 'x' * 50}
+        assert len(w) == 1
+        w['b'] = {'text': 'x' * 50}
+        assert len(w) == 0
+        w.close()
+
+    def test_no_update_log(self):
+        calls = []
+        misc = self.t.proto.misc
+        def record(func, args, opts=0, **kwargs):
+            calls.append((func, opts))
+            return misc(func, args, opts, **kwargs)
+        self.t.proto.misc = record
+        with self.t.buffered(no_update_log=True) as w:
+            w['foo'] = {'name': 'Foo'}
+            del w['bar']
+        assert 'foo' in self.t
+        flag = protocol.TyrantProtocol.RDBMONOULOG
+        assert sorted(calls) == [('outlist', flag), ('putlist', flag)]
+
+    def test_mixed_strings(self):
+        with self.t.buffered() as w:
+            w['foo'] = {'name': u'Ключ', 'tag': 'caf\xc3\xa9'}
+        self.t['bar'] = {'name': u'Ключ', 'tag': 'caf\xc3\xa9'}
+        assert self.t['foo'] == self.t['bar']
+        assert self.t['foo'] == {'name': u'Ключ', 'tag': u'café'}
+
+    def test_timer(self):
+        pool = TyrantPool(self.server.host, self.server.port)
+        t = Tyrant(pool=pool)
+        w = t.buffered(max_delay=0.05)
+        w['foo'] = {'name': 'Foo'}
+        deadline = time.time() + 5
+        # the batch leaves the buffer before it reaches the server
+        while 'foo' not in t and time.time() < deadline:
+            time.sleep(0.01)
+        assert not len(w)
+        assert t['foo'] == {'name': 'Foo'}
+        w.close()
+        self.assertRaises(AssertionError, w.__setitem__, 'bar', {'a': 'b'})
+
+    def test_failed_flush_keeps_operations(self):
+        w = self.t.buffered()
+        w['foo'] = {'name': 'Foo'}
+        self.server.stop()
+        self.assertRaises(Exception, w.flush)
+        assert len(w) == 1
+
+    def test_hash_database(self):
+        server = TyrantServer(db_type=protocol.DB_HASH).start()
+        try:
+            t = Tyrant(host=server.host, port=server.port, separator=',')
+            with t.buffered() as w:
+                w['foo'] = 'bar'
+                w['list'] = ['a', 'b']
+            assert t['foo'] == 'bar'
+            assert t['list'] == ['a', 'b']
+        finally:
+            server.stop()
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 A pure-Python implementation of Tokyo Tyrant protocol.
-Python 2.4+ is required.
+Python 2.7+ is required.
 
 More information about Tokyo Cabinet:
     http://1978th.net/tokyocabinet/
@@ -30,13 +30,21 @@ Usage example (note the automatically managed support for table database)::
 """
 
 import itertools
-import uuid
+import time
 
 # pyrant
+import batch
+import cache
+import chunks
 import exceptions
+import flight
+import info
+import keys
+import pool
 import protocol
 import query
 import utils
+import writer
 
 
 __version__ = '0.6.2'
@@ -57,6 +65,29 @@ class Tyrant(object):
         databases the separator applies to column values.
     :param literal: if set, returned data is not encoded to Unicode (default is
         False)
+    :param pool: a :class:`~pyrant.pool.TyrantPool` instance. If set, `host`
+        and `port` are ignored and each command is run on a connection checked
+        out of the pool, so the :class:`Tyrant` object can be shared by
+        multiple threads.
+    :param info_ttl: number of seconds after which cached server metadata
+        (see :attr:`server_info`) is fetched again. Default is `None`: the
+        metadata is fetched once.
+    :param instrument: an :class:`~pyrant.instrument.Instrument` to be
+        attached to the connection (for pooled connections see
+        :class:`~pyrant.pool.TyrantPool`).
+    :param retry: a :class:`~pyrant.retry.RetryPolicy` which makes the
+        connection recover from failures (for pooled connections see
+        :class:`~pyrant.pool.TyrantPool`).
+    :param key_allocator: a :class:`~pyrant.keys.KeyAllocator` which provides
+        primary keys for :meth:`multi_add` and :meth:`generate_key`. Default
+        is :class:`~pyrant.keys.GenuidAllocator`.
+    :param cache: a :class:`~pyrant.cache.RecordCache` which keeps recently
+        read records in memory. Default is `None` (no caching).
+    :param flight: a :class:`~pyrant.flight.SingleFlight` which merges
+        concurrent identical reads into one request. Default is `None`.
+    :param batch: a :class:`~pyrant.batch.BatchLoader` which merges
+        concurrent reads of single records into `getlist` requests. Default
+        is `None`.
 
     Usage::
 
@@ -89,12 +120,22 @@ class Tyrant(object):
     """
 
     def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, separator=None,
-                 literal=False):
+                 literal=False, pool=None, info_ttl=None, instrument=None,
+                 retry=None, key_allocator=None, cache=None,
+                 flight=None, batch=None):
         """
         The pythonic interface for Tokyo Tyrant. Mimics dict API.
         """
         # keep the protocol public just in case anyone needs a specific option
-        self.proto = protocol.TyrantProtocol(host, port)
+        if pool is None:
+            self.proto = protocol.TyrantProtocol(host, port,
+                                                 instrument=instrument,
+                                                 retry=retry)
+        else:
+            self.proto = pool.protocol()
+
+        # database type and other metadata used to convert the records
+        self.server_info = info.ServerInfo(self.proto, ttl=info_ttl)
 
         self.separator = separator
         if not separator and self.table_enabled:
@@ -102,7 +143,17 @@ class Tyrant(object):
 
         self.literal = literal
 
+        if key_allocator is None:
+            key_allocator = keys.GenuidAllocator(self.proto)
+        self.key_allocator = key_allocator
+
+        self.cache = cache
+        self.flight = flight
+        self.batch = batch
+
     def __contains__(self, key):
+        if self.cache is not None and key in self.cache:
+            return True
         try:
             self.proto.vsiz(key)
         except exceptions.TyrantError:
@@ -115,16 +166,48 @@ class Tyrant(object):
             return self.proto.out(key)
         except exceptions.TyrantError:
             raise KeyError(key)
+        finally:
+            self._invalidate([key])
 
     def __getitem__(self, key):
         if not isinstance(key, (str, unicode)):
             raise TypeError('Primary key must be a string, got %s "%s"'
                             % (type(key).__name__, key))
+        if self.cache is not None:
+            found, value = self.cache.get(key)
+            if found:
+                return value
+        if self.batch is not None:
+            return self.batch.load(key, self._fetch_many)
+        if self.flight is not None:
+            flight_key = ('get', self.proto.host, self.proto.port, self.literal,
+                          key)
+            return self.flight.do(flight_key, self._fetch, key)
+        return self._fetch(key)
+
+    def _fetch(self, key):
+        if self.cache is not None:
+            generation = self.cache.generation
         try:
             elem = self.proto.get(key, self.literal)
-            return utils.to_python(elem, self.db_type, self.separator)
+            value = utils.to_python(elem, self.db_type, self.separator)
         except exceptions.TyrantError:
             raise KeyError(key)
+        if self.cache is not None:
+            self.cache.set(key, value, generation)
+        return value
+
+    def _fetch_many(self, keys):
+        # returns a dictionary of found records by keys as byte strings
+        if self.cache is not None:
+            generation = self.cache.generation
+        db_type = self.db_type
+        data = self.proto.misc('getlist', keys, 0, literal=self.literal)
+        pairs = [(k, utils.to_python(v, db_type, self.separator))
+                 for k, v in zip(data[::2], data[1::2])]
+        if self.cache is not None:
+            self.cache.set_many(pairs, generation)
+        return dict((utils.to_bytes(k), v) for k, v in pairs)
 
     def get(self, key, default=None):
         """
@@ -161,27 +244,33 @@ class Tyrant(object):
             flat = list(itertools.chain(*((k, utils.from_python(v)) for
                                            k,v in value.iteritems())))
             args = [key] + flat
-            self.proto.misc('put', args)  # EXPLAIN why is this hack necessary?
+            try:
+                self.proto.misc('put', args)  # EXPLAIN why is this hack necessary?
+            finally:
+                self._invalidate([key])
         else:
             if isinstance(value, (list, tuple)):
                 assert self.separator, "Separator is not set"
                 prepared_value = self.separator.join(value)
             else:
                 prepared_value = value
-            self.proto.put(key, prepared_value)
+            try:
+                self.proto.put(key, prepared_value)
+            finally:
+                self._invalidate([key])
+
+    def _invalidate(self, keys):
+        # drops records changed by this client from the cache
+        if self.cache is not None:
+            self.cache.invalidate(keys)
 
     @property
     def db_type(self):
-        stats = self.get_stats()
-        assert 'type' in stats and stats['type'], ('statistics must provide a '
-                                                   'valid database type')
-        return stats['type']
+        return self.server_info.db_type
 
     @property
     def db_path(self):
-        stats = self.get_stats()
-        assert 'path' in stats, 'statistics must provide a database path'
-        return stats['path']
+        return self.server_info.path
 
     @property
     def table_enabled(self):
@@ -199,34 +288,42 @@ class Tyrant(object):
         # TODO: write better documentation *OR* move this method to lower level
         opts = ((record_locking and protocol.TyrantProtocol.RDBXOLCKREC) |
                 (global_locking and protocol.TyrantProtocol.RDBXOLCKGLB))
-        return self.proto.ext(func, opts, key, value)
+        try:
+            return self.proto.ext(func, opts, key, value)
+        finally:
+            # the function may change any record
+            if self.cache is not None:
+                self.cache.clear()
 
     def clear(self):
         """
         Removes all records from the remote database.
         """
         self.proto.vanish()
+        if self.cache is not None:
+            self.cache.clear()
 
     def concat(self, key, value, width=None):
         """
         Concatenates columns of the existing record.
         """
         # TODO: write better documentation, provide example code
-        if width is None:
-            self.proto.putcat(key, value)
-        else:
-            self.proto.putshl(key, value, width)
+        try:
+            if width is None:
+                self.proto.putcat(key, value)
+            else:
+                self.proto.putshl(key, value, width)
+        finally:
+            self._invalidate([key])
 
     def generate_key(self):
         """
-        Returns a unique primary key for given database. Tries to obtain the
-        key using database's built-in function `genuid`. If `genuid` fails to
-        provide the key, a UUID is generated instead.
+        Returns a unique primary key for given database. The key is obtained
+        from :attr:`key_allocator`; by default the database's built-in function
+        `genuid` is used and if it fails to provide the key, a UUID is
+        generated instead.
         """
-        try:
-            return self.proto.genuid()
-        except ValueError:
-            return uuid.uuid4()
+        return self.key_allocator.allocate(1)[0]
 
     def get_size(self, key):
         """
@@ -239,9 +336,10 @@ class Tyrant(object):
 
     def get_stats(self):
         """
-        Returns the status message of the database as dictionary.
+        Returns the status message of the database as dictionary. The
+        :attr:`server_info` snapshot is refreshed along the way.
         """
-        return utils.csv_to_dict(self.proto.stat())
+        return dict(self.server_info.refresh().stats)
 
     def iterkeys(self):
         """
@@ -267,25 +365,55 @@ class Tyrant(object):
     def values(self):
         return list(self.itervalues())
 
-    def iteritems(self):
+    def iteritems(self, chunk_size=None):
         """
         Returns a generator with key/value pairs. The data is read from the
         database in chunks to alleviate the issues of a) too many database
         hits, and b) too heavy memory usage when only a part of the list is
         actually used.
+
+        :param chunk_size: the number of records per chunk (default is 1000)
+            or a :class:`~pyrant.chunks.AdaptiveChunkSize` which picks it from
+            the size and fetch time of previous chunks.
         """
         CHUNK_SIZE = 1000
+        sizer = None
+        if isinstance(chunk_size, chunks.AdaptiveChunkSize):
+            sizer = chunk_size
+        size = chunk_size or CHUNK_SIZE
         chunk = []
         for key in self.iterkeys():
             chunk.append(key)
-            if CHUNK_SIZE <= len(chunk):
-                for k,v in self.multi_get(chunk):
+            if int(size) <= len(chunk):
+                for k,v in self._iter_chunk(chunk, sizer):
                     yield k,v
                 chunk = []
         if chunk:
-            for k,v in self.multi_get(chunk):
+            for k,v in self._iter_chunk(chunk, sizer):
                 yield k,v
 
+    def _iter_chunk(self, keys, sizer):
+        if sizer is None:
+            for k,v in self.iter_multi_get(keys):
+                yield k,v
+            return
+        # only the time spent on fetching counts, not the time the caller
+        # spends on processing the records
+        items = self.iter_multi_get(keys)
+        size = 0
+        elapsed = 0
+        while True:
+            started = time.time()
+            try:
+                k, v = items.next()
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.time() - started
+            size += cache.sizeof(k, v)
+            yield k,v
+        sizer.observe(len(keys), size, elapsed)
+
     def items(self):
         return list(self.iteritems())
 
@@ -319,6 +447,22 @@ class Tyrant(object):
         data = dict(mapping or {}, **kwargs)
         self.multi_set(data)
 
+    def buffered(self, max_items=1000, max_bytes=1024 * 1024, max_delay=None,
+                 no_update_log=False):
+        """
+        Returns a :class:`~pyrant.writer.BufferedWriter` which collects
+        assignments and deletions and sends them in batches::
+
+            with t.buffered() as w:
+                for key, value in items:
+                    w[key] = value
+
+        See :mod:`pyrant.writer` for details.
+        """
+        return writer.BufferedWriter(self, max_items=max_items,
+                                     max_bytes=max_bytes, max_delay=max_delay,
+                                     no_update_log=no_update_log)
+
     def multi_add(self, values, chunk_size=1000, no_update_log=False):
         """
         Adds given values as new records and returns a list of automatically
@@ -338,19 +482,19 @@ class Tyrant(object):
 
     def _multi_add(self, values, chunk_size=1000, no_update_log=False):
         assert hasattr(values, '__iter__'), 'values must be an iterable'
-        chunk = []
-        for value in values:
-            'value', value
-            key = self.generate_key()
-            yield key
-            chunk.append((key, value))
-            if 0 < chunk_size < len(chunk):
-                # chunk has grown big, need to feed the database
-                self.multi_set(chunk, no_update_log=no_update_log)
-                chunk = []
-        else:
-            # feed the remnants
-            self.multi_set(chunk, no_update_log=no_update_log)
+        values = iter(values)
+        while True:
+            if chunk_size:
+                chunk = list(itertools.islice(values, chunk_size))
+            else:
+                chunk = list(values)
+            if not chunk:
+                break
+            # one batch of keys per chunk of records
+            keys = self.key_allocator.allocate(len(chunk))
+            self.multi_set(zip(keys, chunk), no_update_log=no_update_log)
+            for key in keys:
+                yield key
 
     def multi_del(self, keys, no_update_log=False):
         """
@@ -361,7 +505,10 @@ class Tyrant(object):
         if not isinstance(keys, (list, tuple)):
             keys = list(keys)
 
-        self.proto.misc('outlist', keys, opts)
+        try:
+            self.proto.misc('outlist', keys, opts)
+        finally:
+            self._invalidate(keys)
 
     def multi_get(self, keys):
         """
@@ -375,17 +522,56 @@ class Tyrant(object):
 
         :param keys: the list of keys.
 
+        If :attr:`cache` is set, only the keys which are not cached are
+        requested from the server and the records are returned in the order
+        of `keys`.
+
         """
         # TODO: write better documentation: why would user need the no_update_log param?
         assert hasattr(keys, '__iter__'), 'expected iterable, got %s' % keys
-        prep_val = lambda v: utils.to_python(v, self.db_type, self.separator)
+        db_type = self.db_type
+        prep_val = lambda v: utils.to_python(v, db_type, self.separator)
 
         keys = list(keys)
-        data = self.proto.misc('getlist', keys, 0)
+        if self.cache is not None:
+            return self._cached_multi_get(keys)
+        data = self.proto.misc('getlist', keys, 0, literal=self.literal)
         data_keys = data[::2]
         data_vals = (prep_val(x) for x in data[1::2])
         return zip(data_keys, data_vals)
 
+    def _cached_multi_get(self, keys):
+        # server keys are decoded unless `literal` is set; compare them as
+        # byte strings and return them the same way as the server does
+        cached, missing = self.cache.get_many(keys)
+        found = dict((utils.to_bytes(k), v) for k, v in cached.iteritems())
+        if missing:
+            found.update(self._fetch_many(missing))
+        result = []
+        for key in keys:
+            key = utils.to_bytes(key)
+            if key in found:
+                value = found[key]
+                if not self.literal:
+                    key = key.decode(protocol.ENCODING,
+                                     protocol.ENCODING_ERROR_HANDLING)
+                result.append((key, value))
+        return result
+
+    def iter_multi_get(self, keys):
+        """
+        Same as :meth:`multi_get` but returns a generator which yields the
+        records as they arrive from the server, so that only one record at a
+        time is kept in memory.
+        """
+        assert hasattr(keys, '__iter__'), 'expected iterable, got %s' % keys
+        db_type = self.db_type
+        data = iter(self.proto.iter_misc('getlist', list(keys), 0,
+                                         literal=self.literal))
+        for key in data:
+            value = data.next()
+            yield key, utils.to_python(value, db_type, self.separator)
+
     def multi_set(self, items, no_update_log=False):
         """
         Stores the given records in the database. The records may be given
@@ -437,7 +623,10 @@ class Tyrant(object):
                 value = self.separator.join(strings)
             ready_pairs.extend((key, value))
 
-        self.proto.misc('putlist', ready_pairs, opts)
+        try:
+            self.proto.misc('putlist', ready_pairs, opts)
+        finally:
+            self._invalidate(ready_pairs[::2])
 
     def prefix_keys(self, prefix, maxkeys=None):
         """
@@ -477,4 +666,5 @@ class Tyrant(object):
         if not self.table_enabled:
             raise TypeError('Query only works with table databases but %s is a '
                             '%s database.' % (self.db_path, self.db_type))
-        return query.Query(self.proto, self.db_type, self.literal)
+        return query.Query(self.proto, self.db_type, self.literal,
+                           flight=self.flight)
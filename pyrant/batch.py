@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Automatic batching of single-record reads.
+
+Code that reads records one by one from several threads pays a round trip
+per record. A :class:`BatchLoader` collects the keys requested by
+:meth:`~pyrant.Tyrant.__getitem__` and :meth:`~pyrant.Tyrant.get` within a
+short window and fetches them with a single `getlist` command::
+
+    from pyrant import Tyrant
+    from pyrant.batch import BatchLoader
+    from pyrant.pool import TyrantPool
+
+    t = Tyrant(pool=TyrantPool('10.0.0.1', 1978),
+               batch=BatchLoader(window=0.0005))
+
+The first thread asking for a key opens a batch and waits `window` seconds
+(or until `max_size` keys are collected) for other threads to add their keys;
+then it sends the request and hands each waiting thread its record. Keys
+requested by several threads are fetched once. A read thus takes up to
+`window` seconds longer, but many concurrent reads cost one round trip.
+
+As with :mod:`pyrant.flight`, this only makes sense if the
+:class:`~pyrant.Tyrant` instance is shared by threads.
+"""
+
+import copy
+import sys
+import threading
+import time
+
+import utils
+
+
+__all__ = ['BatchLoader']
+
+
+class _Batch(object):
+    # keys collected for one request
+    def __init__(self):
+        self.keys = {}           # key: number of callers
+        self.results = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchLoader(object):
+    """
+    Merges concurrent reads of single records into batches.
+
+    :param window: number of seconds a batch stays open for more keys.
+    :param max_size: maximum number of keys in a batch.
+    """
+
+    def __init__(self, window=0.001, max_size=1000):
+        self.window = window
+        self.max_size = max_size
+        self._open = {}          # fetch function: open batch
+        self._cond = threading.Condition()
+        self.batches = 0
+        self.calls = 0
+
+    def __repr__(self):
+        return u'<BatchLoader window=%s max_size=%s>' % (self.window,
+                                                         self.max_size)
+
+    def load(self, key, fetch):
+        """
+        Returns the value for given key, or raises `KeyError` if there is no
+        such record. `fetch` is called with a list of keys of a batch (as byte
+        strings) and must return a dictionary of the found records by keys
+        encoded the same way.
+        """
+        name = utils.to_bytes(key)
+        self._cond.acquire()
+        try:
+            batch = self._open.get(fetch)
+            leader = batch is None
+            if leader:
+                batch = self._open[fetch] = _Batch()
+                self.batches += 1
+            self.calls += 1
+            batch.keys[name] = batch.keys.get(name, 0) + 1
+            if self.max_size <= len(batch.keys):
+                # the batch is full; let the leader send it right away
+                del self._open[fetch]
+                self._cond.notifyAll()
+            if leader:
+                deadline = time.time() + self.window
+                while self._open.get(fetch) is batch:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        del self._open[fetch]
+                        break
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        if leader:
+            try:
+                batch.results = fetch(list(batch.keys))
+            except:
+                batch.error = sys.exc_info()
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error[0], batch.error[1], batch.error[2]
+        if name not in batch.results:
+            raise KeyError(key)
+        value = batch.results[name]
+        if 1 < batch.keys[name]:
+            # the record is shared by several callers
+            value = copy.copy(value)
+        return value
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of calls of :meth:`load` and the
+        number of batches sent.
+        """
+        self._cond.acquire()
+        try:
+            return {'calls': self.calls, 'batches': self.batches}
+        finally:
+            self._cond.release()
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the protocol, the dictionary API and queries.
+
+Each workload is run a fixed number of times against a Tyrant server and the
+following figures are reported:
+
+* calls and records per second;
+* median (p50) and 99th percentile (p99) latency of a call;
+* bytes sent and received per call (counted on the client socket);
+* Python objects allocated by a call (counted by the garbage collector, so
+  only containers such as dictionaries and lists are included; the result of
+  the call is counted as well, and so are the objects kept by the in-process
+  stand-in server);
+* memory allocated during a call (its peak) and memory still held after it,
+  if the `tracemalloc` module is available (it is not a part of the standard
+  library in Python 2.x, but backports exist);
+* Python objects left over after the workload (a sign of leaks or caches).
+
+By default the workloads are run against an in-process
+:class:`~pyrant.server.TyrantServer` which can simulate network latency.
+Results can be saved as JSON and compared with a previous run::
+
+    $ python -m pyrant.bench --latency 0.5 --output 0.6.5.json
+    $ python -m pyrant.bench --latency 0.5 --compare 0.6.5.json
+
+A real server can be used instead::
+
+    $ python -m pyrant.bench --host 127.0.0.1 --port 1983 --records 100000
+
+.. warning:: the workloads remove all records from the database.
+
+The benchmarks can also be run from Python::
+
+    from pyrant import Tyrant
+    from pyrant.bench import run_workloads
+
+    results = run_workloads(Tyrant(port=1983), iterations=100)
+
+"""
+
+import gc
+import json
+import optparse
+import platform
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from pyrant import Tyrant, __version__
+from server import TyrantServer
+
+
+__all__ = ['Workload', 'WORKLOADS', 'run_workload', 'run_workloads']
+
+
+class _CountingSocket(object):
+    """
+    Wraps a socket and counts bytes going through it.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sent = 0
+        self.received = 0
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def sendall(self, data):
+        self._sock.sendall(data)
+        self.sent += len(data)
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        self.received += len(data)
+        return data
+
+    def recv_into(self, *args):
+        received = self._sock.recv_into(*args)
+        self.received += received
+        return received
+
+
+class Workload(object):
+    """
+    A benchmarked operation. Subclasses define :meth:`call` and optionally
+    :meth:`setup`.
+
+    :param batch: number of records processed by one call, if it applies to
+        the workload.
+    """
+
+    #: number of records processed by one call (may be set by setup)
+    records = 1
+
+    #: the workload needs a table database
+    table_only = False
+
+    #: number of calls relative to the requested number of iterations
+    weight = 1.0
+
+    def __init__(self, name, batch=None):
+        self.name = name
+        if batch:
+            self.records = batch
+
+    def __repr__(self):
+        return u'<Workload %s>' % self.name
+
+    def setup(self, t, dataset):
+        """
+        Prepares the database. `dataset` is the list of records generated
+        by :func:`make_dataset`.
+        """
+        t.clear()
+
+    def call(self, t, i):
+        "Runs the i-th call."
+        raise NotImplementedError  # pragma: nocover
+
+    def _fill(self, t, dataset):
+        t.clear()
+        for i in xrange(0, len(dataset), 1000):
+            t.multi_set(dataset[i:i + 1000])
+
+
+class _Get(Workload):
+    def setup(self, t, dataset):
+        self._fill(t, dataset)
+        self.keys = [k for k, v in dataset]
+
+    def call(self, t, i):
+        return t[self.keys[i % len(self.keys)]]
+
+
+class _Put(Workload):
+    def setup(self, t, dataset):
+        Workload.setup(self, t, dataset)
+        self.dataset = dataset
+
+    def call(self, t, i):
+        key, value = self.dataset[i % len(self.dataset)]
+        t[key] = value
+
+
+class _MultiGet(_Get):
+    def call(self, t, i):
+        start = (i * self.records) % len(self.keys)
+        return t.multi_get(self.keys[start:start + self.records])
+
+
+class _MultiSet(_Put):
+    def call(self, t, i):
+        start = (i * self.records) % len(self.dataset)
+        t.multi_set(self.dataset[start:start + self.records])
+
+
+class _MultiAdd(_Put):
+    def call(self, t, i):
+        start = (i * self.records) % len(self.dataset)
+        t.multi_add([v for k, v in self.dataset[start:start + self.records]])
+
+
+class _Scan(_Get):
+    weight = 0.01
+
+    def setup(self, t, dataset):
+        _Get.setup(self, t, dataset)
+        self.records = len(dataset)
+
+    def call(self, t, i):
+        for item in t.iteritems():
+            pass
+
+
+class _QuerySlice(_Get):
+    table_only = True
+
+    def call(self, t, i):
+        offset = (i * self.records) % len(self.keys)
+        query = t.query.filter(num__gte=len(self.keys) // 2)
+        return query.order_by('num', numeric=True)[offset:offset + self.records]
+
+
+#: available workloads in the order they are run
+WORKLOADS = [
+    _Get('get'),
+    _Put('put'),
+    _MultiGet('multi_get_10', 10),
+    _MultiGet('multi_get_100', 100),
+    _MultiGet('multi_get_1000', 1000),
+    _MultiSet('multi_set_10', 10),
+    _MultiSet('multi_set_100', 100),
+    _MultiSet('multi_set_1000', 1000),
+    _Scan('iteritems'),
+    _QuerySlice('query_slice_20', 20),
+    _MultiAdd('multi_add_100', 100),
+]
+
+
+def make_dataset(count, value_size=100, table=True):
+    """
+    Returns a list of `count` key/value pairs. Records of a table database
+    have a numeric column `num` and a string column `text` of `value_size`
+    characters.
+    """
+    dataset = []
+    for i in xrange(count):
+        key = 'key%08d' % i
+        text = ('%d ' % i * value_size)[:value_size]
+        if table:
+            value = {'name': 'Record %d' % i, 'num': str(i), 'text': text}
+        else:
+            value = text
+        dataset.append((key, value))
+    return dataset
+
+
+def _percentile(values, percent):
+    # nearest-rank percentile of a sorted list
+    if not values:
+        return None
+    index = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[index]
+
+
+def _measure_memory(t, workload, samples):
+    # returns the mean peak of memory allocated during a call and the mean
+    # size of memory still held after a call
+    tracemalloc.start()
+    try:
+        # clearing the traces also resets the peak, so each call is measured
+        # on its own
+        peak = 0
+        for i in xrange(samples):
+            tracemalloc.clear_traces()
+            workload.call(t, i)
+            peak += tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.clear_traces()
+        before = tracemalloc.take_snapshot()
+        for i in xrange(samples):
+            workload.call(t, i)
+        after = tracemalloc.take_snapshot()
+        held = sum(stat.size_diff
+                   for stat in after.compare_to(before, 'filename'))
+    finally:
+        tracemalloc.stop()
+    return peak // samples, held // samples
+
+
+def _count_objects(t, workload, samples):
+    # returns the mean number of objects tracked by the garbage collector
+    # which a call leaves alive, including its result
+    created = 0
+    for i in xrange(samples):
+        gc.collect()
+        gc.disable()
+        try:
+            before = len(gc.get_objects())
+            result = workload.call(t, i)
+            created += len(gc.get_objects()) - before
+            del result
+        finally:
+            gc.enable()
+    return round(float(created) / samples, 1)
+
+
+def run_workload(t, workload, dataset, iterations=1000):
+    """
+    Runs given workload and returns the results as a dictionary.
+
+    :param t: a :class:`~pyrant.Tyrant` instance (not based on a pool).
+    :param workload: a :class:`Workload` instance.
+    :param dataset: the records to work with (see :func:`make_dataset`).
+    :param iterations: number of calls (multiplied by the workload's weight).
+    """
+    calls = max(1, int(iterations * workload.weight))
+    workload.setup(t, dataset)
+
+    sock = _CountingSocket(t.proto._sock._sock)
+    t.proto._sock._sock = sock
+    gc.collect()
+    objects = len(gc.get_objects())
+    timings = []
+    try:
+        started = time.time()
+        for i in xrange(calls):
+            call_started = time.time()
+            workload.call(t, i)
+            timings.append(time.time() - call_started)
+        elapsed = time.time() - started
+    finally:
+        t.proto._sock._sock = sock._sock
+    gc.collect()
+    objects = len(gc.get_objects()) - objects
+
+    # separate passes: counting slows the calls down
+    created = _count_objects(t, workload, min(calls, 100))
+    allocated = retained = None
+    if tracemalloc is not None:
+        # separate passes: tracing slows the calls down
+        allocated, retained = _measure_memory(t, workload, min(calls, 100))
+
+    timings.sort()
+    ms = lambda x: round(x * 1000, 3)
+    return {
+        'workload': workload.name,
+        'calls': calls,
+        'records_per_call': workload.records,
+        'seconds': round(elapsed, 6),
+        'calls_per_sec': round(calls / elapsed, 1) if elapsed else None,
+        'records_per_sec': (round(calls * workload.records / elapsed, 1)
+                            if elapsed else None),
+        'p50_ms': ms(_percentile(timings, 50)),
+        'p99_ms': ms(_percentile(timings, 99)),
+        'bytes_sent_per_call': sock.sent // calls,
+        'bytes_received_per_call': sock.received // calls,
+        'objects_allocated_per_call': created,
+        'bytes_allocated_per_call': allocated,
+        'bytes_retained_per_call': retained,
+        'objects_left': objects,
+    }
+
+
+def run_workloads(t, names=None, records=10000, value_size=100,
+                  iterations=1000, callback=None):
+    """
+    Runs workloads with given names (all by default) and returns the list of
+    results (see :func:`run_workload`). Workloads that need a table database
+    are skipped for other database types. `callback`, if set, is called with
+    each result as soon as it is ready.
+    """
+    table = t.table_enabled
+    dataset = make_dataset(records, value_size, table=table)
+    results = []
+    for workload in WORKLOADS:
+        if names is not None and workload.name not in names:
+            continue
+        if workload.table_only and not table:
+            continue
+        result = run_workload(t, workload, dataset, iterations)
+        results.append(result)
+        if callback:
+            callback(result)
+    t.clear()
+    return results
+
+
+def format_result(result, baseline=None):
+    """
+    Returns a line of text describing given result. If `baseline` (a result
+    of the same workload) is given, the change in speed is appended.
+    """
+    line = ('%(workload)-16s %(calls_per_sec)12s calls/s %(records_per_sec)12s '
+            'rec/s  p50 %(p50_ms)9.3f ms  p99 %(p99_ms)9.3f ms  '
+            '%(bytes_sent_per_call)9d B out  %(bytes_received_per_call)9d B in'
+            % result)
+    if result.get('objects_allocated_per_call') is not None:
+        line += '  %9.1f obj' % result['objects_allocated_per_call']
+    if result['bytes_allocated_per_call'] is not None:
+        line += '  %9d B alloc' % result['bytes_allocated_per_call']
+        line += '  %9d B held' % result['bytes_retained_per_call']
+    if baseline and baseline.get('calls_per_sec') and result['calls_per_sec']:
+        change = result['calls_per_sec'] / baseline['calls_per_sec'] - 1
+        line += '  %+.1f%%' % (change * 100)
+    return line
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(description='Runs pyrant benchmarks.')
+    parser.add_option('--host', help='Tyrant host; if not set, an in-process '
+                      'stand-in server is started')
+    parser.add_option('-p', '--port', type='int', default=1978)
+    parser.add_option('--latency', type='float', default=0,
+                      help='simulated round-trip time in milliseconds (only '
+                      'for the stand-in server)')
+    parser.add_option('-n', '--iterations', type='int', default=1000,
+                      help='number of calls per workload [%default]')
+    parser.add_option('-r', '--records', type='int', default=10000,
+                      help='number of records in the database [%default]')
+    parser.add_option('-s', '--value-size', type='int', default=100,
+                      help='size of each value in bytes [%default]')
+    parser.add_option('-w', '--workloads', help='comma-separated names of '
+                      'workloads to run: %s' % ', '.join(w.name for w in WORKLOADS))
+    parser.add_option('-o', '--output', help='save the results as JSON')
+    parser.add_option('-c', '--compare', help='compare with the results saved '
+                      'in given JSON file')
+    options, args = parser.parse_args(argv)
+
+    server = None
+    if options.host:
+        host, port = options.host, options.port
+    else:
+        server = TyrantServer(latency=options.latency / 1000.0).start()
+        host, port = server.host, server.port
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = dict((x['workload'], x) for x in json.load(f)['results'])
+
+    names = options.workloads.split(',') if options.workloads else None
+    t = Tyrant(host=host, port=port)
+    show = lambda result: sys.stdout.write(
+        format_result(result, baseline.get(result['workload'])) + '\n')
+    try:
+        results = run_workloads(t, names, records=options.records,
+                                value_size=options.value_size,
+                                iterations=options.iterations, callback=show)
+    finally:
+        if server:
+            server.stop()
+
+    if options.output:
+        report = {
+            'pyrant': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'server': 'stand-in' if server else '%s:%s' % (host, port),
+            'latency_ms': options.latency if server else None,
+            'options': {'iterations': options.iterations,
+                        'records': options.records,
+                        'value_size': options.value_size},
+            'results': results,
+        }
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side caching of records.
+
+A :class:`RecordCache` keeps recently read records in memory so that hot
+keys do not cost a round trip to the server and a conversion each time they
+are read::
+
+    from pyrant import Tyrant
+    from pyrant.cache import RecordCache
+
+    t = Tyrant(cache=RecordCache(max_items=10000, ttl=60))
+    t['foo']                # fetched from the server
+    t['foo']                # taken from the cache
+    t.cache.stats()['hits']
+
+The cache is consulted by :meth:`~pyrant.Tyrant.__getitem__`,
+:meth:`~pyrant.Tyrant.get`, :meth:`~pyrant.Tyrant.multi_get` (only the missing
+keys are requested from the server) and ``in``. The least recently used
+records are evicted when the number of records exceeds `max_items` or their
+approximate size exceeds `max_bytes`; records older than `ttl` seconds are
+fetched again.
+
+Writes made through the same :class:`~pyrant.Tyrant` instance (including its
+:meth:`~pyrant.Tyrant.buffered` writers) drop the affected records from the
+cache. Changes made by other clients, by :class:`~pyrant.query.Query` (e.g.
+``delete``) or directly via :class:`~pyrant.protocol.TyrantProtocol` are not
+noticed; use `ttl` to limit how stale the cached records may become.
+"""
+
+import collections
+import threading
+import time
+
+import utils
+
+
+__all__ = ['RecordCache', 'sizeof']
+
+
+def _length(value):
+    if value is None:
+        return 0
+    if isinstance(value, basestring):
+        return len(value)
+    return len(str(value))
+
+
+def sizeof(key, value):
+    """
+    Returns the approximate size of a record: the total length of its key
+    and of the strings it consists of (column names and values for tables,
+    items for lists). Other values count as long as their string form.
+    """
+    size = _length(key)
+    if isinstance(value, dict):
+        for k, v in value.iteritems():
+            size += _length(k) + _length(v)
+    elif isinstance(value, list):
+        for v in value:
+            size += _length(v)
+    else:
+        size += _length(value)
+    return size
+
+
+def _copy(value):
+    # callers may modify returned records; the cached ones must stay intact
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class RecordCache(object):
+    """
+    A thread-safe LRU cache of converted records.
+
+    :param max_items: maximum number of cached records.
+    :param max_bytes: maximum approximate size of cached keys and values.
+        Default is `None` (no limit).
+    :param ttl: number of seconds after which a cached record is fetched
+        again. Default is `None` (records do not expire).
+    """
+
+    def __init__(self, max_items=10000, max_bytes=None, ttl=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # key: (value, size, expires)
+        self._size = 0
+        # incremented on each invalidation; records read before that are not
+        # stored, so a concurrent write cannot be shadowed by an older value
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def __contains__(self, key):
+        self._lock.acquire()
+        try:
+            return self._lookup(key) is not None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return u'<RecordCache %d of %s items>' % (len(self._entries),
+                                                  self.max_items)
+
+    def _lookup(self, key):
+        # must be called with the lock acquired; returns the entry or None
+        key = utils.to_bytes(key)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] is not None and entry[2] <= time.time():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        # mark as recently used
+        del self._entries[key]
+        self._entries[key] = entry
+        return entry
+
+    def _remove(self, key):
+        # must be called with the lock acquired
+        entry = self._entries.pop(utils.to_bytes(key), None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    @property
+    def generation(self):
+        """
+        A number which changes whenever records are invalidated. Pass it to
+        :meth:`set` along with values read from the server.
+        """
+        return self._generation
+
+    def get(self, key):
+        """
+        Returns a tuple ``(found, value)``. Counts a hit or a miss.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.hits += 1
+            return True, _copy(entry[0])
+        finally:
+            self._lock.release()
+
+    def get_many(self, keys):
+        """
+        Returns a dictionary of the cached records among given keys and a list
+        of the keys that are not cached. Counts hits and misses.
+        """
+        found = {}
+        missing = []
+        self._lock.acquire()
+        try:
+            for key in keys:
+                entry = self._lookup(key)
+                if entry is None:
+                    missing.append(key)
+                else:
+                    found[key] = _copy(entry[0])
+            self.hits += len(found)
+            self.misses += len(missing)
+            return found, missing
+        finally:
+            self._lock.release()
+
+    def set(self, key, value, generation=None):
+        """
+        Stores a record. If `generation` is given and records have been
+        invalidated since it was obtained, the record is not stored.
+        """
+        self.set_many([(key, value)], generation)
+
+    def set_many(self, pairs, generation=None):
+        """
+        Stores given key/value pairs (see :meth:`set`).
+        """
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._lock.acquire()
+        try:
+            if generation is not None and generation != self._generation:
+                return
+            for key, value in pairs:
+                self._remove(key)
+                size = sizeof(key, value)
+                self._entries[utils.to_bytes(key)] = (_copy(value), size,
+                                                      expires)
+                self._size += size
+            self._evict()
+        finally:
+            self._lock.release()
+
+    def _evict(self):
+        # must be called with the lock acquired
+        while self._entries and (
+                self.max_items < len(self._entries) or
+                self.max_bytes is not None and self.max_bytes < self._size):
+            key, entry = self._entries.popitem(last=False)
+            self._size -= entry[1]
+            self.evictions += 1
+
+    def invalidate(self, keys):
+        """
+        Drops given records from the cache.
+        """
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            for key in keys:
+                self._remove(key)
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """
+        Drops all records from the cache.
+        """
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            self._entries.clear()
+            self._size = 0
+        finally:
+            self._lock.release()
+
+    def reset_stats(self):
+        "Resets the counters returned by :meth:`stats`."
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of hits, misses, evictions and
+        expirations, the hit ratio, and the number and approximate size of
+        cached records.
+        """
+        self._lock.acquire()
+        try:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'hit_ratio': float(self.hits) / lookups if lookups else None,
+                    'items': len(self._entries), 'bytes': self._size}
+        finally:
+            self._lock.release()
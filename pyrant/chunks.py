@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive chunk sizing.
+
+Records are read in chunks by :class:`~pyrant.query.Query` and
+:meth:`~pyrant.Tyrant.iteritems`. A fixed chunk size is a compromise: a
+thousand tiny records make a needlessly short response while a thousand
+records of a megabyte each make a huge one. An :class:`AdaptiveChunkSize`
+observes the size of the fetched records and the time each chunk took, and
+picks the number of records for the next chunk so that a response is close to
+`target_bytes` (and, if set, takes about `target_seconds`)::
+
+    from pyrant.chunks import AdaptiveChunkSize
+
+    sizer = AdaptiveChunkSize(target_bytes=256 * 1024, max_size=5000)
+
+    q = t.query.filter(...)
+    q.set_chunk_size(sizer)
+
+    for key, value in t.iteritems(chunk_size=sizer):
+        ...
+
+An instance can be shared by many queries (and threads); it then keeps
+learning from all of them.
+"""
+
+import threading
+
+
+__all__ = ['AdaptiveChunkSize']
+
+
+class AdaptiveChunkSize(object):
+    """
+    Adjusts the number of records per chunk to observed record sizes and
+    response times.
+
+    :param initial: the size of the first chunk.
+    :param min_size: the smallest allowed chunk size.
+    :param max_size: the largest allowed chunk size.
+    :param target_bytes: desired approximate size of a response. `None`
+        disables the limit.
+    :param target_seconds: desired time of fetching a chunk. `None` (default)
+        disables the limit. If the round trip alone takes longer than that,
+        the chunk size drops to `min_size`.
+    :param smoothing: weight of the latest observation in the moving
+        averages, from 0 (ignore new data) to 1 (only use the latest data).
+
+    The size changes at most by a factor of two per observation, so a single
+    unusual chunk does not throw it off.
+    """
+
+    def __init__(self, initial=1000, min_size=10, max_size=100000,
+                 target_bytes=512 * 1024, target_seconds=None, smoothing=0.3):
+        assert 0 < min_size <= initial <= max_size, 'wrong size bounds'
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.bytes_per_record = None
+        self.seconds_per_record = None
+        self._size = initial
+        self._lock = threading.Lock()
+
+    def __int__(self):
+        return self.size
+
+    def __repr__(self):
+        return u'<AdaptiveChunkSize %d>' % self._size
+
+    @property
+    def size(self):
+        "The number of records for the next chunk."
+        return self._size
+
+    def _average(self, old, new):
+        if old is None:
+            return new
+        return old + self.smoothing * (new - old)
+
+    def observe(self, records, size, seconds=None):
+        """
+        Takes into account a fetched chunk of given number of records, their
+        approximate total size in bytes and the time it took to fetch them.
+        """
+        if not records:
+            return
+        self._lock.acquire()
+        try:
+            self.bytes_per_record = self._average(self.bytes_per_record,
+                                                  float(size) / records)
+            if seconds is not None:
+                self.seconds_per_record = self._average(
+                    self.seconds_per_record, float(seconds) / records)
+
+            wanted = [self.max_size]
+            if self.target_bytes is not None:
+                wanted.append(self.target_bytes /
+                              max(self.bytes_per_record, 1.0))
+            if (self.target_seconds is not None and
+                self.seconds_per_record is not None):
+                wanted.append(self.target_seconds /
+                              max(self.seconds_per_record, 1e-9))
+            new = min(wanted)
+            new = min(max(new, self._size / 2.0), self._size * 2.0)
+            self._size = int(min(max(new, self.min_size), self.max_size))
+        finally:
+            self._lock.release()
@@ -6,7 +6,7 @@ If you know error code, use `get_for_code(code)` to retrieve exception instance.
 
 __all__ = ['Success', 'InvalidOperation', 'HostNotFound', 'ConnectionRefused',
            'SendError', 'ReceiveError', 'RecordExists', 'RecordNotFound',
-           'MiscellaneousError', 'get_for_code']
+           'MiscellaneousError', 'PoolTimeout', 'get_for_code']
 
 
 class TyrantError(Exception):
@@ -45,6 +45,13 @@ class RecordNotFound(TyrantError):
 class MiscellaneousError(TyrantError):
     pass
 
+class PoolTimeout(Exception):
+    """
+    No connection could be checked out of a :class:`~pyrant.pool.TyrantPool`
+    in time. This is not a :class:`TyrantError` as the server is not involved.
+    """
+    pass
+
 
 ERROR_CODE_TO_CLASS = {
     0: Success,
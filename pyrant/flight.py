@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Coalescing of concurrent identical reads.
+
+When many threads read the same hot record at once (e.g. right after it has
+expired from an application cache), each of them would normally send its own
+request. With a :class:`SingleFlight` only the first thread sends the request
+and the others wait for it and share its result::
+
+    from pyrant import Tyrant
+    from pyrant.flight import SingleFlight
+    from pyrant.pool import TyrantPool
+
+    t = Tyrant(pool=TyrantPool('10.0.0.1', 1978), flight=SingleFlight())
+
+Reads of a record (:meth:`~pyrant.Tyrant.__getitem__` and
+:meth:`~pyrant.Tyrant.get`) are coalesced by key, and searches made by
+:class:`~pyrant.query.Query` objects by their parameters. Searches which remove
+records are never coalesced. Only calls which overlap in time are merged;
+nothing is kept once the request is complete (see :mod:`pyrant.cache` for
+that).
+
+This only makes sense if the :class:`~pyrant.Tyrant` instance is shared by
+threads, i.e. if it is built on a :class:`~pyrant.pool.TyrantPool`.
+"""
+
+import copy
+import sys
+import threading
+
+
+__all__ = ['SingleFlight']
+
+
+class _Call(object):
+    # a call in progress
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time. Can be shared by many
+    :class:`~pyrant.Tyrant` instances as long as they are connected to the
+    same server.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0        # calls actually made
+        self.shared = 0       # calls answered by another thread's call
+
+    def __repr__(self):
+        return u'<SingleFlight %d in flight>' % len(self._calls)
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls `func` with given arguments unless a call with the same `key` is
+        already in progress; in that case waits for it and returns its result
+        (a shallow copy of it) or raises its exception.
+        """
+        self._lock.acquire()
+        try:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.shared += 1
+        finally:
+            self._lock.release()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error[0], call.error[1], call.error[2]
+            return copy.copy(call.result)
+
+        try:
+            call.result = func(*args, **kwargs)
+        except:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            self._lock.acquire()
+            try:
+                del self._calls[key]
+            finally:
+                self._lock.release()
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        """
+        Returns a dictionary with the number of calls made, the number of
+        calls answered by another thread's call and the number of calls in
+        progress.
+        """
+        self._lock.acquire()
+        try:
+            return {'calls': self.calls, 'shared': self.shared,
+                    'in_flight': len(self._calls)}
+        finally:
+            self._lock.release()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Server metadata.
+
+Tokyo Tyrant reports its metadata (database type and path, number of records,
+replication settings, etc.) via the `stat` command. :class:`ServerInfo` keeps
+a parsed snapshot of that report so that code which needs e.g. the database
+type does not have to ask the server every time.
+"""
+
+import time
+
+import utils
+
+
+__all__ = ['ServerInfo']
+
+
+class ServerInfo(object):
+    """
+    A snapshot of server metadata as reported by
+    :meth:`~pyrant.protocol.TyrantProtocol.stat`. The data is fetched on first
+    access and then kept until :meth:`refresh` is called or, if `ttl` is set,
+    until the snapshot becomes older than `ttl` seconds.
+
+    :param proto: a :class:`~pyrant.protocol.TyrantProtocol` instance.
+    :param ttl: number of seconds after which the snapshot is refreshed on
+        access. Default is `None` (never). Note that some values (database
+        type and path) never change while others (number of records, size)
+        change with every write.
+
+    Usage::
+
+        info = ServerInfo(proto)
+        info.db_type      # fetches the data
+        info.rnum         # uses the same snapshot
+        info.refresh()    # fetches the data again
+
+    Raw values are available via :attr:`stats`.
+    """
+
+    def __init__(self, proto, ttl=None):
+        self._proto = proto
+        self._stats = None
+        self.ttl = ttl
+        self.fetched_at = None
+
+    def __repr__(self):
+        return u'<ServerInfo %s>' % (self._stats or 'not fetched')
+
+    def refresh(self):
+        """
+        Fetches a fresh snapshot from the server. Returns the instance.
+        """
+        self._stats = utils.csv_to_dict(self._proto.stat())
+        self.fetched_at = time.time()
+        return self
+
+    @property
+    def stats(self):
+        """
+        The dictionary of raw (string) values.
+        """
+        if self._stats is None or (self.ttl is not None and
+                                   self.fetched_at + self.ttl <= time.time()):
+            self.refresh()
+        return self._stats
+
+    def _get_int(self, name):
+        value = self.stats.get(name)
+        return int(value) if value else None
+
+    def _get_float(self, name):
+        value = self.stats.get(name)
+        return float(value) if value else None
+
+    @property
+    def db_type(self):
+        "Database type, one of `pyrant.protocol.DB_*` constants."
+        db_type = self.stats.get('type')
+        assert db_type, 'statistics must provide a valid database type'
+        return db_type
+
+    @property
+    def path(self):
+        "Path to the database file."
+        assert 'path' in self.stats, 'statistics must provide a database path'
+        return self.stats['path']
+
+    @property
+    def rnum(self):
+        "Number of records."
+        return self._get_int('rnum')
+
+    @property
+    def size(self):
+        "Size of the database in bytes."
+        return self._get_int('size')
+
+    @property
+    def version(self):
+        "Version of Tokyo Tyrant."
+        return self.stats.get('version')
+
+    @property
+    def master_host(self):
+        "Host of the replication master or `None`."
+        return self.stats.get('mhost') or None
+
+    @property
+    def master_port(self):
+        "Port of the replication master or `None`."
+        return self._get_int('mport') or None
+
+    @property
+    def replication_delay(self):
+        "Replication delay in seconds (`None` if not reported)."
+        return self._get_float('delay')
+
+    @property
+    def replication_timestamp(self):
+        """
+        Position in the update log of the master, i.e. the timestamp (in
+        microseconds) of the last replicated update (`None` if not reported).
+        """
+        return self._get_int('rts')
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Per-command instrumentation of the protocol layer.
+
+An instrument can be attached to a connection to observe each command sent
+over it::
+
+    from pyrant import Tyrant
+    from pyrant.instrument import Collector
+
+    collector = Collector()
+    t = Tyrant(instrument=collector)    # or TyrantPool(..., instrument=...)
+    ...
+    collector.report()['get']['wait']['p99']
+
+For each call of a :class:`~pyrant.protocol.TyrantProtocol` command a
+:class:`CommandEvent` is passed to :meth:`Instrument.record`. The event holds
+the number of bytes sent and received, the time spent waiting for the server
+(from the start of the call until the first bytes of the response arrived)
+and the time spent receiving the rest and parsing it. A pipeline is recorded
+as one ``pipeline`` event. :class:`Collector` aggregates the events per command
+in constant memory (see :class:`Histogram`) and passes them on to callbacks,
+which is the place to hook up an external metrics system.
+
+Connections without an instrument are not affected in any way: the
+instrumented code paths are only installed on connections that have one.
+"""
+
+import collections
+import math
+import threading
+import time
+
+from protocol import Pipeline, _TyrantSocket
+
+
+__all__ = ['CommandEvent', 'Instrument', 'Collector', 'CommandStats',
+           'Histogram']
+
+
+#: Describes a single command call. `name` is the name of the protocol method
+#: (for `misc` and `ext` the function name is appended, e.g. ``misc:getlist``),
+#: `code` is the command code sent first (`None` for pipelines), times are in
+#: seconds and `error` is the exception raised by the call, if any.
+CommandEvent = collections.namedtuple('CommandEvent', 'name code bytes_sent '
+                                      'bytes_received wait parse error')
+
+
+class _MeteredSocket(object):
+    """
+    Wraps a raw socket and keeps track of the traffic of the current command.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+        self.sent = 0
+        self.received = 0
+        self.code = None
+        self.first_received_at = None
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def start(self):
+        self.code = None
+        self.first_received_at = None
+
+    def sendall(self, data):
+        if self.code is None and 1 < len(data):
+            self.code = ord(data[1])
+        self._sock.sendall(data)
+        self.sent += len(data)
+
+    def _received(self, size):
+        if self.first_received_at is None:
+            self.first_received_at = time.time()
+        self.received += size
+
+    def recv(self, *args):
+        data = self._sock.recv(*args)
+        self._received(len(data))
+        return data
+
+    def recv_into(self, *args):
+        size = self._sock.recv_into(*args)
+        self._received(size)
+        return size
+
+
+#: commands which return lazy iterators over the response
+STREAMING = ('iter_mget', 'iter_misc')
+
+#: commands whose first argument is a function name
+NAMED = ('misc', 'iter_misc', 'ext')
+
+_instrumented_classes = {}
+
+
+def _wrap(name, method):
+    def call(self, *args, **kwargs):
+        if self._metered or type(self._sock) is not _TyrantSocket:
+            # nested commands (e.g. `search` calls `misc`) and pipelines
+            return method(self, *args, **kwargs)
+        label = name
+        if name in NAMED and args:
+            label = '%s:%s' % (name, args[0])
+        return self.instrument.run(self, label, method, self, *args, **kwargs)
+
+    call.__name__ = name
+    call.__doc__ = method.__doc__
+    return call
+
+
+def _instrumented_class(cls):
+    # a subclass of given protocol class with all commands measured
+    if cls not in _instrumented_classes:
+        attrs = {'_metered': False}
+        for name in Pipeline.COMMANDS + STREAMING:
+            attrs[name] = _wrap(name, getattr(cls, name).im_func)
+        _instrumented_classes[cls] = type(cls.__name__, (cls,), attrs)
+    return _instrumented_classes[cls]
+
+
+class Instrument(object):
+    """
+    Base class for instruments. Subclasses override :meth:`record`.
+    """
+
+    def attach(self, proto):
+        """
+        Installs the instrument on given
+        :class:`~pyrant.protocol.TyrantProtocol` instance. Called by the
+        protocol itself.
+        """
+        proto.instrument = self
+        proto._meter = _MeteredSocket(proto._sock._sock)
+        proto._sock._sock = proto._meter
+        proto.__class__ = _instrumented_class(type(proto))
+
+    def attach_socket(self, proto):
+        """
+        Keeps metering the traffic of given protocol after it has opened a new
+        connection (see :meth:`~pyrant.protocol.TyrantProtocol.reconnect`).
+        """
+        proto._meter._sock = proto._sock._sock
+        proto._sock._sock = proto._meter
+
+    def run(self, proto, name, func, *args, **kwargs):
+        """
+        Calls `func` with given arguments, measures the traffic over the
+        connection of `proto` and records the event under given name.
+        """
+        sock = proto._meter
+        sock.start()
+        sent, received = sock.sent, sock.received
+        started = time.time()
+        proto._metered = True
+        try:
+            result = func(*args, **kwargs)
+        except Exception, e:
+            self._finish(name, sock, sent, received, started, e)
+            raise
+        finally:
+            proto._metered = False
+        if name.split(':')[0] in STREAMING:
+            return self._stream(result, name, sock, sent, received, started)
+        self._finish(name, sock, sent, received, started, None)
+        return result
+
+    def _stream(self, items, name, sock, sent, received, started):
+        # the event is recorded when the response has been read completely
+        error = None
+        try:
+            for item in items:
+                yield item
+        except Exception, e:
+            error = e
+            raise
+        finally:
+            self._finish(name, sock, sent, received, started, error)
+
+    def _finish(self, name, sock, sent, received, started, error):
+        finished = time.time()
+        arrived = sock.first_received_at or started
+        code = None if name == 'pipeline' else sock.code
+        self.record(CommandEvent(name, code, sock.sent - sent,
+                                 sock.received - received,
+                                 arrived - started, finished - arrived, error))
+
+    def record(self, event):
+        """
+        Processes a :class:`CommandEvent`. Does nothing by default.
+        """
+        pass
+
+
+class Histogram(object):
+    """
+    A histogram with logarithmic buckets. Memory usage does not depend on the
+    number of recorded values; percentiles are accurate to within a few
+    percent.
+
+    :param lowest: values up to this one fall into the first bucket.
+    :param highest: values above this one fall into the last bucket.
+    :param precision: number of buckets per doubling of the value.
+
+    Usage::
+
+        >>> from pyrant.instrument import Histogram
+        >>> h = Histogram()
+        >>> for i in xrange(1, 101):
+        ...     h.add(i / 1000.0)
+        >>> h.count
+        100
+        >>> 0.048 < h.percentile(50) < 0.053
+        True
+
+    """
+
+    def __init__(self, lowest=1e-6, highest=100.0, precision=16):
+        self.lowest = lowest
+        self.highest = highest
+        self._scale = precision / math.log(2)
+        self.buckets = [0] * (self._index(highest) + 2)
+        self.reset()
+
+    def __repr__(self):
+        return u'<Histogram count=%d p50=%s p99=%s>' % (
+            self.count, self.percentile(50), self.percentile(99))
+
+    def _index(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.log(value / self.lowest) * self._scale) + 1
+
+    def add(self, value):
+        "Records a value."
+        index = min(self._index(value), len(self.buckets) - 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or self.max < value:
+            self.max = value
+
+    def merge(self, other):
+        "Adds values recorded by another histogram of the same layout."
+        assert len(self.buckets) == len(other.buckets), 'layouts differ'
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in other.min, other.max:
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def reset(self):
+        "Drops all recorded values."
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent):
+        """
+        Returns the approximate value below which given percent of recorded
+        values fall, or `None` if nothing has been recorded.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(math.ceil(percent / 100.0 * self.count)))
+        if self.count <= rank:
+            return self.max
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if rank <= seen:
+                break
+        if not index:
+            upper = self.lowest
+        else:
+            # geometric middle of the bucket
+            upper = self.lowest * math.exp((index - 0.5) / self._scale)
+        return min(max(upper, self.min), self.max)
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.total, 'min': self.min,
+                'max': self.max, 'mean': self.mean,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class CommandStats(object):
+    """
+    Aggregated statistics of a command: number of calls and errors, bytes
+    sent and received, and histograms of the server wait time and the parse
+    time.
+    """
+
+    def __init__(self, name, code=None):
+        self.name = name
+        self.code = code
+        self.calls = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.wait = Histogram()
+        self.parse = Histogram()
+
+    def __repr__(self):
+        return u'<CommandStats %s: %d calls>' % (self.name, self.calls)
+
+    def add(self, event):
+        if self.code is None:
+            self.code = event.code
+        self.calls += 1
+        if event.error is not None:
+            self.errors += 1
+        self.bytes_sent += event.bytes_sent
+        self.bytes_received += event.bytes_received
+        self.wait.add(event.wait)
+        self.parse.add(event.parse)
+
+    def as_dict(self):
+        return {'code': self.code, 'calls': self.calls, 'errors': self.errors,
+                'bytes_sent': self.bytes_sent,
+                'bytes_received': self.bytes_received,
+                'wait': self.wait.as_dict(), 'parse': self.parse.as_dict()}
+
+
+class Collector(Instrument):
+    """
+    An instrument which aggregates events per command name (see
+    :class:`CommandStats`). Can be shared by many connections and threads.
+
+    :param callbacks: a list of functions to be called with each
+        :class:`CommandEvent`.
+
+    Note that errors reported by the server (e.g. a missing key for `get`)
+    count as errors, too.
+    """
+
+    def __init__(self, callbacks=None):
+        self.callbacks = list(callbacks or [])
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        self._lock.acquire()
+        try:
+            stats = self.stats.get(event.name)
+            if stats is None:
+                stats = self.stats[event.name] = CommandStats(event.name)
+            stats.add(event)
+        finally:
+            self._lock.release()
+        for callback in self.callbacks:
+            callback(event)
+
+    def report(self):
+        """
+        Returns the statistics as a dictionary of command names and
+        dictionaries of values.
+        """
+        self._lock.acquire()
+        try:
+            return dict((name, stats.as_dict())
+                        for name, stats in self.stats.iteritems())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        "Drops all collected statistics."
+        self._lock.acquire()
+        try:
+            self.stats = {}
+        finally:
+            self._lock.release()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Primary key allocation for new records.
+
+:meth:`~pyrant.Tyrant.multi_add` needs a key for each record. Keys are
+obtained from a key allocator in batches, one batch per chunk of records.
+Three allocators are available:
+
+* :class:`GenuidAllocator` (default) asks the server for unique numeric keys
+  just like :meth:`~pyrant.protocol.TyrantProtocol.genuid`, but pipelines the
+  requests so that a whole batch costs one round trip;
+* :class:`CounterAllocator` reserves ranges of numbers by incrementing a
+  counter record with `addint`, so one round trip yields thousands of keys;
+* :class:`TimeOrderedAllocator` generates unique, time-ordered keys on the
+  client without contacting the server at all.
+
+Usage::
+
+    from pyrant import Tyrant
+    from pyrant.keys import TimeOrderedAllocator
+
+    t = Tyrant(key_allocator=TimeOrderedAllocator())
+    keys = t.multi_add(records)
+
+"""
+
+import os
+import random
+import threading
+import time
+import uuid
+
+
+__all__ = ['KeyAllocator', 'GenuidAllocator', 'CounterAllocator',
+           'TimeOrderedAllocator']
+
+
+class KeyAllocator(object):
+    """
+    Base class for key allocators.
+    """
+
+    def allocate(self, count):
+        """
+        Returns a list of `count` new unique keys.
+        """
+        raise NotImplementedError  # pragma: nocover
+
+
+class GenuidAllocator(KeyAllocator):
+    """
+    Obtains keys from the server's `genuid` function. All keys of a batch are
+    requested in one pipeline. If the server cannot generate a key (e.g. the
+    database is not a table one), a UUID is used instead.
+
+    :param proto: a :class:`~pyrant.protocol.TyrantProtocol` instance.
+    """
+
+    def __init__(self, proto):
+        self.proto = proto
+
+    def allocate(self, count):
+        if count == 1:
+            # no need for a pipeline
+            try:
+                return [self.proto.genuid()]
+            except ValueError:
+                return [uuid.uuid4()]
+        pipe = self.proto.pipeline()
+        for i in xrange(count):
+            pipe.genuid()
+        keys = pipe.execute()
+        return [uuid.uuid4() if isinstance(key, Exception) else key
+                for key in keys]
+
+
+class CounterAllocator(KeyAllocator):
+    """
+    Reserves ranges of numeric keys by incrementing a counter stored in the
+    database under `counter_key`. Each reservation is one `addint` command
+    and yields at least `chunk_size` keys; unused keys of a range are lost
+    when the allocator is discarded.
+
+    :param proto: a :class:`~pyrant.protocol.TyrantProtocol` instance.
+    :param counter_key: the key of the counter record. Note that the record
+        is visible to other operations (e.g. it is returned by `keys()`).
+    :param chunk_size: minimum number of keys reserved at once.
+    :param prefix: a string prepended to each key.
+
+    Keys do not collide with each other across processes that share the
+    counter, but they may collide with keys generated by `genuid`.
+    """
+
+    def __init__(self, proto, counter_key=u'_pyrant_key_counter',
+                 chunk_size=1000, prefix=u''):
+        self.proto = proto
+        self.counter_key = counter_key
+        self.chunk_size = chunk_size
+        self.prefix = prefix
+        self._next = 0
+        self._end = 0    # the range is [_next, _end)
+        self._lock = threading.Lock()
+
+    def _reserve(self, count):
+        # must be called with the lock acquired
+        size = max(count, self.chunk_size)
+        last = self.proto.addint(self.counter_key, size)
+        self._next, self._end = last - size + 1, last + 1
+
+    def allocate(self, count):
+        self._lock.acquire()
+        try:
+            keys = []
+            while len(keys) < count:
+                if self._next == self._end:
+                    self._reserve(count - len(keys))
+                take = min(count - len(keys), self._end - self._next)
+                keys.extend(u'%s%d' % (self.prefix, n)
+                            for n in xrange(self._next, self._next + take))
+                self._next += take
+            return keys
+        finally:
+            self._lock.release()
+
+
+class TimeOrderedAllocator(KeyAllocator):
+    """
+    Generates 24-character hexadecimal keys on the client. A key consists of
+    the time in milliseconds, a sequence number within the millisecond and a
+    random number identifying the allocator, so keys sort roughly by time of
+    creation and do not collide across processes.
+    """
+
+    def __init__(self):
+        self.node = random.SystemRandom().getrandbits(32) ^ os.getpid()
+        self._last = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def allocate(self, count):
+        self._lock.acquire()
+        try:
+            keys = []
+            for i in xrange(count):
+                now = int(time.time() * 1000)
+                if self._last < now:
+                    self._last, self._seq = now, 0
+                else:
+                    # same millisecond (or the clock went back)
+                    self._seq += 1
+                    if 0xffff < self._seq:
+                        self._last, self._seq = self._last + 1, 0
+                keys.append(u'%012x%04x%08x' % (self._last, self._seq,
+                                                self.node & 0xffffffff))
+            return keys
+        finally:
+            self._lock.release()
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics export.
+
+:class:`MetricsExporter` combines client-side statistics collected by a
+:class:`~pyrant.instrument.Collector` with the server status report and
+renders them in the Prometheus text exposition format::
+
+    from pyrant import Tyrant
+    from pyrant.instrument import Collector
+    from pyrant.metrics import MetricsExporter
+
+    collector = Collector()
+    t = Tyrant(host='10.0.0.1', port=1978, instrument=collector)
+
+    exporter = MetricsExporter('10.0.0.1', 1978, collector=collector)
+    exporter.start()                 # polls the server every 10 seconds
+    exporter.serve(port=9178)        # exposes http://localhost:9178/metrics
+
+The server is polled by a background thread over a single connection which
+is kept open between polls. Besides the raw values (number of records, size,
+update log position, replication delay), rates are computed from the last two
+polls: records added per second, operations per second and the change of the
+replication delay per second.
+"""
+
+import BaseHTTPServer
+import socket
+import threading
+import time
+
+import exceptions
+from info import ServerInfo
+from protocol import TyrantProtocol
+
+
+__all__ = ['MetricsExporter']
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+# server counters reported by `stat` and the operations they count
+SERVER_COUNTERS = ('put', 'putmiss', 'out', 'outmiss', 'get', 'getmiss',
+                   'misc')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                                           .replace('"', '\\"'))
+                             for k, v in sorted(labels.iteritems()))
+
+
+class MetricsExporter(object):
+    """
+    Polls a Tyrant server and renders its status along with client-side
+    statistics as text.
+
+    :param host: Tyrant host address
+    :param port: Tyrant port number
+    :param collector: a :class:`~pyrant.instrument.Collector` with client-side
+        statistics (optional).
+    :param interval: number of seconds between polls.
+    :param namespace: prefix of all metric names.
+    :param timeout: socket timeout for the polling connection.
+    """
+
+    def __init__(self, host, port, collector=None, interval=10,
+                 namespace='tyrant', timeout=None):
+        self.host = host
+        self.port = port
+        self.collector = collector
+        self.interval = interval
+        self.namespace = namespace
+        self.timeout = timeout
+
+        self.stats = None        # the last status report
+        self.rates = {}          # values per second between the last polls
+        self.polled_at = None
+        self.errors = 0
+        self._previous = None    # (time, stats) of the poll before last
+        self._proto = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._http = None
+
+    def __repr__(self):
+        return u'<MetricsExporter %s:%s>' % (self.host, self.port)
+
+    def _stat(self):
+        # the connection is reused until it breaks
+        if self._proto is None:
+            self._proto = TyrantProtocol(self.host, self.port, self.timeout)
+        try:
+            return ServerInfo(self._proto).refresh()
+        except (socket.error, exceptions.TyrantError):
+            self._proto._sock.close()
+            self._proto = None
+            raise
+
+    def poll(self):
+        """
+        Fetches the server status and updates the rates. Returns `True` on
+        success. Errors are counted, not raised.
+        """
+        try:
+            info = self._stat()
+        except (socket.error, exceptions.TyrantError):
+            self._lock.acquire()
+            try:
+                self.errors += 1
+                self.stats = None
+            finally:
+                self._lock.release()
+            return False
+
+        now = time.time()
+        stats = {
+            'records': info.rnum,
+            'size_bytes': info.size,
+            'ulog_position': info.replication_timestamp,
+            'replication_delay_seconds': info.replication_delay,
+        }
+        for name in SERVER_COUNTERS:
+            value = info.stats.get('cnt_' + name)
+            if value is not None:
+                stats['ops_' + name] = int(value)
+
+        self._lock.acquire()
+        try:
+            if self.stats is not None:
+                elapsed = now - self.polled_at
+                self.rates = self._get_rates(self.stats, stats, elapsed)
+            self.stats = stats
+            self.polled_at = now
+        finally:
+            self._lock.release()
+        return True
+
+    def _get_rates(self, old, new, elapsed):
+        if elapsed <= 0:
+            return {}
+        rates = {}
+        pairs = [('records', 'records_per_second'),
+                 ('replication_delay_seconds', 'replication_delay_trend')]
+        pairs += [('ops_' + x, 'ops_%s_per_second' % x) for x in SERVER_COUNTERS]
+        for name, rate in pairs:
+            if old.get(name) is not None and new.get(name) is not None:
+                rates[rate] = (new[name] - old[name]) / float(elapsed)
+        return rates
+
+    def _run(self):
+        while not self._stopped.isSet():
+            self.poll()
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        """
+        Starts polling in a background thread. Returns the exporter.
+        """
+        assert self._thread is None, 'already started'
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops polling and serving, closes the connection.
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+        if self._proto is not None:
+            self._proto._sock.close()
+            self._proto = None
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        ns = self.namespace
+
+        def add(name, kind, help, samples):
+            name = '%s_%s' % (ns, name)
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples:
+                if value is not None:
+                    lines.append('%s%s%s %s' % (name, suffix,
+                                                _format_labels(labels),
+                                                _format_value(value)))
+
+        self._lock.acquire()
+        try:
+            stats, rates, errors = self.stats, dict(self.rates), self.errors
+        finally:
+            self._lock.release()
+
+        server = {'server': '%s:%s' % (self.host, self.port)}
+        add('up', 'gauge', 'Whether the last poll of the server succeeded.',
+            [('', server, int(stats is not None))])
+        add('poll_errors_total', 'counter', 'Failed polls of the server.',
+            [('', server, errors)])
+        if stats is not None:
+            for name, help in (
+                    ('records', 'Number of records.'),
+                    ('size_bytes', 'Size of the database.'),
+                    ('ulog_position', 'Timestamp of the last replicated update '
+                     '(microseconds).'),
+                    ('replication_delay_seconds', 'Replication delay.')):
+                add(name, 'gauge', help, [('', server, stats[name])])
+            ops = [('', dict(server, op=x), stats.get('ops_' + x))
+                   for x in SERVER_COUNTERS]
+            add('server_ops_total', 'counter', 'Operations counted by the '
+                'server.', ops)
+        if rates:
+            add('records_per_second', 'gauge', 'Change of the number of '
+                'records per second.',
+                [('', server, rates.get('records_per_second'))])
+            add('replication_delay_trend', 'gauge', 'Change of the '
+                'replication delay per second.',
+                [('', server, rates.get('replication_delay_trend'))])
+            ops = [('', dict(server, op=x), rates.get('ops_%s_per_second' % x))
+                   for x in SERVER_COUNTERS]
+            add('server_ops_per_second', 'gauge', 'Operations per second '
+                'counted by the server.', ops)
+
+        if self.collector is not None:
+            self._render_client(add, self.collector.report())
+
+        return '\n'.join(lines) + '\n'
+
+    def _render_client(self, add, report):
+        commands = sorted(report.iteritems())
+        for name, help in (('calls', 'Commands sent.'),
+                           ('errors', 'Commands that failed.'),
+                           ('bytes_sent', 'Bytes sent.'),
+                           ('bytes_received', 'Bytes received.')):
+            add('client_%s_total' % name, 'counter', help,
+                [('', {'command': cmd}, stats[name]) for cmd, stats in commands])
+        for name, help in (('wait', 'Time spent waiting for the server.'),
+                           ('parse', 'Time spent receiving and parsing '
+                            'responses.')):
+            samples = []
+            for cmd, stats in commands:
+                hist = stats[name]
+                for q in 50, 90, 99:
+                    samples.append(('', {'command': cmd,
+                                         'quantile': '0.%s' % q},
+                                    hist['p%d' % q]))
+                samples.append(('_sum', {'command': cmd}, hist['sum']))
+                samples.append(('_count', {'command': cmd}, hist['count']))
+            add('client_%s_seconds' % name, 'summary', help, samples)
+
+    def serve(self, host='', port=9178):
+        """
+        Serves the metrics over HTTP in a background thread. Any path returns
+        the output of :meth:`render`. Returns the address of the server.
+        """
+        exporter = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = exporter.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._http = BaseHTTPServer.HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._http.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return self._http.server_address
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Connection pooling for multi-threaded applications.
+
+A :class:`~pyrant.protocol.TyrantProtocol` instance wraps a single socket and
+must not be shared between threads. :class:`TyrantPool` keeps a set of open
+connections and hands them out to threads on demand::
+
+    from pyrant import Tyrant
+    from pyrant.pool import TyrantPool
+
+    pool = TyrantPool(host='127.0.0.1', port=1978, max_size=20)
+    t = Tyrant(pool=pool)    # can be shared by all threads
+
+Each command issued via ``t`` checks a connection out of the pool and returns
+it right after the response has been read. A thread that needs a connection
+for a series of commands can also borrow one explicitly::
+
+    with pool.connection() as proto:
+        proto.iterinit()
+        ...
+
+The pool only relies on the standard `socket`, `select` and `threading`
+modules. In applications built on green threads (gevent, eventlet) these
+modules are monkey-patched, so a green thread waiting for a response or for
+a free connection blocks cooperatively and lets other green threads run. Each
+green thread checks out a connection of its own, so the number of concurrent
+requests is bounded by `max_size`; requests are never multiplexed over a
+shared socket. To keep many commands in flight on one connection, use
+:meth:`~pyrant.protocol.TyrantProtocol.pipeline`.
+
+"""
+
+import select
+import socket
+import threading
+import time
+import types
+
+import exceptions
+from protocol import Pipeline, TyrantProtocol
+
+
+__all__ = ['TyrantPool', 'PooledProtocol']
+
+
+class TyrantPool(object):
+    """
+    A thread-safe pool of :class:`~pyrant.protocol.TyrantProtocol` connections.
+
+    :param host: Tyrant host address
+    :param port: Tyrant port number
+    :param timeout: socket timeout for each connection
+    :param min_size: number of connections that are opened in advance and
+        never closed for being idle.
+    :param max_size: maximum number of connections open at once.
+    :param checkout_timeout: how many seconds to wait for a free connection
+        when all `max_size` connections are in use. If the time is out,
+        :class:`~pyrant.exceptions.PoolTimeout` is raised. Default is `None`
+        (wait forever).
+    :param max_idle: if set, connections that have not been used for that many
+        seconds are closed (as long as there are more than `min_size` of them).
+    :param health_check: if True (default), each idle connection is checked
+        before it is handed out; connections closed by the server or containing
+        unexpected data are replaced with new ones. The check does not involve
+        a round trip to the server.
+    :param instrument: an :class:`~pyrant.instrument.Instrument` to be
+        attached to each connection.
+    :param retry: a :class:`~pyrant.retry.RetryPolicy` for each connection.
+
+    Nested checkouts within a thread return the same connection, so a thread
+    never holds more than one connection.
+    """
+
+    def __init__(self, host, port, timeout=None, min_size=0, max_size=10,
+                 checkout_timeout=None, max_idle=None, health_check=True,
+                 instrument=None, retry=None):
+        assert 0 <= min_size <= max_size and 0 < max_size, (
+            'wrong pool size limits: min %s, max %s' % (min_size, max_size))
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.max_idle = max_idle
+        self.health_check = health_check
+        self.instrument = instrument
+        self.retry = retry
+
+        self._cond = threading.Condition()
+        self._idle = []      # (connection, time of checkin); oldest first
+        self._size = 0       # number of open connections, idle or not
+        self._local = threading.local()
+
+        for i in xrange(min_size):
+            self._idle.append((self._connect(), time.time()))
+            self._size += 1
+
+    def __repr__(self):
+        return u'<TyrantPool %s:%s (%d/%d)>' % (self.host, self.port,
+                                               self._size, self.max_size)
+
+    def _connect(self):
+        return TyrantProtocol(self.host, self.port, self.timeout,
+                              instrument=self.instrument, retry=self.retry)
+
+    def _is_healthy(self, proto):
+        sock = proto._sock
+        if sock._rpos != sock._rend or sock._stream is not None:
+            # leftovers of a response that was not read completely
+            return False
+        try:
+            readable, _, _ = select.select([sock._sock], [], [], 0)
+        except (select.error, socket.error, ValueError):
+            return False
+        # an idle connection becomes readable only if the server has closed it
+        return not readable
+
+    def _close(self, proto):
+        # must be called with the lock acquired
+        self._size -= 1
+        proto._sock.close()
+        self._cond.notify()
+
+    def _evict_idle(self):
+        # must be called with the lock acquired
+        if self.max_idle is None:
+            return
+        threshold = time.time() - self.max_idle
+        while self._idle and self.min_size < self._size:
+            proto, released = self._idle[0]
+            if threshold < released:
+                break
+            del self._idle[0]
+            self._close(proto)
+
+    def _acquire(self):
+        if self.checkout_timeout is not None:
+            deadline = time.time() + self.checkout_timeout
+        self._cond.acquire()
+        try:
+            while True:
+                self._evict_idle()
+                while self._idle:
+                    # reuse the most recently released connection: it is the
+                    # least likely to have been dropped by the server
+                    proto, _ = self._idle.pop()
+                    if not self.health_check or self._is_healthy(proto):
+                        return proto
+                    self._close(proto)
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                if self.checkout_timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise exceptions.PoolTimeout(
+                            'No free connection in %s within %s seconds'
+                            % (self, self.checkout_timeout))
+                    self._cond.wait(remaining)
+        finally:
+            self._cond.release()
+
+        # a slot has been reserved; connect without holding the lock
+        try:
+            return self._connect()
+        except:
+            self._cond.acquire()
+            try:
+                self._size -= 1
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            raise
+
+    def _release(self, proto, discard=False):
+        self._cond.acquire()
+        try:
+            if discard:
+                self._close(proto)
+            else:
+                self._idle.append((proto, time.time()))
+                self._evict_idle()
+                self._cond.notify()
+        finally:
+            self._cond.release()
+
+    def checkout(self):
+        """
+        Returns a :class:`~pyrant.protocol.TyrantProtocol` instance reserved
+        for the current thread. Each call must be paired with :meth:`checkin`.
+        """
+        local = self._local
+        proto = getattr(local, 'proto', None)
+        if proto is None:
+            local.proto = proto = self._acquire()
+            local.depth = 0
+            local.broken = False
+        local.depth += 1
+        return proto
+
+    def checkin(self, proto, discard=False):
+        """
+        Returns given connection to the pool.
+
+        :param discard: if True, the connection is closed instead of being
+            reused. Should be set if a socket error occured.
+        """
+        local = self._local
+        assert getattr(local, 'proto', None) is proto, (
+            'connection was not checked out by this thread')
+        local.broken = local.broken or discard
+        local.depth -= 1
+        if not local.depth:
+            local.proto = None
+            self._release(proto, discard=local.broken)
+
+    def connection(self):
+        """
+        Returns a context manager which checks a connection out of the pool
+        and returns it on exit. The connection is discarded if a socket error
+        occured.
+        """
+        return _Connection(self)
+
+    def protocol(self):
+        """
+        Returns a :class:`PooledProtocol` for this pool.
+        """
+        return PooledProtocol(self)
+
+    def close(self):
+        """
+        Closes all idle connections. Connections that are in use are closed
+        when they are returned to the pool.
+        """
+        self._cond.acquire()
+        try:
+            while self._idle:
+                proto, _ = self._idle.pop()
+                self._close(proto)
+        finally:
+            self._cond.release()
+
+
+class _Connection(object):
+    def __init__(self, pool):
+        self.pool = pool
+        self.proto = None
+
+    def __enter__(self):
+        self.proto = self.pool.checkout()
+        return self.proto
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        broken = exc_type is not None and issubclass(exc_type, socket.error)
+        self.pool.checkin(self.proto, discard=broken)
+        self.proto = None
+
+
+class PooledProtocol(object):
+    """
+    Provides the interface of :class:`~pyrant.protocol.TyrantProtocol` but
+    runs each command on a connection checked out of given
+    :class:`TyrantPool`. Unlike the protocol itself, it can be safely shared
+    by multiple threads.
+    """
+
+    # commands which return lazy iterators over the response
+    STREAMING = ('iter_mget', 'iter_misc')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.host = pool.host
+        self.port = pool.port
+
+    def __getattr__(self, name):
+        attr = getattr(TyrantProtocol, name)
+        if name.startswith('_') or not isinstance(attr, types.MethodType):
+            # constants
+            return attr
+
+        pool = self.pool
+
+        if name in self.STREAMING:
+            return self._wrap_stream(name, attr)
+
+        def call(*args, **kwargs):
+            proto = pool.checkout()
+            broken = False
+            try:
+                return getattr(proto, name)(*args, **kwargs)
+            except socket.error:
+                broken = True
+                raise
+            finally:
+                pool.checkin(proto, discard=broken)
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        self.__dict__[name] = call
+        return call
+
+    def __repr__(self):
+        return u'<PooledProtocol %s:%s>' % (self.host, self.port)
+
+    def _wrap_stream(self, name, attr):
+        # the connection is held until the response has been read completely
+        pool = self.pool
+
+        def call(*args, **kwargs):
+            proto = pool.checkout()
+            broken = False
+            try:
+                for item in getattr(proto, name)(*args, **kwargs):
+                    yield item
+            except socket.error:
+                broken = True
+                raise
+            finally:
+                pool.checkin(proto, discard=broken)
+
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        self.__dict__[name] = call
+        return call
+
+    def pipeline(self):
+        """
+        Returns a :class:`~pyrant.protocol.Pipeline` bound to a connection
+        checked out of the pool. The connection is taken when the first command
+        is queued and returned when the pipeline is executed or reset.
+        """
+        return _PooledPipeline(self.pool)
+
+
+class _PooledPipeline(Pipeline):
+    # holds a connection from the first queued command until execution
+
+    def __init__(self, pool):
+        Pipeline.__init__(self, None)
+        self._pool = pool
+
+    def _clone_proto(self, sock):
+        if self._proto is None:
+            self._proto = self._pool.checkout()
+        return Pipeline._clone_proto(self, sock)
+
+    def _release(self, broken=False):
+        if self._proto is not None:
+            self._pool.checkin(self._proto, discard=broken)
+            self._proto = None
+
+    def execute(self):
+        broken = False
+        try:
+            return Pipeline.execute(self)
+        except socket.error:
+            broken = True
+            raise
+        finally:
+            self._release(broken)
+
+    def reset(self):
+        Pipeline.reset(self)
+        self._release()
@@ -9,6 +9,8 @@ Let's assume some defaults for our sandbox::
 
 """
 
+import collections
+import copy
 import math
 import socket
 import struct
@@ -29,44 +31,77 @@ DB_HASH   = 'hash'
 
 TABLE_COLUMN_SEP = '\x00'
 
-def _ulen(expr):
-    "Returns length of the string in bytes."
-    return len(expr.encode(ENCODING)) if isinstance(expr, unicode) else len(expr)
+# Size of the per-connection receive buffer. Responses are read from the socket
+# in blocks of up to this size; values that do not fit are received separately.
+RECV_BUFFER_SIZE = 64 * 1024
 
-def _pack(code, *args):
-    # Craft string that we'll use to send data based on args type and content
-    buf = ''
+# Requests larger than this are sent in blocks of about this size instead of
+# being joined into one string
+SEND_BLOCK_SIZE = 64 * 1024
+
+# Precompiled formats for the numbers found in server responses
+_INT = struct.Struct('>I')
+_LONG = struct.Struct('>Q')
+_INT_PAIR = struct.Struct('>II')
+_LONG_PAIR = struct.Struct('>QQ')
+
+def _encode(value):
+    "Returns given string as bytes."
+    if isinstance(value, unicode):
+        return value.encode(ENCODING)
+    return value
+
+def _pack_segments(code, args):
+    """
+    Encodes a request in a single pass and returns it as a list of strings:
+    the header with magic number, command code and all numeric arguments,
+    followed by the string arguments. Each item of a list argument is prefixed
+    with its length. The strings are meant to be joined or sent one by one.
+    """
     fmt = '>BB'
-    largs = []
+    numbers = [MAGIC_NUMBER, code]
+    segments = [None]    # placeholder for the header
+    append = segments.append
+    pack_int = _INT.pack
     for arg in args:
-        if isinstance(arg, int):
-            fmt += 'I'
-            largs.append(arg)
-
-        elif isinstance(arg, str):
-            buf += arg
+        if isinstance(arg, str):
+            append(arg)
 
         elif isinstance(arg, unicode):
-            buf += arg.encode(ENCODING)
+            append(arg.encode(ENCODING))
+
+        elif isinstance(arg, int):
+            fmt += 'I'
+            numbers.append(arg)
 
         elif isinstance(arg, long):
             fmt += 'Q'
-            largs.append(arg)
+            numbers.append(arg)
 
         elif isinstance(arg, (list, tuple)):
             for v in arg:
                 if isinstance(v, unicode):
                     v = v.encode(ENCODING)
-                else:
+                elif not isinstance(v, str):
                     v = str(v)
-                buf += "%s%s" % (struct.pack(">I", len(v)), v)
+                append(pack_int(len(v)))
+                append(v)
+
+    segments[0] = struct.pack(fmt, *numbers)
+    return segments
 
-    return "%s%s" % (struct.pack(fmt, MAGIC_NUMBER, code, *largs), buf)
+def _pack(code, *args):
+    "Returns the request as a single string."
+    return ''.join(_pack_segments(code, args))
 
 
 class _TyrantSocket(object):
     """
     Socket logic. We use this class as a wrapper to raw sockets.
+
+    Incoming data is read into a reusable buffer in large blocks, so that a
+    response consisting of many small fields costs a few system calls instead
+    of two per field. All ``get_*`` methods read from that buffer.
     """
 
     def __init__(self, host, port, timeout=None):
@@ -75,36 +110,119 @@ class _TyrantSocket(object):
             self._sock.settimeout(timeout)
         self._sock.connect((host, port))
         self._sock.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        # receive buffer; bytes between _rpos and _rend are not consumed yet
+        self._rbuf = bytearray(RECV_BUFFER_SIZE)
+        self._rview = memoryview(self._rbuf)
+        self._rpos = 0
+        self._rend = 0
+        # a response which is being read record by record (see stream())
+        self._stream = None
 
     def __del__(self):
         self._sock.close()
 
+    def close(self):
+        """
+        Closes the socket.
+        """
+        self._sock.close()
+
     def send(self, *args, **kwargs):
         """
         Packs arguments and sends the buffer to the socket.
         """
         sync = kwargs.pop('sync', True)
+        if self._stream is not None:
+            self._stream.drain()
         # Send message to socket, then check for errors as needed.
-        self._sock.sendall(_pack(*args))
-        if not sync:
+        self._send_segments(_pack_segments(args[0], args[1:]))
+        if sync:
+            self.check_status()
+
+    def sendall(self, segments):
+        """
+        Sends already packed data (a list of strings) to the socket.
+        """
+        if self._stream is not None:
+            self._stream.drain()
+        self._send_segments(segments)
+
+    def _send_segments(self, segments):
+        # small requests are joined and sent at once; large ones are sent in
+        # blocks of about SEND_BLOCK_SIZE so that no huge string is built
+        size = sum(map(len, segments))
+        if size <= SEND_BLOCK_SIZE:
+            self._sock.sendall(''.join(segments))
             return
+        step = max(1, len(segments) * SEND_BLOCK_SIZE // size)
+        for i in xrange(0, len(segments), step):
+            self._sock.sendall(''.join(segments[i:i + step]))
+
+    def stream(self, count, read):
+        """
+        Returns an iterator over `count` records of the current response. Each
+        record is read from the socket by calling `read` only when it is
+        requested. See :class:`_ResponseStream`.
+        """
+        if self._stream is not None:
+            self._stream.drain()
+        self._stream = _ResponseStream(self, count, read)
+        return self._stream
 
+    def check_status(self):
+        """
+        Retrieves the status byte of a response. Raises an appropriate
+        :class:`~pyrant.exceptions.TyrantError` if the status is not zero.
+        """
         fail_code = ord(self.get_byte())
         if fail_code:
             raise exceptions.get_for_code(fail_code)
 
+    def _fill(self, size):
+        """
+        Makes sure that at least `size` bytes are available in the receive
+        buffer and returns the offset of the first unread byte. `size` must
+        not exceed the buffer length.
+        """
+        pos = self._rpos
+        avail = self._rend - pos
+        if size <= avail:
+            return pos
+        if len(self._rbuf) < pos + size:
+            # not enough room after the unread bytes; move them to the start
+            self._rbuf[:avail] = self._rbuf[pos:self._rend]
+            self._rpos = pos = 0
+            self._rend = avail
+        while self._rend - pos < size:
+            received = self._sock.recv_into(self._rview[self._rend:])
+            if not received:
+                raise socket.error('server disconnected unexpectedly')  # pragma: nocover
+            self._rend += received
+        return pos
+
     def recv(self, bytes):
         """
         Retrieves given number of bytes from the socket and returns them as
         string.
         """
-        d = ''
-        while len(d) < bytes:
-            c = self._sock.recv(min(8192, bytes - len(d)))
-            if not c:
+        if bytes <= len(self._rbuf):
+            pos = self._fill(bytes)
+            self._rpos = pos + bytes
+            return self._rview[pos:pos + bytes].tobytes()
+
+        # the chunk is larger than the buffer: take what has been buffered so
+        # far and receive the rest directly into a string-sized bytearray
+        data = bytearray(bytes)
+        view = memoryview(data)
+        done = self._rend - self._rpos
+        view[:done] = self._rview[self._rpos:self._rend]
+        self._rpos = self._rend = 0
+        while done < bytes:
+            received = self._sock.recv_into(view[done:], bytes - done)
+            if not received:
                 raise socket.error('server disconnected unexpectedly')  # pragma: nocover
-            d += c
-        return d
+            done += received
+        return str(data)
 
     def get_byte(self):
         """
@@ -116,13 +234,17 @@ class _TyrantSocket(object):
         """
         Retrieves an integer (4 bytes) from the socket and returns it.
         """
-        return struct.unpack('>I', self.recv(4))[0]
+        pos = self._fill(4)
+        self._rpos = pos + 4
+        return _INT.unpack_from(self._rbuf, pos)[0]
 
     def get_long(self):
         """
         Retrieves a long integer (8 bytes) from the socket and returns it.
         """
-        return struct.unpack('>Q', self.recv(8))[0]
+        pos = self._fill(8)
+        self._rpos = pos + 8
+        return _LONG.unpack_from(self._rbuf, pos)[0]
 
     def get_str(self):
         """
@@ -142,7 +264,9 @@ class _TyrantSocket(object):
         """
         Retrieves two long integers (16 bytes) from the socket and returns them.
         """
-        intpart, fracpart = struct.unpack('>QQ', self.recv(16))
+        pos = self._fill(16)
+        self._rpos = pos + 16
+        intpart, fracpart = _LONG_PAIR.unpack_from(self._rbuf, pos)
         return intpart + (fracpart * 1e-12)
 
     def get_strpair(self):
@@ -150,10 +274,117 @@ class _TyrantSocket(object):
         Retrieves a pair of strings (n bytes, n bytes which are 2 integers just
         before the pair) and returns them as a tuple of strings.
         """
-        klen = self.get_int()
-        vlen = self.get_int()
+        pos = self._fill(8)
+        self._rpos = pos + 8
+        klen, vlen = _INT_PAIR.unpack_from(self._rbuf, pos)
         return self.recv(klen), self.recv(vlen)
 
+    def get_strlist(self, count):
+        """
+        Retrieves `count` strings (each preceded by its length) and returns
+        them as a list. All records that are already buffered are sliced off
+        the buffer in a single pass; only incomplete records fall back to
+        :meth:`get_str`.
+        """
+        result = []
+        append = result.append
+        unpack = _INT.unpack_from
+        buf, view = self._rbuf, self._rview
+        pos, end = self._rpos, self._rend
+        while count:
+            if 4 <= end - pos:
+                size = unpack(buf, pos)[0]
+                start = pos + 4
+                if start + size <= end:
+                    append(view[start:start + size].tobytes())
+                    pos = start + size
+                    count -= 1
+                    continue
+            self._rpos = pos
+            append(self.get_str())
+            count -= 1
+            pos, end = self._rpos, self._rend
+        self._rpos = pos
+        return result
+
+    def get_strpairlist(self, count):
+        """
+        Retrieves `count` pairs of strings (see :meth:`get_strpair`) and
+        returns them as a list of tuples. Works like :meth:`get_strlist`.
+        """
+        result = []
+        append = result.append
+        unpack = _INT_PAIR.unpack_from
+        buf, view = self._rbuf, self._rview
+        pos, end = self._rpos, self._rend
+        while count:
+            if 8 <= end - pos:
+                ksize, vsize = unpack(buf, pos)
+                kstart = pos + 8
+                vstart = kstart + ksize
+                if vstart + vsize <= end:
+                    append((view[kstart:vstart].tobytes(),
+                            view[vstart:vstart + vsize].tobytes()))
+                    pos = vstart + vsize
+                    count -= 1
+                    continue
+            self._rpos = pos
+            append(self.get_strpair())
+            count -= 1
+            pos, end = self._rpos, self._rend
+        self._rpos = pos
+        return result
+
+
+class _ResponseStream(object):
+    """
+    Iterates over the records of a response as they are parsed off the socket,
+    so that processing of the first records overlaps with transfer of the rest
+    and only one record at a time has to be kept in memory.
+
+    The socket must not be used for anything else until the response has been
+    read completely. If another request is sent before the stream is
+    exhausted, the remaining records are read into memory first and the
+    stream keeps yielding them from there.
+    """
+
+    def __init__(self, sock, count, read):
+        self._sock = sock
+        self._count = count
+        self._read = read
+        self._pending = None
+
+    def __iter__(self):
+        return self
+
+    def _detach(self):
+        if self._sock._stream is self:
+            self._sock._stream = None
+
+    def next(self):
+        if self._pending is not None:
+            if self._pending:
+                return self._pending.popleft()
+            raise StopIteration
+        if not self._count:
+            self._detach()
+            raise StopIteration
+        self._count -= 1
+        if not self._count:
+            # the socket is free as soon as the last record is being read
+            self._detach()
+        return self._read()
+
+    def drain(self):
+        """
+        Reads the remaining records into memory and releases the socket.
+        """
+        self._detach()
+        if self._pending is None:
+            self._pending = collections.deque(self._read()
+                                              for i in xrange(self._count))
+            self._count = 0
+
 
 class TyrantProtocol(object):
     """
@@ -263,12 +494,45 @@ class TyrantProtocol(object):
     TDBITVOID = 9999 # remove index
     TDBITKEEP = 1 << 24 # keep existing index
 
-    def __init__(self, host, port, timeout=None):
+    # see pyrant.instrument and pyrant.retry
+    instrument = None
+    retry = None
+
+    def __init__(self, host, port, timeout=None, instrument=None, retry=None):
         # connect to the remote database
         self._sock = _TyrantSocket(host, port, timeout)
         # expose connection info (not used internally)
         self.host = host
         self.port = port
+        self.timeout = timeout
+        if retry is not None:
+            retry.attach(self)
+        if instrument is not None:
+            instrument.attach(self)
+
+    def reconnect(self, timeout=None):
+        """
+        Closes the connection and opens a new one. Anything that has not been
+        read from the old connection is lost.
+
+        :param timeout: if set, limits the time of establishing the connection
+            (instead of :attr:`timeout`, which still applies to the commands).
+        """
+        self._sock.close()
+        if timeout is None:
+            self._sock = _TyrantSocket(self.host, self.port, self.timeout)
+        else:
+            self._sock = _TyrantSocket(self.host, self.port, timeout)
+            self._sock._sock.settimeout(self.timeout)
+        if self.instrument is not None:
+            self.instrument.attach_socket(self)
+
+    def pipeline(self):
+        """
+        Returns a :class:`~pyrant.protocol.Pipeline` which queues commands and
+        sends them to the server in one go.
+        """
+        return Pipeline(self)
 
     def put(self, key, value):
         """
@@ -282,20 +546,23 @@ class TyrantProtocol(object):
             2
 
         """
-        self._sock.send(self.PUT, _ulen(key), _ulen(value), key, value)
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.PUT, len(key), len(value), key, value)
 
     def putkeep(self, key, value):
         """
         Sets key to value if key does not already exist.
         """
-        self._sock.send(self.PUTKEEP, _ulen(key), _ulen(value), key, value)
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.PUTKEEP, len(key), len(value), key, value)
 
     def putcat(self, key, value):
         """
         Appends value to the existing value for key, or sets key to value if it
         does not already exist.
         """
-        self._sock.send(self.PUTCAT, _ulen(key), _ulen(value), key, value)
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.PUTCAT, len(key), len(value), key, value)
 
     def putshl(self, key, value, width):
         """
@@ -305,21 +572,23 @@ class TyrantProtocol(object):
             self.put(key, self.get(key)[-width:])
 
         """
-        self._sock.send(self.PUTSHL, _ulen(key), _ulen(value), width, key,
-                        value)
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.PUTSHL, len(key), len(value), width, key, value)
 
     def putnr(self, key, value):
         """
         Sets key to value without waiting for a server response.
         """
-        self._sock.send(self.PUTNR, _ulen(key), _ulen(value), key, value,
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.PUTNR, len(key), len(value), key, value,
                         sync=False)
 
     def out(self, key):
         """
         Removes key from server.
         """
-        self._sock.send(self.OUT, _ulen(key), key)
+        key = _encode(key)
+        self._sock.send(self.OUT, len(key), key)
 
     def genuid(self):
         """
@@ -341,7 +610,8 @@ class TyrantProtocol(object):
             u'box\x00quux'
 
         """
-        self._sock.send(self.GET, _ulen(key), key)
+        key = _encode(key)
+        self._sock.send(self.GET, len(key), key)
         return self._sock.get_str() if literal else self._sock.get_unicode()
 
     def getint(self, key):
@@ -368,13 +638,28 @@ class TyrantProtocol(object):
         """
         self._sock.send(self.MGET, len(keys), keys)
         numrecs = self._sock.get_int()
-        return [self._sock.get_strpair() for i in xrange(numrecs)]
+        return self._sock.get_strpairlist(numrecs)
+
+    def iter_mget(self, keys):
+        """
+        Same as :meth:`mget` but returns an iterator which yields the
+        key,value pairs as they are read from the socket.
+
+        .. note:: the pairs are read lazily. If another command is sent over
+            the connection before the iterator is exhausted, the remaining
+            pairs are read into memory first.
+
+        """
+        self._sock.send(self.MGET, len(keys), keys)
+        numrecs = self._sock.get_int()
+        return self._sock.stream(numrecs, self._sock.get_strpair)
 
     def vsiz(self, key):
         """
         Returns the size of a value for given key.
         """
-        self._sock.send(self.VSIZ, _ulen(key), key)
+        key = _encode(key)
+        self._sock.send(self.VSIZ, len(key), key)
         return self._sock.get_int()
 
     def iterinit(self):
@@ -408,15 +693,18 @@ class TyrantProtocol(object):
         """
         Get up to the first maxkeys starting with prefix
         """
-        self._sock.send(self.FWMKEYS, _ulen(prefix), maxkeys, prefix)
+        prefix = _encode(prefix)
+        self._sock.send(self.FWMKEYS, len(prefix), maxkeys, prefix)
         numkeys = self._sock.get_int()
-        return [self._sock.get_unicode() for i in xrange(numkeys)]
+        return [key.decode(ENCODING, ENCODING_ERROR_HANDLING)
+                for key in self._sock.get_strlist(numkeys)]
 
     def addint(self, key, num=0):
         """
         Adds given integer to existing one. Stores and returns the sum.
         """
-        self._sock.send(self.ADDINT, _ulen(key), num, key)
+        key = _encode(key)
+        self._sock.send(self.ADDINT, len(key), num, key)
         return self._sock.get_int()
 
     def adddouble(self, key, num=0.0):
@@ -425,7 +713,8 @@ class TyrantProtocol(object):
         """
         fracpart, intpart = math.modf(num)
         fracpart, intpart = int(fracpart * 1e12), int(intpart)
-        self._sock.send(self.ADDDOUBLE, _ulen(key), long(intpart),
+        key = _encode(key)
+        self._sock.send(self.ADDDOUBLE, len(key), long(intpart),
                         long(fracpart), key)
         return self._sock.get_double()
 
@@ -436,7 +725,8 @@ class TyrantProtocol(object):
         :param opts: a bitflag that can be `RDBXOLCKREC` for record locking
             and/or `RDBXOLCKGLB` for global locking.
         """
-        self._sock.send(self.EXT, len(func), opts, _ulen(key), _ulen(value),
+        key, value = _encode(key), _encode(value)
+        self._sock.send(self.EXT, len(func), opts, len(key), len(value),
                         func, key, value)
         return self._sock.get_unicode()
 
@@ -457,13 +747,15 @@ class TyrantProtocol(object):
         """
         Hot-copies the database to given path.
         """
-        self._sock.send(self.COPY, _ulen(path), path)
+        path = _encode(path)
+        self._sock.send(self.COPY, len(path), path)
 
     def restore(self, path, msec):
         """
         Restores the database from `path` at given timestamp (in `msec`).
         """
-        self._sock.send(self.RESTORE, _ulen(path), msec, path)
+        path = _encode(path)
+        self._sock.send(self.RESTORE, len(path), msec, path)
 
     def setmst(self, host, port):
         """
@@ -557,7 +849,7 @@ class TyrantProtocol(object):
     def search(self, conditions, limit=10, offset=0,
                order_type=0, order_column=None, opts=0,
                ms_conditions=None, ms_type=None, columns=None,
-               out=False, count=False, hint=False):
+               out=False, count=False, hint=False, get=False, literal=False):
         """
         Returns list of keys for elements matching given ``conditions``.
 
@@ -585,6 +877,11 @@ class TyrantProtocol(object):
             that correspond to the query.
         :param hint: boolean; if True, the hint string is added to the return
             value.
+        :param get: boolean; if True (and `columns` is not set), returns
+            whole matched records instead of keys. The primary key of each
+            record is included as a column with an empty name.
+        :param literal: boolean; if True, the returned strings are not decoded
+            to Unicode (see :meth:`~pyrant.protocol.TyrantProtocol.misc`).
         """
 
         # TODO: split this function into separate functions if they return
@@ -629,6 +926,8 @@ class TyrantProtocol(object):
         # return only selected columns
         if columns:
             args += ['get\x00%s' % '\x00'.join(columns)]
+        elif get:
+            args += ['get']
 
         # set order in query
         if order_column:
@@ -650,14 +949,16 @@ class TyrantProtocol(object):
         if hint:
             args += ['hint']
 
-        return self.misc('search', args, opts)
+        return self.misc('search', args, opts, literal=literal)
 
-    def misc(self, func, args, opts=0):
+    def misc(self, func, args, opts=0, literal=False):
         """
         Executes custom function.
 
         :param func: the function name (see below)
         :param opts: a bitflag (see below)
+        :param literal: if True, the returned strings are not decoded to
+            Unicode. Default is False.
 
         Functions supported by all databases:
 
@@ -682,4 +983,183 @@ class TyrantProtocol(object):
         finally:
             numrecs = self._sock.get_int()
 
-        return [self._sock.get_unicode() for i in xrange(numrecs)]
+        strings = self._sock.get_strlist(numrecs)
+        if literal:
+            return strings
+        return [x.decode(ENCODING, ENCODING_ERROR_HANDLING) for x in strings]
+
+    def iter_misc(self, func, args, opts=0, literal=False):
+        """
+        Same as :meth:`misc` but returns an iterator which yields the strings
+        as they are read from the socket. See notes on :meth:`iter_mget`.
+        """
+        try:
+            self._sock.send(self.MISC, len(func), opts, len(args), func, args)
+        finally:
+            numrecs = self._sock.get_int()
+
+        strings = self._sock.stream(numrecs, self._sock.get_str)
+        if literal:
+            return strings
+        return (x.decode(ENCODING, ENCODING_ERROR_HANDLING) for x in strings)
+
+
+class _Queued(Exception):
+    """
+    Interrupts a command right after its request has been packed. See
+    :class:`Pipeline`.
+    """
+    pass
+
+
+class _RecordingSocket(object):
+    """
+    Collects packed requests instead of sending them. Any attempt to read a
+    response stops the command.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def send(self, *args, **kwargs):
+        self.requests.extend(_pack_segments(args[0], args[1:]))
+        raise _Queued
+
+    def __getattr__(self, name):
+        raise _Queued
+
+
+class _ReplaySocket(object):
+    """
+    Reads responses for requests which have already been sent.
+    """
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def send(self, *args, **kwargs):
+        if kwargs.get('sync', True):
+            self._sock.check_status()
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class Pipeline(object):
+    """
+    Queues commands of a :class:`~pyrant.protocol.TyrantProtocol` instance,
+    sends all of them to the server at once and then reads the responses in
+    the same order. Independent commands thus cost a single round trip instead
+    of one per command.
+
+    A pipeline supports the same commands as the protocol. Calling a command
+    only queues it (invalid arguments are reported right away though).
+    :meth:`execute` returns the list of results; a failed command is
+    represented by the exception it raised instead of a result::
+
+        pipe = p.pipeline()
+        pipe.put('foo', 'bar')
+        pipe.get('foo')
+        pipe.get('no such key')
+        pipe.execute()    # --> [None, u'bar', InvalidOperation()]
+
+    A pipeline can also be used as a context manager; queued commands are
+    executed on exit and the results are available as :attr:`results`::
+
+        with p.pipeline() as pipe:
+            for key in keys:
+                pipe.addint(key, 1)
+        totals = pipe.results
+
+    .. note:: commands that depend on each other's results (e.g. a `get`
+        whose key is returned by `iternext`) cannot be pipelined.
+
+    """
+
+    COMMANDS = ('put', 'putkeep', 'putcat', 'putshl', 'putnr', 'out', 'genuid',
+                'get', 'getint', 'getdouble', 'mget', 'vsiz', 'iterinit',
+                'iternext', 'fwmkeys', 'addint', 'adddouble', 'ext', 'sync',
+                'vanish', 'copy', 'restore', 'setmst', 'rnum', 'add_index',
+                'optimize_index', 'drop_index', 'size', 'stat', 'search',
+                'misc')
+
+    def __init__(self, proto):
+        self._proto = proto
+        self._commands = []
+        self._requests = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+        else:
+            self.reset()
+
+    def __getattr__(self, name):
+        if name not in self.COMMANDS:
+            raise AttributeError('%s has no command "%s"'
+                                 % (type(self).__name__, name))
+        method = getattr(TyrantProtocol, name)
+
+        def queue(*args, **kwargs):
+            # run the command until it tries to read the response; that's
+            # where the recording socket stops it
+            proxy = self._clone_proto(_RecordingSocket(self._requests))
+            try:
+                method(proxy, *args, **kwargs)
+            except _Queued:
+                pass
+            self._commands.append((method, args, kwargs))
+
+        queue.__name__ = name
+        queue.__doc__ = method.__doc__
+        return queue
+
+    def __len__(self):
+        return len(self._commands)
+
+    def _clone_proto(self, sock):
+        proto = copy.copy(self._proto)
+        proto._sock = sock
+        return proto
+
+    def execute(self):
+        """
+        Sends all queued commands and returns the list of their results. The
+        pipeline is emptied and can be reused.
+        """
+        commands, requests = self._commands, self._requests
+        self._commands, self._requests = [], []
+        results = []
+        if commands:
+            instrument = self._proto.instrument
+            if instrument is None:
+                results = self._send(commands, requests)
+            else:
+                results = instrument.run(self._proto, 'pipeline', self._send,
+                                         commands, requests)
+        self.results = results
+        return results
+
+    def _send(self, commands, requests):
+        self._proto._sock.sendall(requests)
+        # run the commands again; this time they skip sending and only read
+        # their responses
+        proxy = self._clone_proto(_ReplaySocket(self._proto._sock))
+        results = []
+        for method, args, kwargs in commands:
+            try:
+                results.append(method(proxy, *args, **kwargs))
+            except (exceptions.TyrantError, ValueError), e:
+                results.append(e)
+        return results
+
+    def reset(self):
+        """
+        Drops all queued commands.
+        """
+        self._commands = []
+        self._requests = []
@@ -4,10 +4,18 @@
 Query classes for Tokyo Tyrant API implementation.
 """
 
+import bisect
+import collections
 import copy
+import Queue
+import sys
+import threading
+import time
 import warnings
 
-from protocol import TyrantProtocol
+from cache import sizeof
+from chunks import AdaptiveChunkSize
+from protocol import TABLE_COLUMN_SEP, TyrantProtocol
 import utils
 
 
@@ -30,12 +38,14 @@ class Query(object):
         or indices you request. Sometimes the chunks are not large enough and
         we hit the database too many times. To minimize the overhead you may
         want to increase the chunk size. You can use
-        :meth:`~pyrant.query.Query.set_chunk_size` for that purpose.
+        :meth:`~pyrant.query.Query.set_chunk_size` for that purpose. By
+        default all fetched chunks are kept; to limit memory usage see
+        :meth:`~pyrant.query.Query.set_cache_policy`.
 
     """
 
     def __init__(self, proto, db_type, literal=False, conditions=None,
-                 columns=None, ms_type=None, ms_conditions=None):
+                 columns=None, ms_type=None, ms_conditions=None, flight=None):
         if conditions:
             assert isinstance(conditions, list) and \
                    all(isinstance(c, Condition) for c in conditions), \
@@ -48,6 +58,8 @@ class Query(object):
         self._columns = columns
         self._ms_type = ms_type
         self._ms_conditions = ms_conditions
+        # merges concurrent identical searches (see pyrant.flight)
+        self._flight = flight
 
         # cache
         self._cache = ResultCache(self)
@@ -65,13 +77,8 @@ class Query(object):
 
     def __getitem__(self, k):
         # Retrieve an item or slice from the set of results.
-
-        # XXX do we really need to cache the data? What if there are a couple
-        #     millions items and the user wants to just iterate over them in
-        #     order to calculate an aggregate? I think cache should be either
-        #     kept small or turned off by default or completely removed.
-        #     The user can always easily cache the data explicitly by keeping
-        #     the results in a variable (i.e. "records = query[:]").
+        # The cached data is limited by the cache policy (see
+        # `set_cache_policy`); by default everything is kept.
 
         if isinstance(k, slice):
             return self._get_slice(k)
@@ -88,8 +95,13 @@ class Query(object):
         if s.start and s.start == s.stop:
             raise ValueError('Zero-length slices are not supported')
 
+        if s.stop and self._cache.keys is None and not self._cache.inline:
+            # only the requested window is retrieved
+            return list(self._cache.get_window(s.start or 0, s.stop))
+
         # retrieve and cache keys
-        self._cache.get_keys(self._do_search)
+        if not self._cache.inline:
+            self._cache.get_keys(self._do_search)
 
         items = self._cache.get_items(s.start or 0, s.stop)
         return list(items)
@@ -98,14 +110,29 @@ class Query(object):
         if index < 0:
             raise ValueError('Negative indexing is not supported')
 
+        if self._cache.keys is None and not self._cache.inline:
+            # only the requested record is retrieved
+            items = self._cache.get_window(index, index + 1)
+            if not items:
+                raise IndexError
+            return items[0]
+
         # retrieve and cache keys
-        self._cache.get_keys(self._do_search)
+        if not self._cache.inline:
+            self._cache.get_keys(self._do_search)
 
         item = self._cache.get_item(index)
         if item is None:
             raise IndexError
         return item
 
+    def __iter__(self):
+        # retrieve and cache keys
+        if not self._cache.inline:
+            self._cache.get_keys(self._do_search)
+
+        return self._cache.get_items(0)
+
     def __len__(self):
         return len(self[:])
 
@@ -145,6 +172,7 @@ class Query(object):
             'literal': self.literal,
             'conditions': [c._clone() for c in self._conditions],
             'ms_type': self._ms_type,
+            'flight': self._flight,
         }
 
         if self._ms_conditions:
@@ -159,14 +187,18 @@ class Query(object):
         return Query(self._proto, self._db_type, **defaults)
 
     def _do_search(self, conditions=None, limit=None, offset=None,
-                   out=False, count=False, hint=False, columns=None):
+                   out=False, count=False, hint=False, columns=None,
+                   get=False, literal=False, proto=None):
         """
         Returns keys of items that correspond to the Query instance.
         """
+        proto = proto or self._proto
         defaults = {
             'out': out,
             'count': count,
             'hint': hint,
+            'get': get,
+            'literal': literal,
             'conditions': conditions or [c.prepare() for c in self._conditions],
             'limit': limit,
             'offset': offset,
@@ -188,7 +220,11 @@ class Query(object):
                 ]
             )
 
-        return self._proto.search(**defaults)
+        if self._flight is not None and not out:
+            signature = ('search', proto.host, proto.port,
+                         repr(sorted(defaults.iteritems())))
+            return self._flight.do(signature, proto.search, **defaults)
+        return proto.search(**defaults)
 
     def _filter(self, negate, args, kwargs):
         query = self._clone()
@@ -420,7 +456,10 @@ class Query(object):
         Sets cache chunk size. Makes sense only if the query has not been
         executed yet.
 
-        :param size: an `int` (custom size) or `None` (default size).
+        :param size: an `int` (custom size), an
+            :class:`~pyrant.chunks.AdaptiveChunkSize` (the size of each chunk
+            is chosen from the size and fetch time of previous ones) or `None`
+            (default size).
 
         Useful if you expect a really large number of results and want to cut
         the number of database hits. In this case you will increase the chunk
@@ -429,7 +468,89 @@ class Query(object):
         .. note:: any existing cache for this query will be dropped.
 
         """
-        self._cache = ResultCache(self, chunk_size=size)
+        old = self._cache
+        self._cache = ResultCache(self, chunk_size=size,
+                                  max_chunks=old.max_chunks,
+                                  max_bytes=old.max_bytes,
+                                  streaming=old.streaming,
+                                  prefetch=old.prefetch, inline=old.inline)
+        old.close()
+
+    def set_cache_policy(self, max_chunks=None, max_bytes=None,
+                         streaming=False):
+        """
+        Defines how many fetched chunks of data are kept. Makes sense only if
+        the query has not been executed yet.
+
+        :param max_chunks: maximum number of chunks to keep; the least
+            recently used ones are dropped. Default is `None` (no limit).
+        :param max_bytes: maximum approximate size of kept data. The most
+            recently used chunk is always kept. Default is `None` (no limit).
+        :param streaming: if True, no chunks are kept at all: iterating over
+            the query or slicing it fetches each chunk once and drops it as
+            soon as its items are yielded, so memory usage does not depend on
+            the number of results (except for the list of keys).
+
+        Usage::
+
+            q = t.query.filter(price__gt=100)
+            q.set_cache_policy(streaming=True)
+            total = sum(int(item['price']) for key, item in q)
+
+        .. note:: in the streaming mode each access by index fetches a whole
+            chunk. Use iteration or slices instead.
+
+        .. note:: any existing cache for this query will be dropped.
+
+        """
+        old = self._cache
+        self._cache = ResultCache(self, chunk_size=old.chunk_size,
+                                  max_chunks=max_chunks, max_bytes=max_bytes,
+                                  streaming=streaming, prefetch=old.prefetch,
+                                  inline=old.inline)
+        old.close()
+
+    def set_prefetch(self, chunks=1):
+        """
+        Enables read-ahead: while the items of a chunk are being yielded by
+        an iteration or a slice, up to given number of next chunks are
+        fetched in a background thread, so that waiting for the server
+        overlaps with processing the data. Zero disables read-ahead.
+
+        The background thread uses a connection of its own: if the query is
+        bound to a :class:`~pyrant.pool.TyrantPool`, it is checked out of the
+        pool, otherwise one is opened on first use and kept for the next
+        iterations and slices of the query until its cache is dropped (see
+        :meth:`set_chunk_size` and :meth:`set_cache_policy`).
+
+        Usage::
+
+            q = t.query.filter(price__gt=100)
+            q.set_prefetch(2)
+            for key, item in q:
+                process(item)
+
+        Access by index is not affected.
+        """
+        self._cache.prefetch = chunks
+
+    def set_inline(self, inline=True):
+        """
+        Makes iteration, slicing and access by index retrieve the records
+        directly with the search, one chunk per search (the `get` and
+        `setlimit` directives), instead of fetching the list of keys first and
+        then the records by keys. This saves a round trip and does not send
+        the keys twice; it also means that the full list of keys is never
+        kept in memory.
+
+        Each chunk is a separate search, so if the matched records change
+        between the searches, records may be skipped or repeated. Ordering
+        the query by a column does not prevent that but makes pages stable
+        as long as the records do not change.
+
+        Makes sense only if the query has not been executed yet.
+        """
+        self._cache.inline = inline
 
     def stat(self):
         """
@@ -705,12 +826,43 @@ class ResultCache(object):
     Represents query results. Implements result caching by chunks. Supports
     slicing and access by item index. Intended to be used internally by
     :class:`~pyrant.query.Query` objects.
+
+    The number and size of cached chunks can be limited with `max_chunks` and
+    `max_bytes` (the least recently used chunks are dropped); if `streaming`
+    is True, chunks are not cached at all (see
+    :meth:`Query.set_cache_policy`). If `prefetch` is set, sequential reads
+    fetch that many chunks ahead in a background thread (see
+    :meth:`Query.set_prefetch`). If `inline` is True, each chunk is retrieved
+    by a search of its own (see :meth:`Query.set_inline`).
+
+    Until the list of keys is needed, access by index and slices with an
+    upper bound only retrieve the requested window of records. Such windows
+    are cached separately from chunks, under the same limits.
     """
-    def __init__(self, query, chunk_size=None):
+    def __init__(self, query, chunk_size=None, max_chunks=None,
+                 max_bytes=None, streaming=False, prefetch=0, inline=False):
         self.query = query
-        self.chunks = {}
+        self.chunks = collections.OrderedDict()
+        self.windows = collections.OrderedDict()   # (start, stop): items
         self.keys = None
         self.chunk_size = chunk_size or CACHE_CHUNK_SIZE
+        self.sizer = None
+        if isinstance(chunk_size, AdaptiveChunkSize):
+            self.sizer = chunk_size
+            # first indices of defined chunks followed by the end of the last
+            # one; a chunk gets its size when it is first referred to
+            self._starts = [0]
+            self._lock = threading.Lock()
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+        self.streaming = streaming
+        self.prefetch = prefetch
+        self.inline = inline
+        self.end = None           # number of results if known without keys
+        self.size = 0             # approximate size of cached chunks
+        self._sizes = {}
+        self._reader_proto = None  # an idle connection for read-ahead
+        self._reader_lock = threading.Lock()
 
     def get_keys(self, getter):
         """
@@ -744,19 +896,79 @@ class ResultCache(object):
         if stop:
             assert start < stop
         chunk = self.get_chunk_number(start)
-        while 1:
-            chunk_start, chunk_stop = self.get_chunk_boundaries(chunk)
-            if stop and stop <= chunk_start:
-                raise StopIteration
-            data = self.get_chunk_data(chunk)
-            if data is None:
-                raise StopIteration
-            for i, item in enumerate(data):
-                if stop and stop <= chunk_start + i:
+        reader = None
+        if self.prefetch:
+            last = None
+            if stop:
+                last = self.get_chunk_number(stop - 1)
+            reader = _ReadAhead(self, chunk, last, self.prefetch)
+        try:
+            while 1:
+                chunk_start, chunk_stop = self.get_chunk_boundaries(chunk)
+                if stop and stop <= chunk_start:
                     raise StopIteration
-                if start <= chunk_start + i:
-                    yield item
-            chunk += 1
+                if reader is None:
+                    data = self.get_chunk_data(chunk)
+                else:
+                    data = reader.get_chunk_data(chunk)
+                if data is None:
+                    raise StopIteration
+                for i, item in enumerate(data):
+                    if stop and stop <= chunk_start + i:
+                        raise StopIteration
+                    if start <= chunk_start + i:
+                        yield item
+                chunk += 1
+        finally:
+            if reader is not None:
+                reader.close()
+
+    def checkout_connection(self):
+        """
+        Returns a connection for reading ahead and a flag telling whether it
+        must be given back with :meth:`checkin_connection`. A pooled protocol
+        is shared by threads; otherwise the idle connection is reused or a new
+        one is opened.
+        """
+        proto = self.query._proto
+        if hasattr(proto, 'pool'):
+            return proto, False
+        self._reader_lock.acquire()
+        try:
+            reader_proto, self._reader_proto = self._reader_proto, None
+        finally:
+            self._reader_lock.release()
+        if reader_proto is None:
+            reader_proto = TyrantProtocol(proto.host, proto.port, proto.timeout,
+                                          instrument=proto.instrument,
+                                          retry=proto.retry)
+        return reader_proto, True
+
+    def checkin_connection(self, proto):
+        """
+        Keeps given connection for the next read-ahead. Closes it if another
+        one is already kept.
+        """
+        self._reader_lock.acquire()
+        try:
+            if self._reader_proto is None:
+                self._reader_proto, proto = proto, None
+        finally:
+            self._reader_lock.release()
+        if proto is not None:
+            proto._sock.close()
+
+    def close(self):
+        """
+        Closes the connection kept for reading ahead, if any.
+        """
+        self._reader_lock.acquire()
+        try:
+            proto, self._reader_proto = self._reader_proto, None
+        finally:
+            self._reader_lock.release()
+        if proto is not None:
+            proto._sock.close()
 
     def get_chunk_number(self, index):
         """
@@ -764,7 +976,15 @@ class ResultCache(object):
         example, if chunk size is set to 10, item #5 will belong to chunk #0
         and item with index #25 will be found in chunk #2.
         """
-        return index / self.chunk_size
+        if self.sizer is None:
+            return index / self.chunk_size
+        self._lock.acquire()
+        try:
+            while self._starts[-1] <= index:
+                self._starts.append(self._starts[-1] + self.sizer.size)
+            return bisect.bisect_right(self._starts, index) - 1
+        finally:
+            self._lock.release()
 
     def get_chunk_boundaries(self, number):
         """
@@ -772,9 +992,17 @@ class ResultCache(object):
         example, if chunk size is set to 10, the first chunk will have
         boundaries `(0, 9)`, the second -- `(10, 19)` and so on.
         """
-        start = number * self.chunk_size
-        stop = start + self.chunk_size - 1
-        return start, stop
+        if self.sizer is None:
+            start = number * self.chunk_size
+            stop = start + self.chunk_size - 1
+            return start, stop
+        self._lock.acquire()
+        try:
+            while len(self._starts) <= number + 1:
+                self._starts.append(self._starts[-1] + self.sizer.size)
+            return self._starts[number], self._starts[number + 1] - 1
+        finally:
+            self._lock.release()
 
     def get_chunk_data(self, number):
         """
@@ -784,20 +1012,198 @@ class ResultCache(object):
         """
         # TODO: do not create empty chunks; check if right boundary is within
         # keys length
-        if not number in self.chunks:
-            # fill cache chunk
-            assert self.keys is not None, 'Cache keys must be filled by query'
-            start, stop = self.get_chunk_boundaries(number)
-            # make sure the chunk is not going to be empty
-            if len(self.keys) <= start:
-                return None
-            # get keys that correspond to the chunk
-            keys = self.keys[start:stop+1]
-            if not keys:
-                return None
-            # hit the database: retrieve values for these keys
-            pairs = self.query._proto.mget(keys)
-            # extend previously created empty list
-            prep = lambda k,v: (k, self.query._to_python(v))
-            self.chunks[number] = [prep(k,v) for k,v in pairs]
-        return self.chunks[number]
+        if number in self.chunks:
+            # mark as recently used
+            data = self.chunks.pop(number)
+            self.chunks[number] = data
+            return data
+        data = self.fetch_chunk(number, self.query._proto)
+        if data is not None and not self.streaming:
+            self.add_chunk(number, data)
+        return data
+
+    def fetch_chunk(self, number, proto):
+        """
+        Retrieves items of given chunk from the database using given
+        protocol. Returns `None` if there are no items for the chunk. Does not
+        touch the cache.
+        """
+        if self.inline:
+            return self.search_chunk(number, proto)
+        assert self.keys is not None, 'Cache keys must be filled by query'
+        start, stop = self.get_chunk_boundaries(number)
+        # make sure the chunk is not going to be empty
+        if len(self.keys) <= start:
+            return None
+        # get keys that correspond to the chunk
+        keys = self.keys[start:stop+1]
+        if not keys:
+            return None
+        # hit the database: retrieve values for these keys
+        started = time.time()
+        pairs = proto.mget(keys)
+        prep = lambda k,v: (k, self.query._to_python(v))
+        data = [prep(k,v) for k,v in pairs]
+        if self.sizer is not None:
+            self.sizer.observe(len(keys), sum(sizeof(k, v) for k, v in data),
+                               time.time() - started)
+        return data
+
+    def search_chunk(self, number, proto):
+        """
+        Retrieves items of given chunk with a search which returns whole
+        records. Returns `None` if there are no items for the chunk.
+        """
+        start, stop = self.get_chunk_boundaries(number)
+        if self.end is not None and self.end <= start:
+            return None
+        started = time.time()
+        data = self.search_records(start, stop + 1, proto)
+        if len(data) < stop - start + 1:
+            self.end = start + len(data)
+        if self.sizer is not None:
+            self.sizer.observe(len(data), sum(sizeof(k, v) for k, v in data),
+                               time.time() - started)
+        return data or None
+
+    def search_records(self, start, stop, proto=None):
+        """
+        Retrieves items with indices from `start` up to (but not including)
+        `stop` with a search which returns whole records. The items are
+        converted the same way as those retrieved by keys.
+        """
+        # the records are not decoded, just like the ones returned by `mget`
+        records = self.query._do_search(limit=stop - start, offset=start,
+                                        get=True, literal=True, proto=proto)
+        data = []
+        for record in records:
+            # the primary key is returned as a column with an empty name
+            columns = record.split(TABLE_COLUMN_SEP)
+            key = None
+            for i in xrange(0, len(columns) - 1, 2):
+                if not columns[i]:
+                    key = columns[i + 1]
+                    del columns[i:i + 2]
+                    break
+            value = TABLE_COLUMN_SEP.join(columns)
+            data.append((key, self.query._to_python(value)))
+        return data
+
+    def get_window(self, start, stop):
+        """
+        Returns a list of items with indices from `start` up to (but not
+        including) `stop`. Uses a cached window if one covers the range,
+        otherwise retrieves just this window and caches it.
+        """
+        for (first, last), data in self.windows.iteritems():
+            # a window shorter than requested ends with the last result
+            if first <= start and (stop <= last or len(data) < last - first):
+                self.windows[first, last] = self.windows.pop((first, last))
+                return data[start - first:stop - first]
+        data = self.search_records(start, stop)
+        if not self.streaming:
+            self._add(self.windows, (start, stop), data)
+        return data
+
+    def _add(self, mapping, key, data):
+        # caches data and drops the least recently used entries of the same
+        # mapping if the cache is over its limits
+        mapping[key] = data
+        if self.max_bytes is not None:
+            self._sizes[key] = sum(sizeof(k, v) for k, v in data)
+            self.size += self._sizes[key]
+        while 1 < len(mapping) and (
+                self.max_chunks is not None and
+                self.max_chunks < len(mapping) or
+                self.max_bytes is not None and self.max_bytes < self.size):
+            key, _ = mapping.popitem(last=False)
+            self.size -= self._sizes.pop(key, 0)
+
+    def add_chunk(self, number, data):
+        """
+        Caches given chunk data and drops the least recently used chunks if
+        the cache is over its limits.
+        """
+        self._add(self.chunks, number, data)
+
+
+class _ReadAhead(object):
+    """
+    Fetches chunks of a :class:`ResultCache` in a background thread, in order,
+    starting with chunk `first` and up to chunk `last` (or the end), keeping
+    at most `depth` fetched chunks waiting to be consumed.
+    """
+
+    # how often a blocked background thread checks whether it must stop
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, cache, first, last, depth):
+        self.cache = cache
+        self.next = first
+        self.last = last
+        self._queue = Queue.Queue(depth)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _put(self, item):
+        while not self._stopped.isSet():
+            try:
+                self._queue.put(item, timeout=self.POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        proto = None
+        own = False
+        failed = False
+        number = self.next
+        try:
+            try:
+                proto, own = self.cache.checkout_connection()
+                while not self._stopped.isSet():
+                    if self.last is not None and self.last < number:
+                        break
+                    # a chunk cached earlier is not fetched again
+                    data = self.cache.chunks.get(number)
+                    if data is None:
+                        data = self.cache.fetch_chunk(number, proto)
+                    if not self._put((number, data, None)) or data is None:
+                        break
+                    number += 1
+            except Exception:
+                failed = True
+                self._put((number, None, sys.exc_info()))
+        finally:
+            if own and proto is not None:
+                if failed:
+                    # the connection may be left in an unknown state
+                    proto._sock.close()
+                else:
+                    self.cache.checkin_connection(proto)
+
+    def get_chunk_data(self, number):
+        """
+        Returns the data of given chunk, which must be the next one.
+        """
+        assert number == self.next, 'chunks must be read in order'
+        _, data, error = self._queue.get()
+        if error is not None:
+            raise error[0], error[1], error[2]
+        self.next += 1
+        if data is None or self.cache.streaming:
+            return data
+        if number in self.cache.chunks:
+            # mark as recently used
+            return self.cache.get_chunk_data(number)
+        self.cache.add_chunk(number, data)
+        return data
+
+    def close(self):
+        """
+        Stops the background thread.
+        """
+        self._stopped.set()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Reconnection and retries.
+
+By default a :class:`~pyrant.protocol.TyrantProtocol` whose connection has
+been lost (e.g. because the server was restarted) keeps failing. With a
+:class:`RetryPolicy` the connection is re-established on the next call, and
+commands that can be safely repeated are retried after a pause::
+
+    from pyrant import Tyrant
+    from pyrant.retry import RetryPolicy
+
+    t = Tyrant(retry=RetryPolicy(retries=5, deadline=2.0))
+
+The pauses grow exponentially and are randomized ("full jitter"), so that
+many clients do not reconnect to a restarted server all at once. If a
+`deadline` is set, no call takes longer than that, including the pauses: the
+connect timeout of a reconnection and the socket timeout of each attempt are
+reduced to the remaining time.
+
+Only idempotent commands are retried: reads (`get`, `mget`, `vsiz`,
+`fwmkeys`, `rnum`, `size`, `stat`, `misc` functions `get` and `getlist`) and
+searches which do not remove records. Other commands fail as usual but still
+leave the connection ready to be re-established by the next call.
+"""
+
+import inspect
+import random
+import socket
+import time
+
+from protocol import Pipeline, _TyrantSocket
+
+
+__all__ = ['RetryPolicy']
+
+
+#: commands that can be safely repeated
+IDEMPOTENT = ('get', 'getint', 'getdouble', 'mget', 'vsiz', 'fwmkeys', 'rnum',
+              'size', 'stat')
+
+#: idempotent functions of `misc`
+IDEMPOTENT_MISC = ('get', 'getlist')
+
+_retrying_classes = {}
+
+
+def _wrap(name, method):
+    def call(self, *args, **kwargs):
+        if self._retrying or type(self._sock) is not _TyrantSocket:
+            # nested commands (e.g. `search` calls `misc`) and pipelines
+            return method(self, *args, **kwargs)
+        return self.retry.run(self, name, method, args, kwargs)
+
+    call.__name__ = name
+    call.__doc__ = method.__doc__
+    return call
+
+
+def _retrying_class(cls):
+    # a subclass of given protocol class with all commands wrapped
+    if cls in _retrying_classes.values():
+        return cls
+    if cls not in _retrying_classes:
+        attrs = {'_retrying': False}
+        for name in Pipeline.COMMANDS:
+            attrs[name] = _wrap(name, getattr(cls, name).im_func)
+        _retrying_classes[cls] = type(cls.__name__, (cls,), attrs)
+    return _retrying_classes[cls]
+
+
+class RetryPolicy(object):
+    """
+    Defines when and how commands are retried after a connection failure.
+
+    :param retries: maximum number of retries of a command.
+    :param backoff: the base pause in seconds. The pause before the n-th
+        retry is a random number between zero and ``backoff * 2 ** n``.
+    :param max_backoff: the upper limit of a pause.
+    :param deadline: maximum number of seconds a call may take, including all
+        retries and pauses. Default is `None` (no limit).
+    """
+
+    def __init__(self, retries=3, backoff=0.05, max_backoff=2.0,
+                 deadline=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.deadline = deadline
+
+    def __repr__(self):
+        return u'<RetryPolicy retries=%s deadline=%s>' % (self.retries,
+                                                          self.deadline)
+
+    def attach(self, proto):
+        """
+        Installs the policy on given :class:`~pyrant.protocol.TyrantProtocol`
+        instance. Called by the protocol itself.
+        """
+        proto.retry = self
+        proto._broken = False
+        proto.__class__ = _retrying_class(type(proto))
+
+    def is_idempotent(self, method, args, kwargs):
+        """
+        Returns `True` if a call of given protocol method can be repeated.
+        """
+        name = method.__name__
+        if name in IDEMPOTENT:
+            return True
+        if name not in ('misc', 'search'):
+            return False
+        values = inspect.getcallargs(method, None, *args, **kwargs)
+        if name == 'search':
+            return not values['out']
+        if values['func'] == 'search':
+            return 'out' not in values['args']
+        return values['func'] in IDEMPOTENT_MISC
+
+    def get_pause(self, attempt):
+        """
+        Returns the number of seconds to wait before given retry (starting
+        with zero).
+        """
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+    def _get_remaining(self, deadline):
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout('deadline exceeded')
+        return remaining
+
+    def run(self, proto, name, method, args, kwargs):
+        """
+        Calls given protocol method, reconnecting and retrying as needed.
+        """
+        deadline = None
+        if self.deadline is not None:
+            deadline = time.time() + self.deadline
+        attempt = 0
+        proto._retrying = True
+        try:
+            while True:
+                try:
+                    if proto._broken:
+                        if deadline is None:
+                            proto.reconnect()
+                        else:
+                            proto.reconnect(self._get_remaining(deadline))
+                        proto._broken = False
+                    if deadline is not None:
+                        proto._sock._sock.settimeout(
+                            self._get_remaining(deadline))
+                    return method(proto, *args, **kwargs)
+                except socket.error:
+                    # the state of the connection is unknown
+                    proto._broken = True
+                    if (self.retries <= attempt or
+                        not self.is_idempotent(method, args, kwargs)):
+                        raise
+                    pause = self.get_pause(attempt)
+                    if deadline is not None and deadline <= time.time() + pause:
+                        raise
+                    time.sleep(pause)
+                    attempt += 1
+        finally:
+            proto._retrying = False
+            if deadline is not None and not proto._broken:
+                proto._sock._sock.settimeout(proto.timeout)
@@ -0,0 +1,862 @@
+# -*- coding: utf-8 -*-
+"""
+A pure-Python stand-in for the Tokyo Tyrant server.
+
+:class:`TyrantServer` speaks the binary protocol and keeps a hash or table
+database in memory. It is meant for tests and benchmarks on machines without
+`ttserver`, not for production use. Network conditions can be simulated with
+artificial round-trip latency and bandwidth, so that the effect of pipelining,
+pooling and batching can be measured locally::
+
+    >>> from pyrant import Tyrant
+    >>> from pyrant.server import TyrantServer
+    >>> server = TyrantServer(latency=0.001).start()
+    >>> t = Tyrant(host=server.host, port=server.port)
+    >>> t['foo'] = {'name': 'Foo'}
+    >>> t['foo']
+    {u'name': u'Foo'}
+    >>> server.stop()
+
+The server can also be run from the command line::
+
+    $ python -m pyrant.server --port 1983 --latency 0.5
+
+Supported commands: `put`, `putkeep`, `putcat`, `putshl`, `putnr`, `out`,
+`get`, `mget`, `vsiz`, `iterinit`, `iternext`, `fwmkeys`, `addint`,
+`adddouble`, `sync`, `vanish`, `rnum`, `size`, `stat` and `misc` with
+functions `put`, `putkeep`, `putcat`, `out`, `get`, `putlist`, `outlist`,
+`getlist`, `iterinit`, `iternext`, `sync`, `vanish` and (for table databases)
+`setindex`, `search` and `genuid`. Search supports all conditions, ordering,
+limits, metasearch and the `get`, `out`, `count` and `hint` options. Indices
+are accepted but not used. Commands that need files or Lua extensions (`ext`,
+`copy`, `restore`, `setmst`) always fail.
+"""
+
+import math
+import optparse
+import os
+import re
+import SocketServer
+import socket
+import struct
+import threading
+import time
+
+from protocol import (TyrantProtocol as P, MAGIC_NUMBER, TABLE_COLUMN_SEP,
+                      DB_HASH, DB_TABLE)
+
+
+__all__ = ['TyrantServer']
+
+
+VERSION = '1.1.41'
+
+_INT = struct.Struct('>I')
+_SIGNED_INT = struct.Struct('>i')
+_LONG = struct.Struct('>Q')
+
+_NUMBER_RE = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?')
+_TOKEN_SEP_RE = re.compile(r'[ ,]+')
+
+
+class _Failure(Exception):
+    "The command could not be executed; status code 1 is returned."
+    pass
+
+
+def _number(value):
+    # mimics tcatof(): leading garbage makes zero, trailing garbage is ignored
+    match = _NUMBER_RE.match(value)
+    return float(match.group(0)) if match else 0.0
+
+def _tokens(value):
+    return [x for x in _TOKEN_SEP_RE.split(value) if x]
+
+def _pack_str(value):
+    return _INT.pack(len(value)) + value
+
+def _pack_list(values):
+    return _INT.pack(len(values)) + ''.join(_pack_str(x) for x in values)
+
+
+class Database(object):
+    """
+    In-memory storage with Tokyo Cabinet semantics. Records of a table
+    database are dictionaries of columns; records of a hash database are
+    strings. All methods expect the caller to hold :attr:`lock`.
+    """
+
+    def __init__(self, db_type=DB_TABLE, path=':memory:'):
+        assert db_type in (DB_HASH, DB_TABLE)
+        self.db_type = db_type
+        self.path = path
+        self.lock = threading.RLock()
+        self.records = {}
+        self.order = []        # keys in insertion order (may contain removed)
+        self.indices = set()
+        self.iterator = None
+        self.uid = 0
+
+    @property
+    def is_table(self):
+        return self.db_type == DB_TABLE
+
+    # records
+
+    def parse(self, value):
+        "Converts a serialized value to a record."
+        if not self.is_table:
+            return value
+        elems = value.split(TABLE_COLUMN_SEP)
+        cols = {}
+        names = []
+        for i in xrange(0, len(elems) - 1, 2):
+            if elems[i] not in cols:
+                names.append(elems[i])
+            cols[elems[i]] = elems[i + 1]
+        return [(name, cols[name]) for name in names if name]
+
+    def dump(self, record):
+        "Converts a record to its serialized form."
+        if not self.is_table:
+            return record
+        return TABLE_COLUMN_SEP.join(x for pair in record for x in pair)
+
+    def keys(self):
+        if len(self.order) > 2 * len(self.records) + 100:
+            self.order = [k for k in self.order if k in self.records]
+        seen = set()
+        for key in self.order:
+            if key in self.records and key not in seen:
+                seen.add(key)
+                yield key
+
+    def get(self, key):
+        if key not in self.records:
+            raise _Failure
+        return self.dump(self.records[key])
+
+    def put(self, key, value, mode=None):
+        exists = key in self.records
+        if mode == 'keep' and exists:
+            raise _Failure
+        record = self.parse(value)
+        if mode == 'cat' and exists:
+            if self.is_table:
+                cols = dict(self.records[key])
+                names = [n for n, v in self.records[key]]
+                for name, col in record:
+                    if name not in cols:
+                        names.append(name)
+                    cols[name] = col
+                record = [(name, cols[name]) for name in names]
+            else:
+                record = self.records[key] + record
+        if self.is_table and not record:
+            raise _Failure
+        if not exists:
+            self.order.append(key)
+        self.records[key] = record
+
+    def out(self, key):
+        if key not in self.records:
+            raise _Failure
+        del self.records[key]
+
+    def add_number(self, key, num, cast):
+        if self.is_table:
+            cols = dict(self.records.get(key, []))
+            num = cast(_number(cols.get('_num', '0'))) + num
+            cols['_num'] = repr(num) if cast is float else str(num)
+            if key not in self.records:
+                self.order.append(key)
+            self.records[key] = [(n, v) for n, v in self.records.get(key, [])
+                                 if n != '_num'] + [('_num', cols['_num'])]
+            return num
+        fmt = '<i' if cast is int else '<d'
+        if key in self.records:
+            if len(self.records[key]) != struct.calcsize(fmt):
+                raise _Failure
+            num += struct.unpack(fmt, self.records[key])[0]
+        else:
+            self.order.append(key)
+        self.records[key] = struct.pack(fmt, num)
+        return num
+
+    def vanish(self):
+        self.records.clear()
+        self.order = []
+        self.iterator = None
+
+    def size(self):
+        return 4096 + sum(len(k) + len(self.dump(v)) + 16
+                          for k, v in self.records.iteritems())
+
+    def genuid(self):
+        self.uid += 1
+        while str(self.uid) in self.records:
+            self.uid += 1
+        return self.uid
+
+    # table search
+
+    def match(self, key, record, cond):
+        name, op, expr = cond
+        negate = bool(op & P.RDBQCNEGATE)
+        op = op & ~(P.RDBQCNEGATE | P.RDBQCNOIDX)
+        if name:
+            value = dict(record).get(name)
+        else:
+            value = key
+        if value is None:
+            # records without the column only match negated conditions
+            return negate
+        return self._match_value(value, op, expr) != negate
+
+    def _match_value(self, value, op, expr):
+        if op == P.RDBQCSTREQ:
+            return value == expr
+        if op == P.RDBQCSTRINC:
+            return expr in value
+        if op == P.RDBQCSTRBW:
+            return value.startswith(expr)
+        if op == P.RDBQCSTREW:
+            return value.endswith(expr)
+        if op == P.RDBQCSTRAND:
+            tokens = _tokens(value)
+            return all(x in tokens for x in _tokens(expr))
+        if op == P.RDBQCSTROR:
+            tokens = _tokens(value)
+            return any(x in tokens for x in _tokens(expr))
+        if op == P.RDBQCSTROREQ:
+            return value in _tokens(expr)
+        if op == P.RDBQCSTRRX:
+            return re.search(expr, value) is not None
+        if P.RDBQCNUMEQ <= op <= P.RDBQCNUMLE:
+            a, b = _number(value), _number(expr)
+            return {P.RDBQCNUMEQ: a == b, P.RDBQCNUMGT: a > b,
+                    P.RDBQCNUMGE: a >= b, P.RDBQCNUMLT: a < b,
+                    P.RDBQCNUMLE: a <= b}[op]
+        if op == P.RDBQCNUMBT:
+            bounds = sorted(_number(x) for x in _tokens(expr)[:2])
+            return len(bounds) == 2 and bounds[0] <= _number(value) <= bounds[1]
+        if op == P.RDBQCNUMOREQ:
+            return _number(value) in [_number(x) for x in _tokens(expr)]
+        text = value.lower()
+        if op == P.RDBQCFTSPH:
+            return expr.lower() in text
+        if op == P.RDBQCFTSAND:
+            return all(x.lower() in text for x in _tokens(expr))
+        if op == P.RDBQCFTSOR:
+            return any(x.lower() in text for x in _tokens(expr))
+        if op == P.RDBQCFTSEX:
+            # "a && b || c !! d": OR of AND-groups; "!!" excludes a phrase
+            for group in expr.lower().split('||'):
+                terms = group.replace('!!', '&&!').split('&&')
+                ok = True
+                for term in terms:
+                    term = term.strip()
+                    if term.startswith('!'):
+                        ok = ok and term[1:].strip() not in text
+                    elif term:
+                        ok = ok and term in text
+                if ok:
+                    return True
+            return False
+        raise _Failure
+
+    def search(self, query):
+        keys = []
+        for key in self.keys():
+            record = self.records[key]
+            if all(self.match(key, record, c) for c in query['conds']):
+                keys.append(key)
+        return keys
+
+    def sort(self, keys, order):
+        name, kind = order
+        desc = kind in (P.RDBQOSTRDESC, P.RDBQONUMDESC)
+        numeric = kind in (P.RDBQONUMASC, P.RDBQONUMDESC)
+
+        def get(key):
+            value = key if not name else dict(self.records[key]).get(name, '')
+            return _number(value) if numeric else value
+
+        return sorted(keys, key=get, reverse=desc)
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+    """
+    Serves one client connection.
+    """
+
+    def setup(self):
+        self.request.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+        self.db = self.server.db
+        self.buf = ''
+        self.pos = 0
+        self.arrival = 0
+        self.link_free = 0
+        self.server.connections.add(self.request)
+
+    def finish(self):
+        self.server.connections.discard(self.request)
+
+    def read(self, size):
+        while len(self.buf) - self.pos < size:
+            data = self.request.recv(65536)
+            if not data:
+                raise EOFError
+            self.server.count('bytes_received', len(data))
+            self.buf = self.buf[self.pos:] + data
+            self.pos = 0
+        data = self.buf[self.pos:self.pos + size]
+        self.pos += size
+        return data
+
+    def read_int(self):
+        return _INT.unpack(self.read(4))[0]
+
+    def read_ints(self, count):
+        return struct.unpack('>%dI' % count, self.read(4 * count))
+
+    def handle(self):
+        while True:
+            if self.pos == len(self.buf):
+                # nothing buffered: the request is sent after the previous
+                # response has been received
+                try:
+                    self.read(1)
+                except (EOFError, socket.error):
+                    return
+                self.pos -= 1
+                self.arrival = time.time()
+            # else the request was pipelined with the previous one
+            try:
+                magic, code = struct.unpack('>BB', self.read(2))
+                if magic != MAGIC_NUMBER:
+                    return
+                response = self.dispatch(code)
+            except (EOFError, socket.error):
+                return
+            if response is not None:
+                self.respond(response)
+
+    def respond(self, data):
+        server = self.server
+        deliver = self.arrival + server.latency
+        if server.bandwidth:
+            deliver = max(deliver, self.link_free) + len(data) / float(server.bandwidth)
+            self.link_free = deliver
+        delay = deliver - time.time()
+        if 0 < delay:
+            time.sleep(delay)
+        server.count('bytes_sent', len(data))
+        try:
+            self.request.sendall(data)
+        except socket.error:
+            pass
+
+    def dispatch(self, code):
+        handler = self.server.COMMANDS.get(code)
+        self.server.count('requests')
+        if handler is None:
+            return None
+        # arguments are read before the database lock is acquired
+        try:
+            return getattr(self, 'do_' + handler)()
+        except _Failure:
+            return '\x01'
+
+    def locked(self, func, *args):
+        self.db.lock.acquire()
+        try:
+            return func(*args)
+        finally:
+            self.db.lock.release()
+
+    # commands
+
+    def _do_put(self, mode, code):
+        ksiz, vsiz = self.read_ints(2)
+        key, value = self.read(ksiz), self.read(vsiz)
+        self.server.count('cnt_put')
+        try:
+            self.locked(self.db.put, key, value, mode)
+        except _Failure:
+            return None if code == P.PUTNR else '\x01'
+        return None if code == P.PUTNR else '\x00'
+
+    def do_put(self):
+        return self._do_put(None, P.PUT)
+
+    def do_putkeep(self):
+        return self._do_put('keep', P.PUTKEEP)
+
+    def do_putcat(self):
+        return self._do_put('cat', P.PUTCAT)
+
+    def do_putnr(self):
+        return self._do_put(None, P.PUTNR)
+
+    def do_putshl(self):
+        ksiz, vsiz, width = self.read_ints(3)
+        key, value = self.read(ksiz), self.read(vsiz)
+        self.server.count('cnt_put')
+        def putshl():
+            if self.db.is_table:
+                raise _Failure
+            value_ = self.db.records.get(key, '') + value
+            self.db.put(key, value_[-width:] if width else '')
+        self.locked(putshl)
+        return '\x00'
+
+    def do_out(self):
+        key = self.read(self.read_int())
+        self.server.count('cnt_out')
+        self.locked(self.db.out, key)
+        return '\x00'
+
+    def do_get(self):
+        key = self.read(self.read_int())
+        self.server.count('cnt_get')
+        return '\x00' + _pack_str(self.locked(self.db.get, key))
+
+    def do_mget(self):
+        count = self.read_int()
+        keys = [self.read(self.read_int()) for i in xrange(count)]
+        self.server.count('cnt_get', count)
+        def mget():
+            return [(k, self.db.dump(self.db.records[k]))
+                    for k in keys if k in self.db.records]
+        pairs = self.locked(mget)
+        return '\x00' + _INT.pack(len(pairs)) + ''.join(
+            _INT.pack(len(k)) + _INT.pack(len(v)) + k + v for k, v in pairs)
+
+    def do_vsiz(self):
+        key = self.read(self.read_int())
+        return '\x00' + _INT.pack(len(self.locked(self.db.get, key)))
+
+    def do_iterinit(self):
+        def iterinit():
+            self.db.iterator = list(self.db.keys())
+            self.db.iterator.reverse()
+        self.locked(iterinit)
+        return '\x00'
+
+    def _iternext(self):
+        while self.db.iterator:
+            key = self.db.iterator.pop()
+            if key in self.db.records:
+                return key
+        raise _Failure
+
+    def do_iternext(self):
+        return '\x00' + _pack_str(self.locked(self._iternext))
+
+    def do_fwmkeys(self):
+        psiz, = self.read_ints(1)
+        maxkeys, = _SIGNED_INT.unpack(self.read(4))
+        prefix = self.read(psiz)
+        def fwmkeys():
+            keys = [k for k in self.db.keys() if k.startswith(prefix)]
+            return keys if maxkeys < 0 else keys[:maxkeys]
+        return '\x00' + _pack_list(self.locked(fwmkeys))
+
+    def do_addint(self):
+        ksiz, = self.read_ints(1)
+        num, = _SIGNED_INT.unpack(self.read(4))
+        key = self.read(ksiz)
+        self.server.count('cnt_put')
+        result = self.locked(self.db.add_number, key, num, int)
+        return '\x00' + _SIGNED_INT.pack(result)
+
+    def do_adddouble(self):
+        ksiz, = self.read_ints(1)
+        integ, fract = struct.unpack('>QQ', self.read(16))
+        key = self.read(ksiz)
+        self.server.count('cnt_put')
+        result = self.locked(self.db.add_number, key, integ + fract * 1e-12,
+                             float)
+        fract, integ = math.modf(result)
+        return '\x00' + struct.pack('>QQ', int(integ),
+                                    int(round(fract * 1e12)))
+
+    def do_ext(self):
+        nsiz, opts, ksiz, vsiz = self.read_ints(4)
+        self.read(nsiz + ksiz + vsiz)
+        raise _Failure
+
+    def do_sync(self):
+        return '\x00'
+
+    def do_vanish(self):
+        self.locked(self.db.vanish)
+        return '\x00'
+
+    def do_copy(self):
+        self.read(self.read_int())
+        raise _Failure
+
+    def do_restore(self):
+        psiz, = self.read_ints(1)
+        self.read(8 + psiz)
+        raise _Failure
+
+    def do_setmst(self):
+        hsiz, port = self.read_ints(2)
+        self.read(hsiz)
+        raise _Failure
+
+    def do_rnum(self):
+        return '\x00' + _LONG.pack(len(self.db.records))
+
+    def do_size(self):
+        return '\x00' + _LONG.pack(self.locked(self.db.size))
+
+    def do_stat(self):
+        return '\x00' + _pack_str(self.server.stat())
+
+    def do_misc(self):
+        nsiz, opts, count = self.read_ints(3)
+        name = self.read(nsiz)
+        args = [self.read(self.read_int()) for i in xrange(count)]
+        self.server.count('cnt_misc')
+        method = getattr(self, 'misc_' + name, None)
+        try:
+            if method is None:
+                raise _Failure
+            result = self.locked(method, args)
+        except (_Failure, IndexError, ValueError, re.error):
+            return '\x01' + _INT.pack(0)
+        return '\x00' + _pack_list(result)
+
+    # misc functions
+
+    def misc_put(self, args):
+        self._misc_put(args, None)
+        return []
+
+    def misc_putkeep(self, args):
+        self._misc_put(args, 'keep')
+        return []
+
+    def misc_putcat(self, args):
+        self._misc_put(args, 'cat')
+        return []
+
+    def _misc_put(self, args, mode):
+        key = args[0]
+        if self.db.is_table:
+            value = TABLE_COLUMN_SEP.join(args[1:])
+        else:
+            value = args[1]
+        self.db.put(key, value, mode)
+
+    def misc_out(self, args):
+        self.db.out(args[0])
+        return []
+
+    def misc_get(self, args):
+        value = self.db.get(args[0])
+        if self.db.is_table:
+            return value.split(TABLE_COLUMN_SEP) if value else []
+        return [value]
+
+    def misc_putlist(self, args):
+        for i in xrange(0, len(args) - 1, 2):
+            self.db.put(args[i], args[i + 1])
+        return []
+
+    def misc_outlist(self, args):
+        for key in args:
+            self.db.records.pop(key, None)
+        return []
+
+    def misc_getlist(self, args):
+        result = []
+        for key in args:
+            if key in self.db.records:
+                result.extend((key, self.db.dump(self.db.records[key])))
+        return result
+
+    def misc_iterinit(self, args):
+        self.do_iterinit()
+        return []
+
+    def misc_iternext(self, args):
+        key = self._iternext()
+        if self.db.is_table:
+            return [key] + self.db.dump(self.db.records[key]).split(TABLE_COLUMN_SEP)
+        return [key, self.db.records[key]]
+
+    def misc_sync(self, args):
+        return []
+
+    def misc_vanish(self, args):
+        self.db.vanish()
+        return []
+
+    def misc_genuid(self, args):
+        if not self.db.is_table:
+            raise _Failure
+        return [str(self.db.genuid())]
+
+    def misc_setindex(self, args):
+        if not self.db.is_table:
+            raise _Failure
+        name, kind = args[0], int(args[1])
+        if kind in (P.TDBITVOID, P.TDBITOPT):
+            if name not in self.db.indices:
+                raise _Failure
+            if kind == P.TDBITVOID:
+                self.db.indices.discard(name)
+        else:
+            if kind & P.TDBITKEEP and name in self.db.indices:
+                raise _Failure
+            self.db.indices.add(name)
+        return []
+
+    def misc_search(self, args):
+        if not self.db.is_table:
+            raise _Failure
+        queries = [{'conds': []}]
+        order = limit = columns = ms_type = None
+        out = count = hint = False
+        for arg in args:
+            parts = arg.split(TABLE_COLUMN_SEP)
+            directive = parts[0]
+            if directive == 'addcond':
+                queries[-1]['conds'].append((parts[1], int(parts[2]),
+                                             TABLE_COLUMN_SEP.join(parts[3:])))
+            elif directive == 'setorder':
+                order = parts[1], int(parts[2])
+            elif directive == 'setlimit':
+                limit = int(parts[1]), int(parts[2])
+            elif directive == 'get':
+                columns = parts[1:]
+            elif directive == 'mstype':
+                ms_type = int(parts[1])
+            elif directive == 'next':
+                queries.append({'conds': []})
+            elif directive == 'out':
+                out = True
+            elif directive == 'count':
+                count = True
+            elif directive == 'hint':
+                hint = True
+
+        keys = self.db.search(queries[0])
+        for query in queries[1:]:
+            other = set(self.db.search(query))
+            if ms_type == P.TDBMSISECT:
+                keys = [k for k in keys if k in other]
+            elif ms_type == P.TDBMSDIFF:
+                keys = [k for k in keys if k not in other]
+            else:
+                known = set(keys)
+                keys += [k for k in self.db.keys() if k in other and k not in known]
+        scanned = len(self.db.records)
+        if order:
+            keys = self.db.sort(keys, order)
+        if limit:
+            maximum, skip = limit
+            keys = keys[skip:] if maximum < 0 else keys[skip:skip + maximum]
+
+        if out:
+            for key in keys:
+                del self.db.records[key]
+            result = []
+        elif count:
+            result = [str(len(keys))]
+        elif columns is not None:
+            result = []
+            for key in keys:
+                record = self.db.records[key]
+                if columns:
+                    cols = dict(record)
+                    record = [(n, cols[n]) for n in columns if n in cols]
+                else:
+                    record = [('', key)] + record
+                result.append(TABLE_COLUMN_SEP.join(x for p in record for x in p))
+        else:
+            result = keys
+        if hint:
+            result.append('\nHINT: scanning the whole table (%d records), '
+                          'result set size: %d\n' % (scanned, len(keys)))
+        return result
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TyrantServer(object):
+    """
+    A Tokyo Tyrant stand-in server which runs in a background thread.
+
+    :param host: address to listen on.
+    :param port: port to listen on. Default is 0 (any free port); the actual
+        port is available as :attr:`port` after :meth:`start`.
+    :param db_type: `pyrant.protocol.DB_TABLE` (default) or
+        `pyrant.protocol.DB_HASH`.
+    :param latency: simulated network round-trip time in seconds. Each
+        response is delayed so that it arrives `latency` seconds after the
+        request was sent; requests pipelined together share the delay.
+    :param bandwidth: simulated bandwidth in bytes per second for responses.
+        Default is `None` (unlimited).
+
+    The server counts requests and bytes sent and received; see
+    :attr:`counters`.
+    """
+
+    COMMANDS = {
+        P.PUT: 'put', P.PUTKEEP: 'putkeep', P.PUTCAT: 'putcat',
+        P.PUTSHL: 'putshl', P.PUTNR: 'putnr', P.OUT: 'out', P.GET: 'get',
+        P.MGET: 'mget', P.VSIZ: 'vsiz', P.ITERINIT: 'iterinit',
+        P.ITERNEXT: 'iternext', P.FWMKEYS: 'fwmkeys', P.ADDINT: 'addint',
+        P.ADDDOUBLE: 'adddouble', P.EXT: 'ext', P.SYNC: 'sync',
+        P.VANISH: 'vanish', P.COPY: 'copy', P.RESTORE: 'restore',
+        P.SETMST: 'setmst', P.RNUM: 'rnum', P.SIZE: 'size', P.STAT: 'stat',
+        P.MISC: 'misc',
+    }
+
+    def __init__(self, host='127.0.0.1', port=0, db_type=DB_TABLE,
+                 latency=0, bandwidth=None, path=':memory:'):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.db = Database(db_type, path)
+        self.counters = {}
+        self.started = time.time()
+        self._counters_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __repr__(self):
+        return u'<TyrantServer %s:%s>' % (self.host, self.port)
+
+    def count(self, name, value=1):
+        """
+        Increments given counter.
+        """
+        self._counters_lock.acquire()
+        try:
+            self.counters[name] = self.counters.get(name, 0) + value
+        finally:
+            self._counters_lock.release()
+
+    def reset_counters(self):
+        self._counters_lock.acquire()
+        try:
+            self.counters = {}
+        finally:
+            self._counters_lock.release()
+
+    def stat(self):
+        """
+        Returns the status report in the same format as Tokyo Tyrant.
+        """
+        db = self.db
+        db.lock.acquire()
+        try:
+            stats = [
+                ('version', VERSION),
+                ('libver', '906'),
+                ('protver', '0.91'),
+                ('os', os.uname()[0]),
+                ('time', '%.6f' % time.time()),
+                ('pid', os.getpid()),
+                ('sid', id(self) % 65536),
+                ('type', db.db_type),
+                ('path', db.path),
+                ('rnum', len(db.records)),
+                ('size', db.size()),
+                ('bigend', 0),
+                ('fd', self._server.fileno() if self._server else -1),
+                ('loadavg', '%.6f' % os.getloadavg()[0]),
+                ('ru_real', '%.6f' % (time.time() - self.started)),
+                ('mhost', ''),
+                ('mport', 0),
+                ('rts', 0),
+                ('delay', '0.000000'),
+            ]
+        finally:
+            db.lock.release()
+        for name in 'cnt_put', 'cnt_out', 'cnt_get', 'cnt_misc':
+            stats.append((name, self.counters.get(name, 0)))
+        return ''.join('%s\t%s\n' % pair for pair in stats)
+
+    def start(self):
+        """
+        Starts serving in a background thread. Returns the server instance.
+        """
+        server = _Server((self.host, self.port), _Handler)
+        server.db = self.db
+        server.latency = self.latency
+        server.bandwidth = self.bandwidth
+        server.COMMANDS = self.COMMANDS
+        server.count = self.count
+        server.stat = self.stat
+        server.connections = set()
+        self.host, self.port = server.server_address
+        self._server = server
+        self._thread = threading.Thread(target=server.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the server and closes all client connections.
+        """
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        for sock in list(self._server.connections):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self._thread.join()
+        self._server = None
+
+    def serve_forever(self):
+        """
+        Serves in the current thread until interrupted.
+        """
+        self.start()
+        try:
+            while self._thread.isAlive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(description='Runs a Tokyo Tyrant '
+                                   'stand-in server (for testing only).')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('-p', '--port', type='int', default=1978)
+    parser.add_option('--hash', action='store_true',
+                      help='serve a hash database instead of a table one')
+    parser.add_option('--latency', type='float', default=0,
+                      help='simulated round-trip time in milliseconds')
+    parser.add_option('--bandwidth', type='float', default=None,
+                      help='simulated bandwidth in megabytes per second')
+    options, args = parser.parse_args(argv)
+    server = TyrantServer(options.host, options.port,
+                          db_type=DB_HASH if options.hash else DB_TABLE,
+                          latency=options.latency / 1000.0,
+                          bandwidth=(options.bandwidth and
+                                     options.bandwidth * 1024 * 1024))
+    print 'Serving on %s:%s...' % (options.host, options.port)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
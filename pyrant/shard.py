@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+Client-side sharding across multiple Tyrant servers.
+
+A single Tokyo Tyrant process is bound to one CPU core and one disk.
+:class:`ShardedTyrant` spreads records over several servers and provides the
+same dictionary API as :class:`~pyrant.Tyrant`::
+
+    from pyrant.shard import ShardedTyrant
+
+    t = ShardedTyrant([('10.0.0.1', 1978), ('10.0.0.2', 1978, 2)])
+    t['foo'] = {'name': 'Foo'}
+    t.multi_get(['foo', 'bar'])
+
+Keys are mapped to servers with a consistent hash ring, so adding or removing
+a server only moves about 1/N of the keys. Bulk operations are split per
+server and the parts are executed concurrently. Queries are sent to all
+servers and the results are merged (see :class:`ShardedQuery`)::
+
+    t.query.filter(price__gt=10).order_by('price', numeric=True)[:20]
+
+"""
+
+import bisect
+import hashlib
+import heapq
+import itertools
+import sys
+import threading
+
+import utils
+from query import Ordering
+
+
+__all__ = ['HashRing', 'ShardedTyrant', 'ShardedQuery']
+
+
+class HashRing(object):
+    """
+    Consistent hash ring. Each node is placed on the ring at a number of
+    points (virtual nodes) proportional to its weight; a key belongs to the
+    first node found clockwise from the key's hash.
+
+    :param nodes: a dictionary of node names and weights (or a list of
+        node names, each with the weight of 1).
+    :param replicas: number of virtual nodes per unit of weight.
+
+    Usage::
+
+        >>> from pyrant.shard import HashRing
+        >>> ring = HashRing({'a': 1, 'b': 2})
+        >>> ring.get_node('foo') in ('a', 'b')
+        True
+
+    """
+
+    def __init__(self, nodes, replicas=160):
+        if not isinstance(nodes, dict):
+            nodes = dict((node, 1) for node in nodes)
+        assert nodes, 'at least one node is required'
+        self.replicas = replicas
+        ring = {}
+        for node, weight in sorted(nodes.iteritems()):
+            # each digest yields four points on the ring (as in ketama)
+            for i in xrange(max(1, int(replicas * weight / 4))):
+                digest = hashlib.md5('%s-%d' % (node, i)).digest()
+                for offset in 0, 4, 8, 12:
+                    ring[self._unpack(digest, offset)] = node
+        self._points = sorted(ring)
+        self._nodes = [ring[point] for point in self._points]
+
+    def _unpack(self, digest, offset=0):
+        return (ord(digest[offset + 3]) << 24 | ord(digest[offset + 2]) << 16 |
+                ord(digest[offset + 1]) << 8 | ord(digest[offset]))
+
+    def get_node(self, key):
+        """
+        Returns the node responsible for given key.
+        """
+        point = self._unpack(hashlib.md5(utils.to_bytes(key)).digest())
+        index = bisect.bisect(self._points, point)
+        if index == len(self._points):
+            index = 0
+        return self._nodes[index]
+
+
+def run_parallel(calls):
+    """
+    Executes given ``(function, args)`` pairs concurrently, one thread per
+    call (the last call is executed in the current thread). Returns the list
+    of results in the same order. If any call fails, the first error is
+    re-raised after all calls have finished.
+    """
+    calls = list(calls)
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+
+    def run(index):
+        func, args = calls[index]
+        try:
+            results[index] = func(*args)
+        except:
+            errors[index] = sys.exc_info()
+
+    threads = []
+    for index in xrange(len(calls) - 1):
+        thread = threading.Thread(target=run, args=(index,))
+        thread.start()
+        threads.append(thread)
+    if calls:
+        run(len(calls) - 1)
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error:
+            raise error[0], error[1], error[2]
+    return results
+
+
+class ShardedTyrant(object):
+    """
+    A dictionary API for a set of Tokyo Tyrant servers.
+
+    :param servers: a list of servers. Each item is either a ``(host, port)``
+        or ``(host, port, weight)`` tuple, or an existing
+        :class:`~pyrant.Tyrant` instance (optionally as a ``(tyrant, weight)``
+        tuple), e.g. one built on a :class:`~pyrant.pool.TyrantPool`.
+    :param separator: see :class:`~pyrant.Tyrant`.
+    :param literal: see :class:`~pyrant.Tyrant`.
+    :param replicas: number of virtual nodes per server (see
+        :class:`HashRing`).
+
+    All servers are expected to have the same database type.
+
+    .. note:: like :class:`~pyrant.Tyrant` itself, the object is not
+        thread-safe unless the shards are built on connection pools.
+
+    """
+
+    def __init__(self, servers, separator=None, literal=False, replicas=160):
+        # imported here to avoid circular import
+        from pyrant import Tyrant
+
+        self.shards = {}
+        weights = {}
+        for server in servers:
+            weight = 1
+            if isinstance(server, tuple):
+                if isinstance(server[0], basestring):
+                    # (host, port) or (host, port, weight)
+                    host, port = server[:2]
+                    if 2 < len(server):
+                        weight = server[2]
+                    server = Tyrant(host, port, separator=separator,
+                                    literal=literal)
+                else:
+                    server, weight = server
+            name = '%s:%s' % (server.proto.host, server.proto.port)
+            assert name not in self.shards, 'duplicate server %s' % name
+            self.shards[name] = server
+            weights[name] = weight
+        self.ring = HashRing(weights, replicas=replicas)
+
+    def __contains__(self, key):
+        return key in self.get_shard(key)
+
+    def __delitem__(self, key):
+        del self.get_shard(key)[key]
+
+    def __getitem__(self, key):
+        return self.get_shard(key)[key]
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        return sum(self._run_all(len))
+
+    def __repr__(self):
+        return u'<ShardedTyrant %s>' % ', '.join(sorted(self.shards))
+
+    def __setitem__(self, key, value):
+        self.get_shard(key)[key] = value
+
+    def _run_all(self, func, *args):
+        # calls func(shard, *args) on each shard concurrently
+        return run_parallel((func, (shard,) + args)
+                            for shard in self.shards.itervalues())
+
+    def _group(self, keys):
+        # splits keys by shard, preserving their order
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_node(key), []).append(key)
+        return groups
+
+    @property
+    def db_type(self):
+        return self.shards.itervalues().next().db_type
+
+    @property
+    def table_enabled(self):
+        return self.shards.itervalues().next().table_enabled
+
+    def get_shard(self, key):
+        """
+        Returns the :class:`~pyrant.Tyrant` instance responsible for `key`.
+        """
+        return self.shards[self.ring.get_node(key)]
+
+    def get(self, key, default=None):
+        return self.get_shard(key).get(key, default)
+
+    def get_size(self, key):
+        return self.get_shard(key).get_size(key)
+
+    def has_key(self, key):
+        return key in self
+
+    def clear(self):
+        """
+        Removes all records from all servers.
+        """
+        self._run_all(lambda shard: shard.clear())
+
+    def concat(self, key, value, width=None):
+        return self.get_shard(key).concat(key, value, width)
+
+    def setdefault(self, key, value):
+        return self.get_shard(key).setdefault(key, value)
+
+    def sync(self):
+        self._run_all(lambda shard: shard.sync())
+
+    def iterkeys(self):
+        """
+        Iterates keys of all servers, one server after another.
+        """
+        return itertools.chain(*[shard.iterkeys()
+                                 for shard in self.shards.itervalues()])
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def iteritems(self):
+        return itertools.chain(*[shard.iteritems()
+                                 for shard in self.shards.itervalues()])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def itervalues(self):
+        for k, v in self.iteritems():
+            yield v
+
+    def values(self):
+        return list(self.itervalues())
+
+    def prefix_keys(self, prefix, maxkeys=None):
+        """
+        Returns keys starting with `prefix` from all servers.
+        """
+        keys = self._run_all(lambda shard: shard.prefix_keys(prefix, maxkeys))
+        keys = list(itertools.chain(*keys))
+        return keys if maxkeys is None else keys[:maxkeys]
+
+    def update(self, mapping=None, **kwargs):
+        data = dict(mapping or {}, **kwargs)
+        self.multi_set(data)
+
+    def multi_del(self, keys, no_update_log=False):
+        """
+        Removes given records. Keys are split by server and removed
+        concurrently.
+        """
+        groups = self._group(keys)
+        run_parallel((self.shards[name].multi_del, (group, no_update_log))
+                     for name, group in groups.iteritems())
+
+    def multi_get(self, keys):
+        """
+        Returns records that match given keys as key/value pairs in the order
+        of the keys. Missing keys are silently ignored. Keys are split by
+        server and the parts are fetched concurrently.
+        """
+        assert hasattr(keys, '__iter__'), 'expected iterable, got %s' % keys
+        keys = list(keys)
+        groups = self._group(keys)
+        names = list(groups)
+        results = run_parallel((self.shards[name].multi_get, (groups[name],))
+                               for name in names)
+        found = {}
+        for pairs in results:
+            for key, value in pairs:
+                found[utils.to_bytes(key)] = key, value
+        return [found[k] for k in (utils.to_bytes(key) for key in keys) if k in found]
+
+    @property
+    def query(self):
+        """
+        Returns a :class:`ShardedQuery` for the servers.
+
+        .. note:: Only available for Table Databases.
+
+        """
+        return ShardedQuery([shard.query for shard in self.shards.itervalues()])
+
+    def multi_set(self, items, no_update_log=False):
+        """
+        Stores given records (a dictionary or a sequence of key/value pairs).
+        Records are split by server and stored concurrently.
+        """
+        if isinstance(items, dict):
+            items = items.iteritems()
+        groups = {}
+        for key, value in items:
+            groups.setdefault(self.ring.get_node(key), []).append((key, value))
+        run_parallel((self.shards[name].multi_set, (group, no_update_log))
+                     for name, group in groups.iteritems())
+
+
+class _Reversed(object):
+    # inverts comparison of wrapped values (for descending string order)
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def _make_sort_key(ordering):
+    """
+    Returns a function which extracts the sort key from a ``(key, record)``
+    pair according to given :class:`~pyrant.query.Ordering` (or `None` if the
+    ordering is not defined). Mimics the way Tokyo Cabinet compares values.
+    """
+    if not ordering:
+        return None
+    name = ordering.name
+    descending = ordering.direction == Ordering.DESC
+    if ordering.method == Ordering.NUMERIC:
+        def get_key(item):
+            try:
+                value = float(item[1].get(name) or 0)
+            except (TypeError, ValueError):
+                value = 0.0
+            return -value if descending else value
+    else:
+        def get_key(item):
+            value = item[1].get(name) or ''
+            return _Reversed(value) if descending else value
+    return get_key
+
+
+def _merge(iterables, get_key):
+    """
+    Merges given iterables of pre-sorted items into a single sorted iterator.
+    If `get_key` is `None`, the iterables are simply chained.
+    """
+    if get_key is None:
+        return itertools.chain(*iterables)
+
+    def decorate(index, iterable):
+        # the indices keep the merge stable and never compare the items
+        for number, item in enumerate(iterable):
+            yield get_key(item), index, number, item
+
+    decorated = [decorate(i, x) for i, x in enumerate(iterables)]
+    return (item for _, _, _, item in heapq.merge(*decorated))
+
+
+class ShardedQuery(object):
+    """
+    Executes the same query on all shards of a :class:`ShardedTyrant` and
+    merges the results. Provides the interface of
+    :class:`~pyrant.query.Query`; you will normally get an instance via
+    :attr:`ShardedTyrant.query`.
+
+    Each shard sorts its part of the results according to
+    :meth:`~pyrant.query.Query.order_by`, so the parts are combined with a
+    k-way merge. When a slice is requested, only the first `stop` items are
+    requested from each shard.
+
+    :param queries: a list of :class:`~pyrant.query.Query` instances, one per
+        shard.
+    """
+
+    def __init__(self, queries):
+        self._queries = queries
+
+    def __and__(self, other):
+        return self.intersect(other)
+
+    def __contains__(self, key):
+        return any(run_parallel((q.__contains__, (key,))
+                                for q in self._queries))
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self._get_slice(k)
+        elif isinstance(k, (int, long)):
+            if k < 0:
+                raise ValueError('Negative indexing is not supported')
+            items = self._get_slice(slice(k, k + 1))
+            if not items:
+                raise IndexError
+            return items[0]
+        else:
+            raise TypeError("Query indices must be integers")
+
+    def __iter__(self):
+        return _merge([iter(q) for q in self._queries], self._sort_key)
+
+    def __len__(self):
+        return sum(run_parallel((len, (q,)) for q in self._queries))
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __repr__(self):
+        return str(self[:])
+
+    def __sub__(self, other):
+        return self.minus(other)
+
+    def _get_slice(self, s):
+        for x in s.start, s.stop:
+            if x is not None and x < 0:
+                raise ValueError('Negative indexing is not supported')
+        start = s.start or 0
+        # each shard may hold all of the requested items
+        parts = run_parallel((q.__getitem__, (slice(0, s.stop),))
+                             for q in self._queries)
+        merged = _merge(parts, self._sort_key)
+        return list(itertools.islice(merged, start, s.stop))
+
+    def _map(self, method, *args, **kwargs):
+        return ShardedQuery([getattr(q, method)(*args, **kwargs)
+                             for q in self._queries])
+
+    def _combine(self, method, other):
+        assert isinstance(other, ShardedQuery), (
+            'Expected ShardedQuery instance, got %s' % other)
+        assert len(self._queries) == len(other._queries)
+        return ShardedQuery([getattr(q, method)(o) for q, o in
+                             zip(self._queries, other._queries)])
+
+    @property
+    def _sort_key(self):
+        return _make_sort_key(self._queries[0]._ordering)
+
+    def columns(self, *names):
+        """
+        See :meth:`pyrant.query.Query.columns`. The results are merged
+        according to the ordering if the ordering column is requested.
+        """
+        parts = run_parallel((q.columns, names) for q in self._queries)
+        get_key = self._sort_key
+        ordering = self._queries[0]._ordering
+        if get_key is None or ordering.name not in names:
+            return list(itertools.chain(*parts))
+        pairs = [[(None, x) for x in part] for part in parts]
+        return [x for _, x in _merge(pairs, get_key)]
+
+    def count(self):
+        """
+        Returns the number of matched items on all shards.
+        """
+        return sum(run_parallel((q.count, ()) for q in self._queries))
+
+    def delete(self, quick=False):
+        """
+        Deletes all matched items from all shards. See
+        :meth:`pyrant.query.Query.delete`.
+        """
+        results = run_parallel((q.delete, (quick,)) for q in self._queries)
+        if None in results:
+            return None
+        return all(results)
+
+    def exclude(self, *args, **kwargs):
+        return self._map('exclude', *args, **kwargs)
+
+    def filter(self, *args, **kwargs):
+        return self._map('filter', *args, **kwargs)
+
+    def hint(self):
+        """
+        Returns the list of hint strings, one per shard.
+        """
+        return run_parallel((q.hint, ()) for q in self._queries)
+
+    def intersect(self, other):
+        return self._combine('intersect', other)
+
+    def minus(self, other):
+        return self._combine('minus', other)
+
+    def order_by(self, name, numeric=False):
+        return self._map('order_by', name, numeric)
+
+    def set_chunk_size(self, size=None):
+        for q in self._queries:
+            q.set_chunk_size(size)
+
+    def stat(self):
+        collected = {}
+        for part in run_parallel((q.stat, ()) for q in self._queries):
+            for k, v in part.iteritems():
+                collected[k] = collected.get(k, 0) + v
+        return collected
+
+    def union(self, other):
+        return self._combine('union', other)
+
+    def values(self, key):
+        parts = run_parallel((q.values, (key,)) for q in self._queries)
+        return list(set(itertools.chain(*parts)))
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import warnings
-from pyrant.protocol import DB_TABLE, TABLE_COLUMN_SEP
+from pyrant.protocol import DB_TABLE, ENCODING, TABLE_COLUMN_SEP
 
 
 def pairwise(elems):
@@ -23,6 +23,16 @@ def pairwise(elems):
     for i in xrange(0, len(elems), 2):
         yield elems[i], elems[i+1]
 
+def to_bytes(key):
+    """
+    Returns given key as a byte string, encoded the same way as it is sent to
+    the server. Useful to compare keys given by the user with keys returned
+    by the server (which are Unicode unless `literal` is set).
+    """
+    if isinstance(key, unicode):
+        return key.encode(ENCODING)
+    return str(key)
+
 def from_python(value):
     """
     Returns value prepared for storage. This is required for search because
@@ -55,7 +65,7 @@ def from_python(value):
         ''
 
     Note that we don't convert the value to bytes here, it's done by
-    pyrant.protocol._pack.
+    pyrant.protocol._pack_segments.
     """
     if value is None:
         return ''
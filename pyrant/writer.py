@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Write-behind buffering.
+
+Each assignment to :class:`~pyrant.Tyrant` is a round trip to the server. A
+:class:`BufferedWriter` collects assignments and deletions and sends them in
+batches of `putlist` and `outlist` commands::
+
+    with t.buffered(max_items=500) as w:
+        w['foo'] = {'name': 'Foo'}
+        w['bar'] = {'name': 'Bar'}
+        del w['bar']        # only the deletion of 'bar' is sent
+
+Only the last operation for each key is sent: a deletion cancels a pending
+assignment to the same key and repeated assignments replace each other.
+Pending operations are sent when:
+
+* the number of pending keys reaches `max_items`;
+* their approximate size reaches `max_bytes`;
+* the oldest of them is `max_delay` seconds old (checked by a background
+  thread);
+* :meth:`BufferedWriter.flush` or :meth:`BufferedWriter.close` is called,
+  or the ``with`` block is left.
+
+.. note:: pending operations are not visible to reads until they are sent.
+
+.. note:: if `max_delay` is set, batches are sent from a background thread.
+    Unless the :class:`~pyrant.Tyrant` instance is built on a
+    :class:`~pyrant.pool.TyrantPool`, it must not be used directly while the
+    writer is open.
+
+"""
+
+import collections
+import sys
+import threading
+import time
+
+import protocol
+import utils
+
+
+__all__ = ['BufferedWriter']
+
+
+# marks a pending deletion
+_DELETE = object()
+
+
+class BufferedWriter(object):
+    """
+    Collects writes to a :class:`~pyrant.Tyrant` instance and sends them in
+    batches. You will normally get an instance via
+    :meth:`pyrant.Tyrant.buffered`.
+
+    :param tyrant: a :class:`~pyrant.Tyrant` instance.
+    :param max_items: maximum number of pending keys.
+    :param max_bytes: maximum approximate size of pending keys and values.
+    :param max_delay: maximum number of seconds an operation may stay pending.
+        Default is `None` (no limit).
+    :param no_update_log: if True, the batches are not written to the update
+        log (and thus not replicated).
+    """
+
+    def __init__(self, tyrant, max_items=1000, max_bytes=1024 * 1024,
+                 max_delay=None, no_update_log=False):
+        self.tyrant = tyrant
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.opts = no_update_log and protocol.TyrantProtocol.RDBMONOULOG or 0
+
+        self._pending = collections.OrderedDict()
+        self._size = 0
+        self._since = None        # time of the oldest pending operation
+        self._error = None        # an error raised in the background thread
+        self._closed = False
+        self._cond = threading.Condition()
+        # batches are sent one at a time, in order
+        self._send_lock = threading.Lock()
+        self._thread = None
+        if max_delay is not None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.setDaemon(True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __delitem__(self, key):
+        self._add(key, _DELETE)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __repr__(self):
+        return u'<BufferedWriter for %s: %d pending>' % (self.tyrant,
+                                                          len(self._pending))
+
+    def __setitem__(self, key, value):
+        self._add(key, self._prepare(value))
+
+    def _prepare(self, value):
+        # the same conversion as done by Tyrant.__setitem__
+        if isinstance(value, dict):
+            if not all(unicode(k) for k in value):
+                raise KeyError('Empty keys are not allowed (%s).' % repr(value))
+            # the columns are joined here, so byte strings and Unicode must
+            # not be mixed
+            pairs = ((k, utils.from_python(v)) for k, v in value.iteritems())
+            return protocol.TABLE_COLUMN_SEP.join(utils.to_bytes(x)
+                                                  for pair in pairs
+                                                  for x in pair)
+        if isinstance(value, (list, tuple)):
+            assert self.tyrant.separator, 'Separator is not set'
+            return utils.to_bytes(self.tyrant.separator).join(
+                utils.to_bytes(x) for x in value)
+        return value
+
+    def _add(self, key, value):
+        self._cond.acquire()
+        try:
+            assert not self._closed, 'writer is closed'
+            self._raise_error()
+            old = self._pending.pop(key, None)
+            if old is not None:
+                self._size -= len(key) + (0 if old is _DELETE else len(old))
+            self._pending[key] = value
+            self._size += len(key) + (0 if value is _DELETE else len(value))
+            if self._since is None:
+                self._since = time.time()
+                self._cond.notify()
+            full = (self.max_items <= len(self._pending) or
+                    self.max_bytes <= self._size)
+        finally:
+            self._cond.release()
+        if full:
+            self.flush()
+
+    def _raise_error(self):
+        # must be called with the lock acquired
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+    def _take(self):
+        # must be called with the lock acquired
+        pending = self._pending
+        self._pending = collections.OrderedDict()
+        self._size = 0
+        self._since = None
+        return pending
+
+    def _send(self, pending):
+        proto = self.tyrant.proto
+        puts = []
+        outs = []
+        for key, value in pending.iteritems():
+            if value is _DELETE:
+                outs.append(key)
+            else:
+                puts.extend((key, value))
+        try:
+            if outs:
+                proto.misc('outlist', outs, self.opts)
+            if puts:
+                proto.misc('putlist', puts, self.opts)
+        except:
+            # keep the operations that have not been superseded meanwhile
+            self._cond.acquire()
+            try:
+                for key, value in pending.iteritems():
+                    if key not in self._pending:
+                        self._pending[key] = value
+                        self._size += len(key) + (
+                            0 if value is _DELETE else len(value))
+                if self._pending and self._since is None:
+                    self._since = time.time()
+            finally:
+                self._cond.release()
+            raise
+        finally:
+            self.tyrant._invalidate(pending.keys())
+
+    def _run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                if self._closed:
+                    return
+                if self._since is None:
+                    self._cond.wait()
+                    continue
+                remaining = self._since + self.max_delay - time.time()
+                if 0 < remaining:
+                    self._cond.wait(remaining)
+                    continue
+            finally:
+                self._cond.release()
+            try:
+                self._flush()
+            except Exception:
+                # reported by the next call; the batch is retried after
+                # max_delay
+                self._cond.acquire()
+                self._error = sys.exc_info()
+                self._cond.release()
+            else:
+                self._error = None
+
+    def _flush(self):
+        self._send_lock.acquire()
+        try:
+            self._cond.acquire()
+            try:
+                pending = self._take()
+            finally:
+                self._cond.release()
+            if pending:
+                self._send(pending)
+        finally:
+            self._send_lock.release()
+
+    def flush(self):
+        """
+        Sends all pending operations.
+        """
+        self._cond.acquire()
+        try:
+            self._raise_error()
+        finally:
+            self._cond.release()
+        self._flush()
+
+    def close(self):
+        """
+        Sends all pending operations and stops the background thread. The
+        writer cannot be used after that.
+        """
+        try:
+            self.flush()
+        finally:
+            self._cond.acquire()
+            try:
+                self._closed = True
+                self._cond.notify()
+            finally:
+                self._cond.release()
+            if (self._thread is not None and
+                self._thread is not threading.currentThread()):
+                self._thread.join()